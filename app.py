@@ -1,13 +1,18 @@
 ### TO DO: Flask app
 
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify, session, g
-from interview.main import InterviewAgent
+from flask import Flask, Response, render_template, request, jsonify, session, g, stream_with_context
+from interview.agents import runtime
+from interview.evaluations import EvaluationWorker
+from interview.main import INTERVIEW_MODEL, InterviewAgent
 from interview.agents.utils import Termination
-from match.matcher import Matcher
+from interview.store import create_store
+from match.registry import get_matcher, preload
+from metrics import exposition, span
 import json
 import os
 import pickle
+import uuid
 
 load_dotenv()
 app = Flask(__name__)
@@ -17,21 +22,72 @@ app.secret_key = os.getenv("SECRET_KEY")
 NAME = "John Doe"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+MATCH_DATA = "match/data.csv" # Relative Path for the Data For Now
+STORE = create_store(os.getenv("INTERVIEW_STORE", "memory://")) # eg. sqlite:///interviews.db or redis://localhost:6379/0 with several workers
+EVALUATIONS = EvaluationWorker(STORE, OPENAI_API_KEY, model = INTERVIEW_MODEL or "GPT") # Updates the evaluations off the request path
 
+preload([MATCH_DATA]) # Load the model before gunicorn forks the workers (see gunicorn.conf.py)
+
+
+def new_state() -> dict:
+    """Return the state of a new interview."""
+
+    return {
+        'name': NAME,
+        'evaluator_history': None,
+        'questioner_history': None,
+        'criticizer_history': None,
+        'history': None,
+        'question_counter': 0
+    }
+
+def load_state() -> tuple:
+    """Load the state of the interview whose id is in the session cookie, and its evaluation snapshot, from the server-side STORE
+    in one round trip. Starts a new interview if there is none."""
+
+    interview_id = session.get('interview_id')
+    state = snapshot = None
+    if interview_id:
+        with span("session_load"):
+            state, snapshot = EVALUATIONS.load(interview_id)
+
+    if state is None:
+        session['interview_id'] = str(uuid.uuid4())
+        state, snapshot = new_state(), None
+
+    return state, snapshot
+
+def save_state(state: dict) -> None:
+    """Save the state of the interview in the server-side STORE (memory, SQLite or Redis, see interview/store.py).
+    The session cookie only carries the interview id."""
+
+    with span("session_save"):
+        STORE.save(session['interview_id'], state)
+
+def build_agent(state: dict, snapshot: dict = None) -> InterviewAgent:
+    """Rebuild the InterviewAgent from the state of an interview and its evaluation snapshot."""
+
+    with span("agent_build"):
+        return InterviewAgent(
+            state['name'], 
+            OPENAI_API_KEY,
+            ANTHROPIC_API_KEY,
+            question_counter=state['question_counter'],
+            user_history=state['history'],
+            criticizer_history=state['criticizer_history'],
+            questioner_history=state['questioner_history'],
+            evaluator_history=state['evaluator_history'],
+            evaluations=EVALUATIONS,
+            interview_id=session['interview_id'],
+            evaluation_snapshot=snapshot
+        )
 
 @app.route('/')
 def home() -> None:
     """Render the initial template."""
 
-    session['name'] = NAME
-    session['openai'] = OPENAI_API_KEY
-    session['anthropic'] = ANTHROPIC_API_KEY
-    session['evaluator_history'] = None
-    session['questioner_history'] = None
-    session['criticizer_history'] = None
-    session['evaluation'] = "A person who is trying to find meaningful work."
-    session['history'] = None
-    session['question_counter'] = 0
+    session['interview_id'] = str(uuid.uuid4()) # The cookie only carries the interview id
+    save_state(new_state())
 
     return render_template('index.html')
 
@@ -40,56 +96,162 @@ def get_response() -> json:
     """Get a response and generate a question."""
 
     message = request.form["message"]
-    interview_agent = InterviewAgent(
-        session['name'], 
-        session['openai'],
-        session['anthropic'],
-        question_counter=session['question_counter'],
-        user_history=session['history'],
-        criticizer_history=session['criticizer_history'],
-        questioner_history=session['questioner_history'],
-        evaluator_history=session['evaluator_history']
-    )
-
-    interview_agent.evaluator.replace_evaluation(session['evaluation']) # Replace Evaluation
-    interview_agent.question_counter = session['question_counter'] # Question Counter replacing
-
-    response = interview_agent.get_response(message)
-
-    # Update Session Data
+    state, snapshot = load_state()
+    interview_agent = build_agent(state, snapshot)
+
+    interview_agent.question_counter = state['question_counter'] # Question Counter replacing
+
+    with span("turn"):
+        response = runtime.run(interview_agent.aget_response(message)) # Concurrent LLM calls on the shared event loop
+
+    # Update Interview State
     data = interview_agent.prepare_serialization()
-    session['name'] = NAME
-    session['openai'] = OPENAI_API_KEY
-    session['anthropic'] = ANTHROPIC_API_KEY
-    session['evaluator_history'] = data['evaluator_history']
-    session['questioner_history'] = data['questioner_history']
-    session['criticizer_history'] = data['criticizer_history']
-    session['evaluation'] = interview_agent.evaluator.obtain_evaluation()
-    session['history'] = data['history']
-    session['question_counter'] = data['question_counter']
+    state.update(data)
+    save_state(state)
 
     return jsonify({"question": response})
 
+def sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event."""
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/stream_response', methods = ["POST"])
+def stream_response() -> Response:
+    """Get a response and stream the question as Server-Sent Events: a token event per chunk, then a done event with the whole question.
+    The interview state is saved once the question is complete."""
+
+    message = request.form["message"]
+    state, snapshot = load_state()
+    interview_agent = build_agent(state, snapshot)
+
+    interview_agent.question_counter = state['question_counter'] # Question Counter replacing
+
+    def events():
+        chunks = []
+        try:
+            with span("turn_stream"): # Until the last token is sent
+                for chunk in runtime.iterate(interview_agent.astream_response(message)): # Runs on the shared event loop
+                    chunks.append(chunk)
+                    yield sse("token", {"token": chunk})
+        except Exception as error:
+            app.logger.exception("The streamed response failed")
+            yield sse("error", {"error": str(error)})
+            return
+
+        # Update Interview State
+        data = interview_agent.prepare_serialization()
+        state.update(data)
+        save_state(state)
+
+        yield sse("done", {"question": "".join(chunks)})
+
+    return Response(stream_with_context(events()), mimetype = "text/event-stream", headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route('/get_match', methods = ["GET"])
 def get_match() -> json:
-    """Get a match based on the line of questioning."""
-
-    interview_agent = InterviewAgent(
-        session['name'], 
-        session['openai'],
-        session['anthropic'],
-        question_counter=session['question_counter'],
-        user_history=session['history'],
-        criticizer_history=session['criticizer_history'],
-        questioner_history=session['questioner_history'],
-        evaluator_history=session['evaluator_history']
-    )
+    """Get a match based on the line of questioning. The filterable columns of the schema can be given as query arguments, eg. ?sector=Healthcare"""
+
+    state, snapshot = load_state()
+    interview_agent = build_agent(state, snapshot) # The evaluation is the latest snapshot of the evaluation worker
 
     user_attributes = interview_agent.terminate_interview()
-    matcher = Matcher(user_attributes, "match/data.csv") # Relative Path for the Data For Now
-    matches = matcher.match() # Returns a dictionary of matches
+    matcher = get_matcher(MATCH_DATA) # Shared by every request in this process
+    filters = {column: request.args.getlist(column) for column in matcher.schema.filters if column in request.args}
+    with span("match"):
+        matches = matcher.match(user_attributes = user_attributes, filters = filters) # Returns a dictionary of matches
 
     return jsonify(matches)
 
+@app.route('/match_batch', methods = ["POST"])
+def match_batch() -> json:
+    """Match a list of impressions: {"impressions": [...], "maximum_count": 2, "filters": {"sector": "Healthcare"}}.
+    With "question_answers" (one question_answer per impression), the matches are reranked with the answers as in /get_match.
+    With "reverse": true, rank the impressions for each company instead (optionally only the companies in "ids")."""
+
+    body = request.get_json()
+    if not isinstance(body, dict) or not isinstance(body.get("impressions"), list):
+        return jsonify({"error": "The body must be a json object with a list of impressions."}), 400
+
+    try:
+        maximum_count = int(body.get("maximum_count", 2))
+    except (TypeError, ValueError):
+        maximum_count = 0
+    if maximum_count < 1:
+        return jsonify({"error": "The maximum_count must be a positive integer."}), 400
+    filters = body.get("filters") or {}
+    if not isinstance(filters, dict):
+        return jsonify({"error": "The filters must be a json object of column values, eg. {\"sector\": \"Healthcare\"}."}), 400
+    question_answers = body.get("question_answers")
+    if question_answers is not None and (not isinstance(question_answers, list) or len(question_answers) != len(body["impressions"])
+                                         or not all(isinstance(question_answer, dict) for question_answer in question_answers)):
+        return jsonify({"error": "The question_answers must be a list of json objects, one per impression."}), 400
+
+    impressions = [str(impression) for impression in body["impressions"]]
+    matcher = get_matcher(MATCH_DATA)
+
+    try:
+        if body.get("reverse"):
+            return jsonify({"companies": matcher.rank_candidates(impressions, maximum_count, body.get("ids"), filters)})
+
+        return jsonify({"matches": matcher.match_batch(impressions, maximum_count, filters, question_answers)})
+    except ValueError as error: # A filter on a column the schema does not declare
+        return jsonify({"error": str(error)}), 400
+
+def upsert(profiles: list) -> json:
+    """Upsert validated profiles, answering 400 if one cannot be written (eg. it has no id)."""
+
+    try:
+        count = get_matcher(MATCH_DATA).upsert(profiles)
+    except (TypeError, ValueError) as error:
+        return jsonify({"error": str(error)}), 400
+
+    return jsonify({"upserted": count})
+
+@app.route('/profiles', methods = ["POST"])
+def upsert_profiles() -> json:
+    """Add or update one profile, or a list of profiles, by id."""
+
+    profiles = request.get_json(silent = True)
+    if isinstance(profiles, dict):
+        profiles = [profiles]
+    if not isinstance(profiles, list) or not all(isinstance(profile, dict) for profile in profiles):
+        return jsonify({"error": "The body must be a json object or a list of json objects."}), 400
+
+    return upsert(profiles)
+
+@app.route('/profiles/<id>', methods = ["PUT"])
+def update_profile(id: str) -> json:
+    """Add or update the profile with this id."""
+
+    profile = request.get_json(silent = True)
+    if not isinstance(profile, dict):
+        return jsonify({"error": "The profile must be a json object."}), 400
+
+    profile[get_matcher(MATCH_DATA).schema.id_column] = int(id) if id.isdigit() else id
+
+    return upsert([profile])
+
+@app.route('/profiles/<id>', methods = ["DELETE"])
+def delete_profile(id: str) -> json:
+    """Remove the profile with this id."""
+
+    count = get_matcher(MATCH_DATA).delete([id])
+    if count == 0:
+        return jsonify({"error": f"No profile with the id {id}."}), 404
+
+    return jsonify({"deleted": count})
+
+@app.route('/metrics', methods = ["GET"])
+def metrics() -> Response:
+    """Export the stage timings, the LLM calls and the cache counters in the Prometheus format (see metrics.py)."""
+
+    try:
+        body, content_type = exposition()
+    except RuntimeError as error: # prometheus_client is not installed
+        return jsonify({"error": str(error)}), 501
+
+    return Response(body, content_type = content_type)
+
 if __name__ == "__main__":
     app.run()
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+The parity and speed check of the encoder backends (see MATCH_ENCODER in match/registry.py).
+
+Key Features:
+    - Encode the catalogue with each encoder and compare the embeddings with the torch encoder (mean and minimum cosine).
+    - Rank the catalogue against each of its own fields as queries, and compare the top k with the torch ranking (overlap and same first).
+    - Measure the latency of single queries (p50, p95) and the throughput of batch encoding.
+    - Exit with status 1 if an encoder falls below the parity thresholds (--min-cosine, --min-overlap), so that it gates a deploy.
+
+Usage: python -m benchmarks.encoder_parity --catalogue match/data.csv --encoders torch onnx int8 --output encoder_parity.json
+"""
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import pandas as pd
+from match.registry import ENCODERS, MODEL_NAME, get_model, model_id
+from match.schema import DEFAULT_SCHEMA
+from typing import Dict, List
+
+MIN_COSINE = 0.98 # The minimum cosine of any embedding with its torch embedding
+MIN_OVERLAP = 0.9 # The minimum mean overlap of the top k with the torch top k
+
+
+def catalogue_texts(csv_file: str) -> List[str]:
+    """Return the texts of the schema fields of the catalogue, row by row."""
+
+    dataset = pd.read_csv(csv_file)
+    fields = DEFAULT_SCHEMA.field_names()
+
+    return dataset[fields].fillna("").astype(str).values.ravel().tolist()
+
+def encode(id: str, texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """Return the normalized embeddings of the texts by a model."""
+
+    return np.asarray(get_model(id).encode(texts, batch_size = batch_size, normalize_embeddings = True), dtype = np.float32)
+
+def top_k(embeddings: np.ndarray, k: int) -> np.ndarray:
+    """Rank the texts against each other and return the indices of the top k of each, excluding itself."""
+
+    scores = embeddings @ embeddings.T
+    np.fill_diagonal(scores, -np.inf)
+
+    return np.argsort(-scores, axis = 1)[:, :k]
+
+def timing(id: str, texts: List[str], queries: int = 200, batch_size: int = 64) -> Dict:
+    """Measure the latency of single queries and the throughput of batches."""
+
+    model = get_model(id)
+    model.encode(texts[:batch_size], batch_size = batch_size) # Warm up
+
+    latencies = []
+    for text in (texts * (queries // len(texts) + 1))[:queries]:
+        start = time.perf_counter()
+        model.encode([text])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    model.encode(texts, batch_size = batch_size)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "throughput_per_s": len(texts) / elapsed
+    }
+
+def compare(csv_file: str, encoders: List[str], model: str = MODEL_NAME, k: int = 5, batch_size: int = 64) -> Dict:
+    """Return the parity and the timing of each encoder against the torch encoder.
+
+    Attributes:
+        - csv_file: The catalogue.
+        - encoders: The encoders to compare.
+        - model: The name of the Sentence Transformer model.
+        - k: The number of matches compared per query.
+        - batch_size: The number of texts encoded at once.
+    """
+
+    texts = catalogue_texts(csv_file)
+    reference = encode(model_id(model, "torch"), texts, batch_size)
+    reference_top = top_k(reference, k)
+
+    results = {}
+    for encoder in encoders:
+        id = model_id(model, encoder)
+        embeddings = encode(id, texts, batch_size)
+        cosines = np.sum(embeddings * reference, axis = 1)
+        ranked = top_k(embeddings, k)
+        overlap = [len(set(a) & set(b)) / k for a, b in zip(ranked, reference_top)]
+
+        results[encoder] = {
+            "model": id,
+            "mean_cosine": float(cosines.mean()),
+            "min_cosine": float(cosines.min()),
+            "top_k_overlap": float(np.mean(overlap)),
+            "same_first": float(np.mean(ranked[:, 0] == reference_top[:, 0])),
+            **timing(id, texts, batch_size = batch_size)
+        }
+
+    return {"catalogue": csv_file, "texts": len(texts), "k": k, "encoders": results}
+
+def failures(report: Dict, min_cosine: float = MIN_COSINE, min_overlap: float = MIN_OVERLAP) -> List[str]:
+    """Return a description of each encoder below the parity thresholds, or an empty list.
+
+    Attributes:
+        - report: The report of compare.
+        - min_cosine: The minimum cosine of any embedding with its torch embedding.
+        - min_overlap: The minimum mean overlap of the top k with the torch top k.
+    """
+
+    failed = []
+    for encoder, result in report["encoders"].items():
+        if result["min_cosine"] < min_cosine:
+            failed.append(f"{encoder}: min cosine {result['min_cosine']:.4f} < {min_cosine}")
+        if result["top_k_overlap"] < min_overlap:
+            failed.append(f"{encoder}: top {report['k']} overlap {result['top_k_overlap']:.4f} < {min_overlap}")
+
+    return failed
+
+
+def main() -> None:
+    """Parse the command line, compare the encoders and print the report."""
+
+    parser = argparse.ArgumentParser(prog = "python -m benchmarks.encoder_parity")
+    parser.add_argument("--catalogue", default = "match/data.csv")
+    parser.add_argument("--encoders", nargs = "+", default = list(ENCODERS), choices = list(ENCODERS))
+    parser.add_argument("--model", default = MODEL_NAME)
+    parser.add_argument("--top-k", type = int, default = 5)
+    parser.add_argument("--batch-size", type = int, default = 64)
+    parser.add_argument("--min-cosine", type = float, default = MIN_COSINE, help = "Fail if an embedding is below this cosine with torch.")
+    parser.add_argument("--min-overlap", type = float, default = MIN_OVERLAP, help = "Fail if the mean top k overlap with torch is below this.")
+    parser.add_argument("--output", help = "Also write the report to this json file.")
+    args = parser.parse_args()
+
+    report = compare(args.catalogue, args.encoders, args.model, args.top_k, args.batch_size)
+    print(json.dumps(report, indent = 2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+
+    failed = failures(report, args.min_cosine, args.min_overlap)
+    if failed:
+        print("Below the parity thresholds:\n  " + "\n  ".join(failed), file = sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+The load benchmark of the interview: full interviews driven through app.py at N concurrent sessions, with every agent on the fake LLM.
+
+Key Features:
+    - Run every agent on the fake LLM (see interview/agents/fake.py), with its latency and token rate distributions, so no API is paid for.
+    - Drive each session like the browser does: /, then one /get_response (or /stream_response) per answer, then optionally /get_match.
+    - Report the latency percentiles of each turn and of every turn, the throughput of the server and the errors.
+    - Measure the growth of the prompt tokens per turn on one calibration interview run alone before the load.
+    - Write the results as json.
+    - Drive a running server over HTTP instead (--url), eg. gunicorn started with INTERVIEW_MODEL=Fake.
+
+By default the app is imported in-process: each session has its own Flask test client (its own cookie) and runs in its own thread.
+This is an approximation of a deployment, not a measure of it: every session shares one process and its GIL, and there is no socket,
+no gunicorn worker or thread pool and no SSE framing by a real server. Use it to compare changes to the interview path; use --url to
+measure a deployment. Against a url the calibration and the fake LLM usage are skipped, since they read the counters of the process.
+The response cache is off by default, since the sessions send the same answers and would only hit it.
+
+Usage: python -m benchmarks.interview_bench --sessions 32 --turns 7 --fake "fake://echo?latency=lognormal:600:0.4&rate=normal:80:15"
+       INTERVIEW_MODEL=Fake INTERVIEW_CACHE=off gunicorn app:app & python -m benchmarks.interview_bench --url http://127.0.0.1:8000
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+from typing import Dict, List, Tuple
+
+ANSWERS = [
+    "I studied environmental engineering and I have been working on water treatment projects for three years.",
+    "What drives me is seeing communities get access to clean resources, I care a lot about fairness.",
+    "I would like to lead a small team one day and learn more about the business side of impact ventures.",
+    "Outside of work I volunteer at a food bank and I read a lot about circular economy models.",
+    "I work best in small teams where everyone owns a piece of the product and feedback is direct.",
+    "In five years I want to have built something that measurably reduces waste in my city.",
+    "I am also curious about healthcare access in rural areas, my family comes from a small village."
+]
+
+
+def configure(options: Dict) -> None:
+    """Set the environment of the app before it is imported: the fake model on every agent and the stores in memory."""
+
+    os.environ["INTERVIEW_MODEL"] = "Fake"
+    os.environ["INTERVIEW_FAKE_LLM"] = options["fake"]
+    os.environ["INTERVIEW_CACHE"] = options["cache"]
+    os.environ.setdefault("INTERVIEW_STORE", "memory://")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("ANTHROPIC_API_KEY", "fake")
+
+def percentiles(latencies: List[float]) -> Dict:
+    """Return the count and the p50, p95 and p99 of the latencies, in milliseconds."""
+
+    if not latencies:
+        return {"count": 0}
+
+    values = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+
+    return {"count": len(latencies), "p50_ms": float(values[0]), "p95_ms": float(values[1]), "p99_ms": float(values[2])}
+
+
+class Session:
+    """
+    The Session class, one interview driven through the test client of the app or over HTTP.
+
+    Attributes:
+        - url: The url of the server, or None to use the test client.
+        - client: The Flask test client, or the urllib opener, which keeps the cookie of the session.
+        - latencies: The latency of each turn, by turn.
+        - errors: The failed requests.
+    """
+
+    url: str
+    client: object
+    latencies: Dict[int, float]
+    errors: List[str]
+
+    def __init__(self, server: object = None, url: str = None) -> None:
+        """Open a new session on the app module, or on the server at url."""
+
+        self.url = url
+        if url is None:
+            self.client = server.app.test_client()
+        else:
+            self.client = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.latencies = {}
+        self.errors = []
+
+    def request(self, method: str, path: str, data: Dict = None) -> Tuple[int, str]:
+        """Send a request and return its status code and its whole body (0 if the server could not be reached)."""
+
+        if self.url is None:
+            response = self.client.open(path, method = method, data = data)
+            return response.status_code, response.get_data(as_text = True)
+
+        body = None if data is None else urllib.parse.urlencode(data).encode()
+        try:
+            with self.client.open(urllib.request.Request(self.url.rstrip("/") + path, data = body, method = method), timeout = 300) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read().decode()
+        except OSError as error:
+            return 0, str(error)
+
+    def interview_id(self) -> str:
+        """Return the id of the interview of the session."""
+
+        with self.client.session_transaction() as session:
+            return session.get("interview_id")
+
+    def turn(self, index: int, message: str, stream: bool) -> None:
+        """Send one message and time the whole response."""
+
+        start = time.perf_counter()
+        status, body = self.request("POST", "/stream_response" if stream else "/get_response", {"message": message}) # The whole event stream
+        failed = status != 200 or (stream and "event: error" in body)
+        self.latencies[index] = time.perf_counter() - start
+
+        if failed:
+            self.errors.append(f"turn {index}: {status}")
+
+    def run(self, turns: int, stream: bool, match: bool) -> None:
+        """Run a whole interview: the opening question, one turn per answer and optionally the match."""
+
+        self.request("GET", "/")
+        self.turn(0, "Start", stream)
+        for index in range(1, turns + 1):
+            self.turn(index, ANSWERS[(index - 1) % len(ANSWERS)], stream)
+
+        if match:
+            start = time.perf_counter()
+            status, _ = self.request("GET", "/get_match")
+            self.latencies["match"] = time.perf_counter() - start
+            if status != 200:
+                self.errors.append(f"match: {status}")
+
+
+def settle(server: object, session: Session, timeout: float = 60.0) -> None:
+    """Wait until the background work of a turn (the evaluation update and the pool refills) has finished."""
+
+    from interview.agents.fake import usage
+
+    pending = server.EVALUATIONS.pending.get(session.interview_id())
+    if pending is not None:
+        pending.result(timeout)
+
+    deadline = time.monotonic() + timeout
+    while usage()["active"] > 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def calibrate(server: object, turns: int) -> List[Dict]:
+    """Run one interview alone and return the fake LLM usage of each turn, background work included."""
+
+    from interview.agents.fake import usage
+
+    warm_up = Session(server)
+    warm_up.request("GET", "/")
+    warm_up.turn(0, "Start", False)
+    settle(server, warm_up) # The question pool fills up on the first turn of the process
+
+    session = Session(server)
+    session.request("GET", "/")
+
+    growth = []
+    for index in range(turns + 1):
+        before = usage()
+        session.turn(index, "Start" if index == 0 else ANSWERS[(index - 1) % len(ANSWERS)], False)
+        settle(server, session)
+        after = usage()
+        growth.append({
+            "turn": index,
+            "calls": after["calls"] - before["calls"],
+            "prompt_tokens": after["input_tokens"] - before["input_tokens"],
+            "completion_tokens": after["output_tokens"] - before["output_tokens"]
+        })
+
+    return growth
+
+def load(server: object, options: Dict) -> Dict:
+    """Run the sessions concurrently, on the app module or on the server at options["url"], and return the latencies and the throughput."""
+
+    sessions = [Session(server, options["url"]) for _ in range(options["sessions"])]
+    threads = [threading.Thread(target = session.run, args = (options["turns"], options["stream"], options["match"])) for session in sessions]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    turns = [latency for session in sessions for index, latency in session.latencies.items() if index != "match"]
+    by_turn = {str(index): percentiles([session.latencies[index] for session in sessions if index in session.latencies])
+               for index in range(options["turns"] + 1)}
+
+    return {
+        "elapsed_s": elapsed,
+        "turns": percentiles(turns),
+        "by_turn": by_turn,
+        "match": percentiles([session.latencies["match"] for session in sessions if "match" in session.latencies]),
+        "turns_per_s": len(turns) / elapsed,
+        "sessions_per_s": len(sessions) / elapsed,
+        "errors": [error for session in sessions for error in session.errors]
+    }
+
+
+def main() -> None:
+    """Parse the command line, run the calibration and the load, and write the report."""
+
+    parser = argparse.ArgumentParser(prog = "python -m benchmarks.interview_bench")
+    parser.add_argument("--sessions", type = int, default = 16, help = "The number of concurrent interviews.")
+    parser.add_argument("--turns", type = int, default = 6, help = "The number of answers per interview.")
+    parser.add_argument("--fake", default = "fake://echo?latency=lognormal:500:0.4&rate=normal:80:15", help = "The fake LLM url.")
+    parser.add_argument("--cache", default = "off", help = "The response cache url (INTERVIEW_CACHE).")
+    parser.add_argument("--stream", action = "store_true", help = "Use /stream_response instead of /get_response.")
+    parser.add_argument("--match", action = "store_true", help = "End each interview with /get_match.")
+    parser.add_argument("--url", help = "Drive the server at this url over HTTP instead of the app in-process. --fake and --cache are then "
+                                        "the server's to set (INTERVIEW_MODEL=Fake, INTERVIEW_FAKE_LLM and INTERVIEW_CACHE).")
+    parser.add_argument("--output", default = "interview_bench.json")
+    args = parser.parse_args()
+
+    options = vars(args)
+    if args.url:
+        report = {"options": options, "load": load(None, options)}
+    else:
+        configure(options)
+
+        import app as server # After the environment is set
+        from interview.agents.fake import usage
+
+        report = {"options": options, "prompt_growth": calibrate(server, args.turns)}
+        report["load"] = load(server, options)
+        report["usage"] = usage()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent = 2)
+
+    turns = report["load"]["turns"]
+    print(f"{turns['count']} turns, p50 {turns.get('p50_ms', 0):.0f} ms, p95 {turns.get('p95_ms', 0):.0f} ms, "
+          f"{report['load']['turns_per_s']:.1f} turns/s, {len(report['load']['errors'])} errors: {args.output}")
+    if report["load"]["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
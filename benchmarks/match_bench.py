@@ -0,0 +1,326 @@
+"""
+The benchmark of the match path: synthetic catalogues in the schema of match/data.csv, from 10 to 1M rows, matched with every backend.
+
+Key Features:
+    - Generate reproducible synthetic catalogues (id, name, values_summary, future_goals_and_interests, sector, location, stage) from a seed.
+    - Measure the index build time, the Matcher build time of each backend, the latency percentiles of single matches (p50, p95, p99),
+      the throughput of single and batched matches and the peak RSS.
+    - Run every case in a forked process, so that the peak RSS of one case does not carry over to the next.
+    - Encode with the configured Sentence Transformer, or with a hashing encoder that needs no model and isolates the search cost.
+    - Write the results as json, and compare them with a baseline to catch regressions (exit status 1).
+
+The catalogues and indexes are kept under --workdir, so a second run only pays for the sizes it has not built yet.
+The query cache is off by default, so that every query pays for its encoding as a first request would.
+
+Usage:
+    python -m benchmarks.match_bench --sizes 10 1000 100000 --encoder hashing --output match_bench.json
+    python -m benchmarks.match_bench --sizes 1000000 --backends brute ivf --baseline match_bench.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import zlib
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("MATCH_QUERY_CACHE", "off") # Before match.cache reads it
+
+from match.registry import register_model
+from typing import Dict, List
+
+SIZES = [10, 1000, 100000]
+BACKENDS = ["brute", "ivf", "vector_store", "calculate_cosine"]
+CHUNK_ROWS = 50000
+WORDS = """
+sustainability community innovation transparency healthcare education finance inclusion technology data privacy security climate
+recycling waste energy solar agriculture food supply chain logistics mobility housing affordable access digital platform ai research
+collaboration partnership growth scale impact diversity equity wellbeing mental health patients doctors farmers workers migrants
+students teachers learning skills training careers hiring talent remote culture values mission purpose trust integrity quality
+customers users experience design product engineering software hardware cloud analytics automation robotics biodiversity ocean water
+conservation circular economy carbon emissions renewable investment capital microfinance payments banking insurance retail commerce
+""".split()
+SECTORS = ["Healthcare", "Climate", "Fintech", "Education", "Agriculture", "Logistics", "Retail", "Software"]
+LOCATIONS = ["Singapore", "Malaysia", "Indonesia", "Vietnam", "Thailand", "Philippines"]
+STAGES = ["Seed", "Series A", "Series B", "Growth"]
+
+
+class HashingEncoder:
+    """
+    The HashingEncoder class, a stand-in for the Sentence Transformer which hashes the words of a text into a vector.
+
+    Attributes:
+        - dimension: The dimension of the vectors.
+        - codes: The bucket and sign of every word seen.
+    """
+
+    dimension: int
+    codes: Dict[str, tuple]
+
+    def __init__(self, dimension: int = 384) -> None:
+        """Initialize the HashingEncoder class."""
+
+        self.dimension = dimension
+        self.codes = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """Return the dimension of the vectors."""
+
+        return self.dimension
+
+    def encode(self, texts: List[str], batch_size: int = 32, normalize_embeddings: bool = False, **options) -> np.ndarray:
+        """Return the hashed vectors of the texts, shape (texts, dimension)."""
+
+        vectors = np.zeros((len(texts), self.dimension), dtype = np.float32)
+        for i, text in enumerate(texts):
+            for word in str(text).lower().split():
+                code = self.codes.get(word)
+                if code is None:
+                    hashed = zlib.crc32(word.encode())
+                    code = self.codes[word] = (hashed % self.dimension, 1.0 if hashed & 1 << 31 else -1.0)
+                vectors[i, code[0]] += code[1]
+        if normalize_embeddings:
+            vectors /= np.clip(np.linalg.norm(vectors, axis = 1, keepdims = True), 1e-12, None)
+
+        return vectors
+
+
+def sentences(rng: np.random.Generator, rows: int, words: int) -> List[str]:
+    """Return rows random texts of about the given number of words."""
+
+    picks = rng.integers(0, len(WORDS), size = (rows, words))
+
+    return [" ".join(WORDS[i] for i in pick) for pick in picks]
+
+def synthetic_catalogue(path: str, rows: int, seed: int = 0) -> str:
+    """Write a synthetic catalogue of rows companies in the schema of match/data.csv, unless it exists, and return its path.
+
+    Attributes:
+        - path: The csv filepath.
+        - rows: The number of companies.
+        - seed: The random seed, so that the same size always gives the same catalogue.
+    """
+
+    if os.path.exists(path):
+        return path
+
+    rng = np.random.default_rng(seed)
+    tmp = path + ".tmp"
+    for start in range(0, rows, CHUNK_ROWS):
+        count = min(CHUNK_ROWS, rows - start)
+        chunk = pd.DataFrame({
+            "id": np.arange(start + 1, start + count + 1),
+            "name": [f"Company {i}" for i in range(start + 1, start + count + 1)],
+            "values_summary": sentences(rng, count, 60),
+            "future_goals_and_interests": sentences(rng, count, 50),
+            "sector": rng.choice(SECTORS, count),
+            "location": rng.choice(LOCATIONS, count),
+            "stage": rng.choice(STAGES, count)
+        })
+        chunk.to_csv(tmp, mode = "w" if start == 0 else "a", header = start == 0, index = False)
+    os.replace(tmp, path)
+
+    return path
+
+def percentiles(latencies: List[float]) -> Dict:
+    """Return the p50, p95 and p99 of the latencies, in milliseconds."""
+
+    values = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+
+    return {"p50_ms": float(values[0]), "p95_ms": float(values[1]), "p99_ms": float(values[2])}
+
+def peak_rss_mb() -> float:
+    """Return the peak resident set size of the process, in MB."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024 # Bytes on macOS, kB on Linux
+
+
+def run_case(csv_file: str, backend: str, options: Dict) -> Dict:
+    """Build the Matcher of one backend over the catalogue and time its matches.
+
+    Attributes:
+        - csv_file: The catalogue, already indexed.
+        - backend: The backend, or calculate_cosine for the per-call scoring of match/utils.py.
+        - options: The parsed command line.
+    """
+
+    from match.matcher import Matcher
+    from match.utils import calculate_cosine
+
+    rng = np.random.default_rng(options["seed"] + 1)
+    impressions = sentences(rng, options["queries"], 40)
+    k = options["top_k"]
+    result = {"rss_start_mb": peak_rss_mb()}
+
+    start = time.perf_counter()
+    matcher = Matcher(csv_file = csv_file, backend = "brute" if backend == "calculate_cosine" else backend,
+                      backend_options = options["backend_options"].get(backend), model = options["model"], root = options["root"])
+    result["open_s"] = time.perf_counter() - start
+
+    if backend == "calculate_cosine":
+        profiles = pd.DataFrame({"row": np.arange(len(matcher.index))})
+        embeddings = np.asarray(matcher.index.embeddings)
+        search = lambda query: calculate_cosine(query, profiles, embeddings).nlargest(k, "Cosine")
+    else:
+        search = lambda query: matcher.backend.search(query, k)
+
+    matcher.match(k, {"impression": impressions[0]}) # Warm up
+    latencies, search_latencies = [], []
+    for impression in impressions:
+        start = time.perf_counter()
+        query = matcher._queries([impression])[0]
+        encoded = time.perf_counter()
+        search(query)
+        done = time.perf_counter()
+        latencies.append(done - start)
+        search_latencies.append(done - encoded)
+
+    result.update(percentiles(latencies))
+    result.update({f"search_{key}": value for key, value in percentiles(search_latencies).items()})
+    result["qps"] = len(latencies) / sum(latencies)
+
+    if backend != "calculate_cosine":
+        start = time.perf_counter()
+        matcher.match_batch(impressions, k)
+        result["batch_qps"] = len(impressions) / (time.perf_counter() - start)
+
+    result["peak_rss_mb"] = peak_rss_mb()
+
+    return result
+
+def _child(queue: multiprocessing.Queue, csv_file: str, backend: str, options: Dict) -> None:
+    """Run one case in the forked process and send back its result or its error."""
+
+    try:
+        queue.put(run_case(csv_file, backend, options))
+    except Exception as error:
+        queue.put({"error": repr(error)})
+
+def isolated(csv_file: str, backend: str, options: Dict) -> Dict:
+    """Run one case in a forked process."""
+
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target = _child, args = (queue, csv_file, backend, options))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    return result
+
+def benchmark(options: Dict) -> Dict:
+    """Generate, index and match every size with every backend, and return the report.
+
+    Attributes:
+        - options: The parsed command line.
+    """
+
+    from match.index import EmbeddingIndex
+
+    os.makedirs(options["workdir"], exist_ok = True)
+    results = []
+
+    for size in options["sizes"]:
+        start = time.perf_counter()
+        csv_file = synthetic_catalogue(os.path.join(options["workdir"], f"catalogue-{size}.csv"), size, options["seed"])
+        generate_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        EmbeddingIndex.open(csv_file, options["model"], options["root"]) # Builds the index on the first run only
+        build_s = time.perf_counter() - start
+
+        for backend in options["backends"]:
+            if backend == "calculate_cosine" and size > options["legacy_limit"]:
+                continue
+
+            result = {"size": size, "backend": backend, "generate_s": generate_s, "build_s": build_s}
+            result.update(isolated(csv_file, backend, options))
+            results.append(result)
+            print(json.dumps(result), file = sys.stderr)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "encoder": options["encoder"],
+            "model": options["model"],
+            "queries": options["queries"],
+            "top_k": options["top_k"]
+        },
+        "results": results
+    }
+
+def regressions(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Return the cases whose p95 latency or peak RSS grew more than tolerance over the baseline.
+
+    Attributes:
+        - report: The new report.
+        - baseline: The report to compare with.
+        - tolerance: The allowed relative growth, eg. 0.2 for 20%.
+    """
+
+    previous = {(result["size"], result["backend"]): result for result in baseline["results"]}
+    found = []
+
+    for result in report["results"]:
+        old = previous.get((result["size"], result["backend"]))
+        if old is None or "error" in result or "error" in old:
+            continue
+        for metric in ("p95_ms", "search_p95_ms", "peak_rss_mb"):
+            if metric in old and result[metric] > old[metric] * (1 + tolerance):
+                found.append(f"{result['backend']} at {result['size']} rows: {metric} {old[metric]:.2f} -> {result[metric]:.2f}")
+
+    return found
+
+
+def main() -> None:
+    """Parse the command line, run the benchmark and write the report."""
+
+    parser = argparse.ArgumentParser(prog = "python -m benchmarks.match_bench")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = SIZES)
+    parser.add_argument("--backends", nargs = "+", default = BACKENDS, choices = BACKENDS)
+    parser.add_argument("--backend-options", type = json.loads, default = {}, help = 'The options of each backend, eg. {"ivf": {"n_probe": 16}}')
+    parser.add_argument("--encoder", default = "model", choices = ["model", "hashing"], help = "The Sentence Transformer, or the hashing stand-in.")
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--top-k", type = int, default = 5)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--legacy-limit", type = int, default = 100000, help = "The largest size calculate_cosine is measured at.")
+    parser.add_argument("--workdir", default = "benchmarks/.data")
+    parser.add_argument("--output", default = "match_bench.json")
+    parser.add_argument("--baseline", help = "A previous report: exit with status 1 if a case regressed.")
+    parser.add_argument("--tolerance", type = float, default = 0.2)
+    args = parser.parse_args()
+
+    options = dict(vars(args), root = os.path.join(args.workdir, "index"))
+    if args.encoder == "hashing":
+        options["model"] = "hashing"
+        register_model("hashing", HashingEncoder())
+    else:
+        from match.registry import MODEL_ID
+        options["model"] = MODEL_ID
+
+    report = benchmark(options)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent = 2)
+    print(f"{len(report['results'])} cases: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}", file = sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
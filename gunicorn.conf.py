@@ -0,0 +1,36 @@
+"""
+The gunicorn configuration, eg. gunicorn app:app
+
+The app is imported once in the master, which loads the Sentence Transformer and the match index before the workers are forked.
+The workers then share those pages copy-on-write, and each one warms up before it accepts requests.
+With PROMETHEUS_MULTIPROC_DIR set, /metrics aggregates the metrics of every worker (see metrics.py).
+"""
+
+import gc
+import os
+
+preload_app = True
+worker_class = "gthread" # A turn mostly waits on the LLM calls of the shared event loop, so each worker serves several at once
+threads = 8
+
+
+def pre_fork(server, worker) -> None:
+    """Move the preloaded objects out of the garbage collector, so that collections do not copy their pages."""
+
+    gc.freeze()
+
+def post_fork(server, worker) -> None:
+    """Warm up the model and the Matcher in the worker."""
+
+    from app import MATCH_DATA
+    from match.registry import warm_up
+
+    warm_up([MATCH_DATA])
+
+def child_exit(server, worker) -> None:
+    """Mark the metrics of a dead worker, so that its gauges are dropped from /metrics."""
+
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
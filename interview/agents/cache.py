@@ -0,0 +1,352 @@
+"""
+The response cache of the agents, which answers repeated LLM calls without going to the network.
+
+Key Features:
+    - Exact keys: a response is keyed by the model, the temperature and the rendered messages sent.
+    - Semantic lookup (optional): a call whose context matches and whose last message is close enough to a cached one reuses its response.
+    - LRU eviction over a capacity, and a TTL after which a response is not reused.
+    - SQLite persistence, so that the cache is shared by the gunicorn workers of a machine and survives restarts.
+    - Hit and miss counters (see ResponseCache.stats).
+
+The cache is picked by url with create_cache, eg. memory://?capacity=4096, sqlite:///responses.db?ttl=604800 or off.
+Every url takes ?ttl=<seconds>, ?similarity=<cosine> to turn the semantic lookup on, and ?scope=all to also cache the agents which sample
+(by default only the deterministic, temperature 0, agents are cached since their responses do not vary).
+
+Note that the default scope follows the temperature of the client, not the prompt: with the GPT model the Questioner samples at 1.0, so
+only the Evaluator is cached and the opening and scripted questions still go to the network. Set ?scope=all to cache them too, at the
+cost of asking every candidate the same sampled question for the same context.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+
+def _digest(value: object) -> str:
+    """Return the sha256 of the json of a value."""
+
+    return hashlib.sha256(json.dumps(value, ensure_ascii = False).encode()).hexdigest()
+
+def _default_encoder() -> Callable[[str], np.ndarray]:
+    """Return the Sentence Transformer encoder of the semantic lookup, sharing the model of match.registry on the first call."""
+
+    model = None
+
+    def encode(text: str) -> np.ndarray:
+        nonlocal model
+        if model is None:
+            from match.registry import get_model
+            model = get_model() # The model of the matcher (MATCH_ENCODER), so that a worker loads it once
+
+        return model.encode(text, normalize_embeddings = True)
+
+    return encode
+
+
+class ResponseCache:
+    """
+    The ResponseCache class, which keeps the most recently used responses in memory and, optionally, in a SQLite database.
+
+    Attributes:
+        - capacity: The maximum number of responses kept in memory.
+        - ttl: The number of seconds a response is reused after it was stored.
+        - path: The filepath of the SQLite database, or None to keep the responses in memory only.
+        - similarity: The minimum cosine between the last messages of a semantic hit, or None to only use exact keys.
+        - scope: "deterministic" to only cache temperature 0 calls, or "all".
+        - hits, semantic_hits, misses: The counters of the lookups.
+    """
+
+    capacity: int
+    ttl: int
+    path: Optional[str]
+    similarity: Optional[float]
+    scope: str
+    hits: int
+    semantic_hits: int
+    misses: int
+
+    def __init__(self, capacity: int = 4096, ttl: int = DEFAULT_TTL, path: str = None, similarity: float = None,
+                 scope: str = "deterministic", encoder: Callable[[str], np.ndarray] = None) -> None:
+        """Initialize the ResponseCache.
+
+        Attributes:
+            - capacity: The maximum number of responses kept in memory.
+            - ttl: The number of seconds a response is reused after it was stored.
+            - path: The filepath of the SQLite database, or None to keep the responses in memory only.
+            - similarity: The minimum cosine between the last messages of a semantic hit, or None to only use exact keys.
+            - scope: "deterministic" to only cache temperature 0 calls, or "all".
+            - encoder: The text encoder of the semantic lookup. Defaults to a Sentence Transformer.
+        """
+
+        if scope not in ("deterministic", "all"):
+            raise ValueError("The cache scope must be: deterministic or all!")
+
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.similarity = similarity
+        self.scope = scope
+        self.encoder = encoder if encoder is not None or similarity is None else _default_encoder()
+        self.hits = self.semantic_hits = self.misses = 0
+
+        self.entries = OrderedDict() # key -> (response, expiry, namespace, vector), least recently used first
+        self.namespaces: Dict[str, Dict[str, np.ndarray]] = {} # namespace -> {key: vector} of the semantic lookup
+        self.hydrated = set()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        if path is not None:
+            connection = self._connection()
+            connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, expiry REAL NOT NULL, namespace TEXT, vector BLOB)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_namespace ON responses (namespace)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection of the current thread, opening a new one in a forked worker."""
+
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout = 30, isolation_level = None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection, self.local.pid = connection, os.getpid()
+
+        return self.local.connection
+
+    @property
+    def blocking(self) -> bool:
+        """Return whether the lookups may block (database reads or encoding), so that async callers run them in a thread."""
+
+        return self.path is not None or self.similarity is not None
+
+    def applies(self, temperature: Optional[float]) -> bool:
+        """Return whether calls at this temperature are cached."""
+
+        return self.scope == "all" or temperature == 0
+
+    @staticmethod
+    def key(model: str, temperature: Optional[float], messages: List[Tuple[str, str]]) -> str:
+        """Return the exact key of a call.
+
+        Attributes:
+            - model: The model of the client.
+            - temperature: The temperature of the client.
+            - messages: The rendered (role, text) messages sent.
+        """
+
+        return _digest([model, temperature, [list(message) for message in messages]])
+
+    @staticmethod
+    def namespace(model: str, temperature: Optional[float], messages: List[Tuple[str, str]]) -> str:
+        """Return the namespace of the semantic lookup: the exact key of every message but the last."""
+
+        return ResponseCache.key(model, temperature, messages[:-1])
+
+    def _remember(self, key: str, response: str, expiry: float, namespace: str = None, vector: np.ndarray = None) -> None:
+        """Keep an entry in memory, evicting the least recently used entries over capacity. The lock must be held."""
+
+        self.entries[key] = (response, expiry, namespace, vector)
+        self.entries.move_to_end(key)
+        if vector is not None:
+            self.namespaces.setdefault(namespace, {})[key] = vector
+
+        while len(self.entries) > self.capacity:
+            self._forget(next(iter(self.entries)))
+
+    def _forget(self, key: str) -> None:
+        """Drop an entry from memory. The lock must be held."""
+
+        _, _, namespace, vector = self.entries.pop(key)
+        if vector is not None:
+            self.namespaces[namespace].pop(key, None)
+            if not self.namespaces[namespace]:
+                del self.namespaces[namespace]
+                self.hydrated.discard(namespace)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        """Return the response of an exact key from memory, then from the database."""
+
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] >= now:
+                    self.entries.move_to_end(key)
+                    return entry[0]
+                self._forget(key)
+
+        if self.path is None:
+            return None
+
+        row = self._connection().execute("SELECT response, expiry FROM responses WHERE key = ? AND expiry >= ?", (key, now)).fetchone()
+        if row is None:
+            return None
+
+        with self.lock:
+            self._remember(key, row[0], row[1])
+
+        return row[0]
+
+    def _hydrate(self, namespace: str) -> None:
+        """Load the vectors of a namespace from the database, once per namespace."""
+
+        if self.path is None or namespace in self.hydrated:
+            return
+
+        rows = self._connection().execute("SELECT key, response, expiry, vector FROM responses WHERE namespace = ? AND expiry >= ? AND vector IS NOT NULL",
+                                          (namespace, time.time())).fetchall()
+        with self.lock:
+            for key, response, expiry, vector in rows:
+                if key not in self.entries:
+                    self._remember(key, response, expiry, namespace, np.frombuffer(vector, dtype = np.float32))
+            self.hydrated.add(namespace)
+
+    def _semantic_lookup(self, namespace: str, vector: np.ndarray) -> Optional[str]:
+        """Return the response whose last message is the closest to the vector within the namespace, if it is close enough."""
+
+        self._hydrate(namespace)
+        now = time.time()
+
+        with self.lock:
+            candidates = self.namespaces.get(namespace)
+            if not candidates:
+                return None
+
+            keys = list(candidates)
+            scores = np.stack([candidates[key] for key in keys]) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                return None
+
+            response, expiry, _, _ = self.entries[keys[best]]
+            if expiry < now:
+                self._forget(keys[best])
+                return None
+            self.entries.move_to_end(keys[best])
+
+        return response
+
+    def _vector(self, messages: List[Tuple[str, str]]) -> np.ndarray:
+        """Return the normalized vector of the last message."""
+
+        return np.asarray(self.encoder(messages[-1][1]), dtype = np.float32)
+
+    def get(self, model: str, temperature: Optional[float], messages: List[Tuple[str, str]]) -> Optional[str]:
+        """Return the cached response of a call, or None.
+
+        Attributes:
+            - model: The model of the client.
+            - temperature: The temperature of the client.
+            - messages: The rendered (role, text) messages sent.
+        """
+
+        response = self._lookup(self.key(model, temperature, messages))
+        if response is not None:
+            with self.lock:
+                self.hits += 1
+            return response
+
+        if self.similarity is not None and messages:
+            response = self._semantic_lookup(self.namespace(model, temperature, messages), self._vector(messages))
+            if response is not None:
+                with self.lock:
+                    self.semantic_hits += 1
+                return response
+
+        with self.lock:
+            self.misses += 1
+
+        return None
+
+    def put(self, model: str, temperature: Optional[float], messages: List[Tuple[str, str]], response: str) -> None:
+        """Store the response of a call.
+
+        Attributes:
+            - model: The model of the client.
+            - temperature: The temperature of the client.
+            - messages: The rendered (role, text) messages sent.
+            - response: The response of the LLM.
+        """
+
+        key = self.key(model, temperature, messages)
+        expiry = time.time() + self.ttl
+        namespace = vector = None
+        if self.similarity is not None and messages:
+            namespace, vector = self.namespace(model, temperature, messages), self._vector(messages)
+
+        with self.lock:
+            self._remember(key, response, expiry, namespace, vector)
+
+        if self.path is not None:
+            connection = self._connection()
+            connection.execute("INSERT OR REPLACE INTO responses (key, response, expiry, namespace, vector) VALUES (?, ?, ?, ?, ?)",
+                               (key, response, expiry, namespace, None if vector is None else vector.tobytes()))
+            if int(key[:4], 16) % 100 == 0:
+                connection.execute("DELETE FROM responses WHERE expiry < ?", (time.time(),))
+
+    def stats(self) -> Dict:
+        """Return the counters of the cache."""
+
+        with self.lock:
+            hits, semantic_hits, misses, entries = self.hits, self.semantic_hits, self.misses, len(self.entries)
+        lookups = hits + semantic_hits + misses
+
+        return {
+            "hits": hits,
+            "semantic_hits": semantic_hits,
+            "misses": misses,
+            "hit_rate": (hits + semantic_hits) / lookups if lookups else 0.0,
+            "entries": entries
+        }
+
+
+def create_cache(url: str) -> Optional[ResponseCache]:
+    """Return the cache described by the url, or None if the url is off.
+
+    Attributes:
+        - url: off, memory://?capacity=4096 or sqlite:///responses.db. Every url takes ?ttl=, ?similarity= and ?scope=.
+    """
+
+    if url in ("", "off", "none"):
+        return None
+
+    parsed = urlparse(url)
+    options = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+    for name, kind in (("capacity", int), ("ttl", int), ("similarity", float)):
+        if name in options:
+            options[name] = kind(options[name])
+
+    if parsed.scheme == "memory":
+        return ResponseCache(**options)
+    if parsed.scheme == "sqlite":
+        return ResponseCache(path = parsed.path[1:] or "responses.db", **options) # sqlite:///relative.db or sqlite:////absolute.db
+
+    raise ValueError("The response cache must be off, or a memory:// or sqlite:// url!")
+
+
+_LOCK = threading.Lock()
+_CACHE = None
+_CREATED = False
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """Return the response cache of the process, created from INTERVIEW_CACHE on the first call (memory:// by default)."""
+
+    global _CACHE, _CREATED
+
+    with _LOCK:
+        if not _CREATED:
+            _CACHE = create_cache(os.getenv("INTERVIEW_CACHE", "memory://"))
+            _CREATED = True
+            logging.info("Interview response cache: %s", "off" if _CACHE is None else os.getenv("INTERVIEW_CACHE", "memory://"))
+
+        return _CACHE
@@ -0,0 +1,100 @@
+"""
+The shared LLM clients of the agents.
+
+Key Features:
+    - Create each LangChain chat model once per process, keyed by model, temperature and API key.
+    - Share one keep-alive HTTP connection pool between the OpenAI clients, so that turns reuse connections instead of paying for TLS handshakes.
+      The async pool is only used from the event loop of runtime.py.
+
+The Questioner, Evaluator and Criticizer only hold a reference to a shared client plus their own chat history, so building them per request is cheap.
+The Anthropic clients keep their own pooled HTTP client, which lives as long as the shared chat model.
+The Fake model is the local stand-in for load tests (see fake.py), configured by INTERVIEW_FAKE_LLM.
+"""
+
+import logging
+import os
+import threading
+import httpx
+from langchain_anthropic import ChatAnthropic
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_openai import ChatOpenAI
+from interview.agents.fake import create_fake_llm
+from typing import Dict, Tuple
+
+MODELS = {
+    "GPT": "gpt-4o-mini",
+    "Claude": "claude-3-5-haiku-latest"
+}
+LIMITS = httpx.Limits(max_connections = 100, max_keepalive_connections = 20, keepalive_expiry = 60)
+
+_LOCK = threading.Lock()
+_CLIENTS: Dict[Tuple, BaseChatModel] = {}
+_HTTP_CLIENT = None
+_HTTP_ASYNC_CLIENT = None
+
+
+def _http_client() -> httpx.Client:
+    """Return the shared HTTP connection pool of the OpenAI clients."""
+
+    global _HTTP_CLIENT
+
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = httpx.Client(limits = LIMITS, timeout = httpx.Timeout(600, connect = 5))
+
+    return _HTTP_CLIENT
+
+def _http_async_client() -> httpx.AsyncClient:
+    """Return the shared async HTTP connection pool of the OpenAI clients."""
+
+    global _HTTP_ASYNC_CLIENT
+
+    if _HTTP_ASYNC_CLIENT is None:
+        _HTTP_ASYNC_CLIENT = httpx.AsyncClient(limits = LIMITS, timeout = httpx.Timeout(600, connect = 5))
+
+    return _HTTP_ASYNC_CLIENT
+
+def get_client(model: str, api_key: str, temperature: float, max_tokens: int = 1024) -> BaseChatModel:
+    """Return the shared chat model, creating it on the first call.
+
+    Attributes:
+        - model: The model of the agent, GPT, Claude or Fake.
+        - api_key: The API Key of the provider.
+        - temperature: The sampling temperature.
+        - max_tokens: The maximum number of tokens per response.
+    """
+
+    key = (model, api_key, temperature, max_tokens)
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+
+    with _LOCK:
+        if key in _CLIENTS:
+            return _CLIENTS[key]
+
+        logging.info("Creating the shared %s client (temperature %s)", model, temperature)
+        if model == "GPT":
+            client = ChatOpenAI(model = MODELS["GPT"], 
+                                temperature = temperature,
+                                max_tokens = max_tokens,
+                                timeout = None,
+                                max_retries = 2,
+                                api_key = api_key,
+                                stream_usage = True, # Report the tokens of streamed calls too (see metrics.py)
+                                http_client = _http_client(),
+                                http_async_client = _http_async_client())
+        elif model == "Claude":
+            client = ChatAnthropic(model = MODELS["Claude"], 
+                                   temperature = temperature,
+                                   max_tokens = max_tokens,
+                                   timeout = None,
+                                   max_retries = 2,
+                                   api_key = api_key)
+        elif model == "Fake":
+            client = create_fake_llm(os.getenv("INTERVIEW_FAKE_LLM", "fake://echo"), temperature, max_tokens)
+        else:
+            raise ValueError("The model must be: GPT, Claude or Fake!")
+
+        _CLIENTS[key] = client
+
+        return client
@@ -10,6 +10,7 @@ from langchain_anthropic import ChatAnthropic
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 import logging
+from interview.agents.clients import get_client
 from interview.agents.history import ChatHistory
 from interview.agents.llm import LLMAgent
 from typing import List, Tuple
@@ -21,7 +22,7 @@ class Criticizer(LLMAgent):
     Attributes:
         api_key: The API Key to access the LLM.
         user_history: The past evaluation of the criticizer if there is any (Most likely queried from the database).
-        client: The Claude Agent using LangChain.
+        client: The shared Claude Agent using LangChain (see clients.py).
         prompt: The prompt to activate the criticizer.
         history: The Chat History of the Criticizer Agent.
     """
@@ -45,41 +46,25 @@ class Criticizer(LLMAgent):
 
         super().__init__(api_key, curr_history)
 
-        if model == "GPT":
-            self.client = ChatOpenAI(model="gpt-4o-mini", 
-                                    temperature = 1.0,
-                                    max_tokens = 1024,
-                                    timeout = None,
-                                    max_retries = 2,
-                                    api_key = api_key)
-        elif model == "Claude":
-            self.client = ChatAnthropic(model="claude-3-5-haiku-latest", 
-                                        temperature = 1.0,
-                                        max_tokens = 1024,
-                                        timeout = None,
-                                        max_retries = 2,
-                                        api_key = api_key)
+        self.client = get_client(model, api_key, temperature = 1.0) # Shared by every interview in this process
         
         self.user_past = user_past
-        self.prompt = """
-        Below is a question from a conversation:
+        self.prompt = """Question:
+{question}
 
-        Question:
-        {question}
+Personality Evaluation:
+{evaluation}"""
 
-        Personality Evaluation:
-        {evaluation}
-
-        Provide a meaningful critique of the question based on the personality evaluation. Focus on how the questioner can improve the question to make the evaluation more specific and confident. Your critique should address any gaps in the question that prevent a deeper or more accurate understanding of the user's personality.
+        # The instructions are sent once in the system message, each turn only carries the question and the evaluation
+        if curr_history is None:
+            self.append_history("system", """You are a manager who is giving constructive criticism on how to make your worker's work better.
 
-        Guidelines:
+Each message gives you a question from a conversation and a personality evaluation. Provide a meaningful critique of the question based on the personality evaluation. Focus on how the questioner can improve the question to make the evaluation more specific and confident. Your critique should address any gaps in the question that prevent a deeper or more accurate understanding of the user's personality.
 
-        Limit your critique to one paragraph (up to 50 words).
-        Do not suggest new questions directly.
-        """
+Guidelines:
 
-        if curr_history is None:
-            self.append_history("system", "You are a manager who is giving constructive criticism on how to make your worker's work better.")
+Limit your critique to one paragraph (up to 50 words).
+Do not suggest new questions directly.""")
     
     def generate(self, question: str, evaluation: str) -> str:
         """Take in a question and evaluation from an LLM and generate a critique of the question.
@@ -95,9 +80,14 @@ class Criticizer(LLMAgent):
         # Append the assistant to the chat history
         # Return the critique
 
-        self.append_history("human", self.prompt)
-        prompt = ChatPromptTemplate(self.reveal_chat_history())
-        chain = prompt | self.client
-        content = chain.invoke({"question": question, "evaluation": evaluation}).content
-        self.append_history("assistant", content)
-        return content
\ No newline at end of file
+        return self.invoke(self.prompt, {"question": question, "evaluation": evaluation})
+
+    async def agenerate(self, question: str, evaluation: str) -> str:
+        """The asynchronous generate.
+
+        Attributes:
+            question: The question from the questioner agent.
+            evaluation: The personality evaluation from the evaluator agent.
+        """
+
+        return await self.ainvoke(self.prompt, {"question": question, "evaluation": evaluation})
\ No newline at end of file
@@ -5,15 +5,18 @@ The Evaluator Agent has the following features:
     - Perform an evaluation of the person.
     - Able to give the final evaluation.
     - Continuously improve upon the evaluation based on the current evaluation.
+    - Time each update of the evaluation (see metrics.py).
 """
 
 import anthropic
 from langchain_anthropic import ChatAnthropic
 from langchain_core.prompts import ChatPromptTemplate
 import logging
+from interview.agents.clients import get_client
 from interview.agents.history import ChatHistory
 from interview.agents.llm import LLMAgent
 from langchain_openai import ChatOpenAI
+from metrics import span
 from typing import List, Tuple
 
 
@@ -22,11 +25,13 @@ class Evaluator(LLMAgent):
 
     Attributes:
         api_key: The API Key to access the LLM.
-        client: The Claude Agent using LangChain.
+        client: The shared Claude Agent using LangChain (see clients.py).
         prompt: The prompt to activate the evaluator.
         history: The Chat History of the Evaluator Agent.
         evaluation: The current evaluation.
         threshold: How many lines of questioning before an evaluation.
+        update_prompt: The prompt to update the current evaluation with a response.
+        critique_prompt: The prompt to critique the current evaluation.
     """
 
     api_key: str
@@ -46,51 +51,47 @@ class Evaluator(LLMAgent):
 
         super().__init__(api_key, curr_history)
 
-        if model == "GPT":
-            self.client = ChatOpenAI(model="gpt-4o-mini", 
-                                    temperature = 0,
-                                    max_tokens = 1024,
-                                    timeout = None,
-                                    max_retries = 2,
-                                    api_key = api_key)
-        elif model == "Claude":
-            self.client = ChatAnthropic(model="claude-3-5-haiku-latest", 
-                                        temperature = 1.0,
-                                        max_tokens = 1024,
-                                        timeout = None,
-                                        max_retries = 2,
-                                        api_key = api_key)
+        self.client = get_client(model, api_key, temperature = 0 if model == "GPT" else 1.0) # Shared by every interview in this process
         
         self.evaluation = "A person who is trying to find meaningful work."
         self.threshold = threshold
+        self.update_prompt = """Task: Update
 
-        if curr_history is None:
-            self.append_history("system", "You are a life coach who is trying to determine a person's values, future goals, personal interests. Your goal is to have a thorough understanding of the person.")
+User Response:
+{response}
 
-    def update_evaluation(self, response: str) -> None:
-        """Update the evaluation using the answers given."""
+Past Impression:
+{evaluation}"""
+        self.critique_prompt = """Task: Critique
 
+Evaluation:
+{evaluation}"""
 
-        prompt = """
-        Below is a response from the user and your past impression of them:
+        # The instructions of both tasks are sent once in the system message, each turn only carries its task and values
+        if curr_history is None:
+            self.append_history("system", """You are a life coach who is trying to determine a person's values, future goals, personal interests. Your goal is to have a thorough understanding of the person.
 
-        User Response:
-        {response}
+Each message gives you one of two tasks.
 
-        Past Impression:
-        {evaluation}
+Task: Update
+You are given a response from the user and your past impression of them. You are trying to gain a deeper understanding of the user's values, goals, and personal interests. Update the past impression based on the new response, specifically focusing on any new insights related to the user's values, goals, and personal interests.
+Ensure that the updated impression is coherent and integrates both past and new information.
 
-        You are trying to gain a deeper understanding of the user's values, goals, and personal interests. Update the past impression based on the new response, specifically focusing on any new insights related to the user's values, goals, and personal interests. 
-        Ensure that the updated impression is coherent and integrates both past and new information.
-        """
+Task: Critique
+You are given the current evaluation of the user. Provide one suggestion to make the evaluation more specific and holistic. Focus on any missing aspects related to the user's values, goals, or interests.
+If the evaluation is already thorough and requires no substantial critique, simply output: \"Continue\".""")
 
-        self.append_history("human", response)
-        prompt = ChatPromptTemplate(self.reveal_chat_history())
-        chain = prompt | self.client
+    def update_evaluation(self, response: str) -> None:
+        """Update the evaluation using the answers given."""
+
+        with span("evaluation_update"):
+            self.evaluation = self.invoke(self.update_prompt, {"response": response, "evaluation": self.evaluation})
+
+    async def aupdate_evaluation(self, response: str) -> None:
+        """The asynchronous update_evaluation."""
 
-        content = chain.invoke({"response": response, "evaluation": self.evaluation}).content
-        self.append_history("assistant", content)
-        self.evaluation = content
+        with span("evaluation_update"):
+            self.evaluation = await self.ainvoke(self.update_prompt, {"response": response, "evaluation": self.evaluation})
 
     def generate(self) -> None:
         """Generate a critique of the current evaluation."""
@@ -100,22 +101,12 @@ class Evaluator(LLMAgent):
         # Append the history
         # Output the critique as needed
 
-        curr_prompt = """ 
-        Below is the current evaluation of the user:
+        return self.invoke(self.critique_prompt, {"evaluation": self.evaluation})
 
-        Evaluation:
-        {evaluation}
-
-        Provide one suggestion to make the evaluation more specific and holistic. Focus on any missing aspects related to the user's values, goals, or interests. 
-        If the evaluation is already thorough and requires no substantial critique, simply output: "Continue"
-        """
+    async def agenerate(self) -> str:
+        """The asynchronous generate."""
 
-        self.append_history("human", curr_prompt)
-        prompt = ChatPromptTemplate(self.reveal_chat_history())
-        chain = prompt | self.client
-        content = chain.invoke({"evaluation": self.evaluation}).content
-        self.append_history("assistant", content)
-        return content
+        return await self.ainvoke(self.critique_prompt, {"evaluation": self.evaluation})
     
     def obtain_evaluation(self) -> str:
         """Return self.evaluation."""
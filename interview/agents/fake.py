@@ -0,0 +1,217 @@
+"""
+The fake LLM of the agents, a local stand-in for the OpenAI and Anthropic chat models, so that the interview can be load-tested for free.
+
+Key Features:
+    - Echo the last message sent (the first words of it), or answer from a script.
+    - Wait a time to first token and stream the tokens at a rate, both drawn from configurable distributions.
+    - Deterministic: the response and the timings of a call only depend on the messages sent and the seed, not on the order of the calls.
+    - Report the (estimated) tokens of every call as usage_metadata, with the token details dicts of the real providers,
+      and count them for the whole process (see usage).
+
+The agents use it with model = "Fake" (eg. INTERVIEW_MODEL=Fake), configured by url with INTERVIEW_FAKE_LLM, eg.
+    fake://echo?latency=lognormal:400:0.5&rate=normal:60:10&words=30
+    fake://script?path=benchmarks/script.json&latency=const:200&rate=const:0
+The script is a json list of responses: the response of a call is the one of its turn, ie. of the number of human messages sent.
+A distribution is const:<value>, uniform:<low>:<high>, normal:<mean>:<deviation> or lognormal:<median>:<sigma>. The latency is in
+milliseconds and the rate in tokens per second (0 streams the whole response at once).
+"""
+
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from interview.agents.history import estimate_tokens
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+_LOCK = threading.Lock()
+_USAGE = {"calls": 0, "active": 0, "input_tokens": 0, "output_tokens": 0}
+
+
+def create_distribution(spec: str) -> Callable[[random.Random], float]:
+    """Return the sampler of a distribution, never below 0.
+
+    Attributes:
+        - spec: const:<value>, uniform:<low>:<high>, normal:<mean>:<deviation> or lognormal:<median>:<sigma>.
+    """
+
+    name, *values = spec.split(":")
+    values = [float(value) for value in values]
+
+    if name == "const" and len(values) == 1:
+        return lambda rng: max(values[0], 0.0)
+    if name == "uniform" and len(values) == 2:
+        return lambda rng: max(rng.uniform(values[0], values[1]), 0.0)
+    if name == "normal" and len(values) == 2:
+        return lambda rng: max(rng.gauss(values[0], values[1]), 0.0)
+    if name == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(max(values[0], 1e-9)), values[1])
+
+    raise ValueError("The distribution must be const:v, uniform:low:high, normal:mean:deviation or lognormal:median:sigma!")
+
+def usage() -> Dict:
+    """Return the counters of the fake calls of the process: calls, active (in flight), input_tokens and output_tokens."""
+
+    with _LOCK:
+        return dict(_USAGE)
+
+def _count(field: str, value: int) -> None:
+    """Add to a usage counter."""
+
+    with _LOCK:
+        _USAGE[field] += value
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    The FakeChatModel class, a chat model which answers locally after a simulated latency.
+
+    Attributes:
+        - model: The name of the model, part of the keys of the response cache.
+        - mode: echo or script.
+        - responses: The scripted responses.
+        - words: The maximum number of words echoed.
+        - latency: The distribution of the time to first token, in milliseconds.
+        - rate: The distribution of the tokens per second of the response. 0 returns it at once.
+        - seed: The seed of the distributions.
+        - temperature: The temperature the agent asked for (it does not change the responses).
+        - max_tokens: The maximum number of tokens per response.
+    """
+
+    model: str = "Fake"
+    mode: str = "echo"
+    responses: List[str] = []
+    words: int = 30
+    latency: str = "const:0"
+    rate: str = "const:0"
+    seed: int = 0
+    temperature: float = 0.0
+    max_tokens: int = 1024
+
+    @property
+    def _llm_type(self) -> str:
+        """Return the type of the chat model."""
+
+        return "fake"
+
+    def _respond(self, messages: List[BaseMessage]) -> Tuple[str, List[str], float, float, Dict]:
+        """Return the response, its tokens, the latency and the delay between tokens (in seconds), and the usage of a call."""
+
+        prompt = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        rng = random.Random(zlib.crc32(prompt.encode()) ^ self.seed) # The same call always gets the same draws
+
+        if self.mode == "script":
+            turn = sum(1 for message in messages if message.type == "human")
+            content = self.responses[(turn - 1) % len(self.responses)] if self.responses else ""
+        else:
+            last = next((message.content for message in reversed(messages) if message.type == "human"), "")
+            content = " ".join(str(last).split()[:self.words])
+
+        tokens = content.split()[:self.max_tokens]
+        content = " ".join(tokens)
+        rate = create_distribution(self.rate)(rng)
+        delay = 1 / rate if rate > 0 else 0.0
+        metadata = {"input_tokens": estimate_tokens(prompt), "output_tokens": len(tokens)}
+        metadata["total_tokens"] = metadata["input_tokens"] + metadata["output_tokens"]
+        metadata["input_token_details"], metadata["output_token_details"] = {"cache_read": 0}, {"reasoning": 0} # Shaped like OpenAI's
+
+        return content, tokens, create_distribution(self.latency)(rng) / 1000, delay, metadata
+
+    def _start(self, metadata: Dict) -> None:
+        """Count a call starting."""
+
+        with _LOCK:
+            _USAGE["calls"] += 1
+            _USAGE["active"] += 1
+            _USAGE["input_tokens"] += metadata["input_tokens"]
+            _USAGE["output_tokens"] += metadata["output_tokens"]
+
+    def _generate(self, messages: List[BaseMessage], stop: List[str] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        """Wait for the latency and the whole response, then return it."""
+
+        content, tokens, latency, delay, metadata = self._respond(messages)
+        self._start(metadata)
+        try:
+            time.sleep(latency + delay * len(tokens))
+        finally:
+            _count("active", -1)
+
+        return ChatResult(generations = [ChatGeneration(message = AIMessage(content = content, usage_metadata = metadata))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: List[str] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        """The asynchronous _generate, which does not block the event loop."""
+
+        content, tokens, latency, delay, metadata = self._respond(messages)
+        self._start(metadata)
+        try:
+            await asyncio.sleep(latency + delay * len(tokens))
+        finally:
+            _count("active", -1)
+
+        return ChatResult(generations = [ChatGeneration(message = AIMessage(content = content, usage_metadata = metadata))])
+
+    def _stream(self, messages: List[BaseMessage], stop: List[str] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        """Yield the tokens of the response at the rate, after the latency. The last chunk carries the usage."""
+
+        content, tokens, latency, delay, metadata = self._respond(messages)
+        self._start(metadata)
+        try:
+            time.sleep(latency)
+            for i, token in enumerate(tokens):
+                if i > 0:
+                    time.sleep(delay)
+                yield ChatGenerationChunk(message = AIMessageChunk(content = token if i == 0 else " " + token))
+            yield ChatGenerationChunk(message = AIMessageChunk(content = "", usage_metadata = metadata))
+        finally:
+            _count("active", -1)
+
+    async def _astream(self, messages: List[BaseMessage], stop: List[str] = None, run_manager: Any = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        """The asynchronous _stream."""
+
+        content, tokens, latency, delay, metadata = self._respond(messages)
+        self._start(metadata)
+        try:
+            await asyncio.sleep(latency)
+            for i, token in enumerate(tokens):
+                if i > 0:
+                    await asyncio.sleep(delay)
+                yield ChatGenerationChunk(message = AIMessageChunk(content = token if i == 0 else " " + token))
+            yield ChatGenerationChunk(message = AIMessageChunk(content = "", usage_metadata = metadata))
+        finally:
+            _count("active", -1)
+
+
+def create_fake_llm(url: str, temperature: float = 0.0, max_tokens: int = 1024) -> FakeChatModel:
+    """Return the fake chat model described by the url.
+
+    Attributes:
+        - url: fake://echo?... or fake://script?path=<json file>&... (see the module docstring).
+        - temperature: The temperature the agent asked for.
+        - max_tokens: The maximum number of tokens per response.
+    """
+
+    parsed = urlparse(url)
+    options = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+    mode = parsed.netloc or "echo"
+
+    if parsed.scheme != "fake" or mode not in ("echo", "script"):
+        raise ValueError("The fake LLM must be a fake://echo or fake://script url!")
+
+    responses = []
+    if mode == "script":
+        with open(options.pop("path")) as f:
+            responses = [str(response) for response in json.load(f)]
+
+    fake = FakeChatModel(mode = mode, responses = responses, words = int(options.get("words", 30)), latency = options.get("latency", "const:0"),
+                         rate = options.get("rate", "const:0"), seed = int(options.get("seed", 0)), temperature = temperature, max_tokens = max_tokens)
+    for spec in (fake.latency, fake.rate):
+        create_distribution(spec) # Fail early on a bad distribution
+
+    return fake
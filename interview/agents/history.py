@@ -3,14 +3,29 @@ The modules in history.py serves to record the histories of the different chats
     - ChatHistory: The history of the chat, which includes the users and the LLMs.
     - UserHistory: The history of the user answers.
 
+It also has the context policies, which bound how much of a ChatHistory is sent to the LLM:
+    - FullContext: The whole history.
+    - SlidingWindow: The system messages and the last few turns.
+    - TokenBudget: The system messages and as many recent turns as fit in a token budget.
+    - RollingSummary: Older turns are folded into a summary system message once there are too many of them.
+
 Key Features:
     - Record Chat History: Each module will effectively record the chat history. 
+    - Bound the context: The prompt tokens stop growing with every turn of the interview.
 
 This module serves to be the short term memory of each conversation. This means that these modules only serves to be the memory for one conversation.
 """
 
 from typing import List, Tuple
 
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text (about 4 characters per token)."""
+
+    return len(text) // 4 + 1
+
 class ChatHistory:
     """
     The ChatHistory class. This class aims to save the chat history of each of the items in the conversation, which includes responses by the LLM and user responses. 
@@ -27,7 +42,7 @@ class ChatHistory:
         if history is None:
             self.history = []
         else:
-            self.history = history
+            self.history = [tuple(entry) for entry in history] # Tuples come back as lists from a json store
         
     def show_history(self) -> List[Tuple[str]]:
         """Show the history."""
@@ -47,6 +62,156 @@ class ChatHistory:
         else:
             raise ValueError("The role must be: assistant, system, ai, user or human!")
 
+    def split(self) -> Tuple[List[Tuple[str]], List[Tuple[str]]]:
+        """Split the history into the leading system messages (the instructions and the summary) and the turns after them."""
+
+        head = 0
+        while head < len(self.history) and self.history[head][0] == "system":
+            head += 1
+
+        return self.history[:head], self.history[head:]
+
+    def fold(self, count: int, summary: str) -> None:
+        """Replace the first count turns and the previous summary with a summary system message.
+
+        Attributes:
+            count: The number of turns (messages) folded into the summary.
+            summary: The summary of those turns.
+        """
+
+        head, turns = self.split()
+        head = [entry for entry in head if not entry[1].startswith(SUMMARY_PREFIX)]
+        self.history = head + [("system", SUMMARY_PREFIX + summary)] + turns[count:]
+
+
+class ContextPolicy:
+    """
+    The ContextPolicy class, which decides which part of a ChatHistory is sent to the LLM. The base policy sends everything.
+    """
+
+    def select(self, history: ChatHistory, reserve: int = 0) -> List[Tuple[str]]:
+        """Return the messages to send.
+
+        Attributes:
+            history: The chat history.
+            reserve: The number of tokens to keep free for the new message.
+        """
+
+        return history.history
+
+    def to_fold(self, history: ChatHistory) -> int:
+        """Return the number of turns (messages) which should be folded into the summary now."""
+
+        return 0
+
+FullContext = ContextPolicy
+
+
+class SlidingWindow(ContextPolicy):
+    """
+    The SlidingWindow policy, which sends the system messages and the last few turns.
+
+    Attributes:
+        turns: The number of (human, assistant) turns to send.
+    """
+
+    turns: int
+
+    def __init__(self, turns: int = 4) -> None:
+        """Initialize the SlidingWindow policy."""
+
+        self.turns = turns
+
+    def select(self, history: ChatHistory, reserve: int = 0) -> List[Tuple[str]]:
+        """Return the system messages and the last turns."""
+
+        head, turns = history.split()
+
+        return head + (turns[-2 * self.turns:] if self.turns > 0 else [])
+
+
+class TokenBudget(ContextPolicy):
+    """
+    The TokenBudget policy, which sends the system messages and as many of the most recent turns as fit in the budget.
+
+    Attributes:
+        max_tokens: The token budget of the context, including the new message.
+    """
+
+    max_tokens: int
+
+    def __init__(self, max_tokens: int = 3000) -> None:
+        """Initialize the TokenBudget policy."""
+
+        self.max_tokens = max_tokens
+
+    def select(self, history: ChatHistory, reserve: int = 0) -> List[Tuple[str]]:
+        """Return the system messages and the most recent turns within the budget. Turns are kept in (human, assistant) pairs."""
+
+        head, turns = history.split()
+        budget = self.max_tokens - reserve - sum(estimate_tokens(text) for _, text in head)
+        start = len(turns)
+
+        while start >= 2:
+            cost = estimate_tokens(turns[start - 1][1]) + estimate_tokens(turns[start - 2][1])
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 2
+
+        return head + turns[start:]
+
+
+class RollingSummary(ContextPolicy):
+    """
+    The RollingSummary policy. Once there are more than max_turns turns, all but the last keep_turns are folded into a summary.
+    The agent writes the summary with its own LLM (see LLMAgent.compact).
+
+    Attributes:
+        max_turns: The number of (human, assistant) turns which triggers a summary.
+        keep_turns: The number of recent turns kept verbatim.
+    """
+
+    max_turns: int
+    keep_turns: int
+
+    def __init__(self, max_turns: int = 6, keep_turns: int = 2) -> None:
+        """Initialize the RollingSummary policy."""
+
+        self.max_turns = max_turns
+        self.keep_turns = min(keep_turns, max_turns)
+
+    def to_fold(self, history: ChatHistory) -> int:
+        """Return the number of turns to fold, once there are more than max_turns."""
+
+        _, turns = history.split()
+        if len(turns) <= 2 * self.max_turns:
+            return 0
+
+        return len(turns) - 2 * self.keep_turns
+
+
+def create_policy(spec: str) -> ContextPolicy:
+    """Return the policy described by spec: full, window:<turns>, budget:<tokens> or summary:<max turns>[:<kept turns>].
+
+    Attributes:
+        spec: The description of the policy.
+    """
+
+    name, *args = spec.split(":")
+    args = [int(arg) for arg in args]
+
+    if name == "full":
+        return FullContext()
+    if name == "window":
+        return SlidingWindow(*args)
+    if name == "budget":
+        return TokenBudget(*args)
+    if name == "summary":
+        return RollingSummary(*args)
+
+    raise ValueError("The context policy must be: full, window, budget or summary!")
+
 class UserHistory:
     """
     The UserHistory class. This class aims to save the chat history of each of the items in the conversation, which only includes responses by the user responses. 
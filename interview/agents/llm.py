@@ -4,12 +4,57 @@ The LLM class acts as a parent class to the other agentic classes.
 In this case, this class has a few features which are common to all the other classes:
     - Raising errors when calling APIs
     - Chat history monitoring
+    - Invoking the LLM with the chat history, synchronously (invoke), on an event loop (ainvoke) or token by token (astream)
+    - Rendering each turn once, when it is appended: the chat history holds literal messages, never templates
+    - Answering repeated calls from the response cache (see cache.py), by default for the deterministic agents only
+    - Bounding the context sent to the LLM with a context policy (see history.py), set by INTERVIEW_CONTEXT (eg. budget:3000)
+    - Timing every LLM call and counting its tokens by agent and model (see metrics.py)
 
 """
 
+import asyncio
 import logging
-from interview.agents.history import ChatHistory
-from typing import List, Tuple
+import os
+import time
+from functools import lru_cache
+from interview.agents.cache import ResponseCache, get_cache
+from interview.agents.history import ChatHistory, ContextPolicy, SUMMARY_PREFIX, create_policy, estimate_tokens
+from langchain_core.messages import BaseMessage, convert_to_messages
+from langchain_core.messages.ai import add_usage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+from metrics import record_llm
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+CONTEXT_POLICY = os.getenv("INTERVIEW_CONTEXT", "budget:3000")
+SUMMARY_PROMPT = "Summarize the conversation below in at most 150 words. Keep every fact learned about the user and the points already covered."
+
+# The messages are passed through as they are: nothing in the chat history is parsed as a template
+MESSAGES_PROMPT = ChatPromptTemplate([MessagesPlaceholder("messages")])
+
+
+@lru_cache(maxsize = 256)
+def compile_template(template: str) -> PromptTemplate:
+    """Return the parsed template, parsing each distinct template only once per process."""
+
+    return PromptTemplate.from_template(template)
+
+
+@lru_cache(maxsize = 4096)
+def _message(role: str, text: str) -> BaseMessage:
+    """Return the message of a chat history entry, converting each entry only once."""
+
+    return convert_to_messages([(role, text)])[0]
+
+
+def render(template: str, values: Dict) -> str:
+    """Render a template with its values.
+
+    Attributes:
+        - template: The template of the turn.
+        - values: The values of the template placeholders. Braces in the values are kept as they are.
+    """
+
+    return compile_template(template).format(**values)
 
 
 class LLMAgent:
@@ -19,20 +64,31 @@ class LLMAgent:
     Attributes:
         - api_key: The API Key to access the LLM.
         - chat_history: The Chat History of the LLM Agents.
+        - context_policy: The policy deciding which part of the chat history is sent to the LLM.
+        - chain: The chain of the agent, built once per client (see the chain property).
+        - cache: The response cache, or None.
     """
 
     api_key: str
     chat_history: ChatHistory
+    context_policy: ContextPolicy
+    cache: Optional[ResponseCache]
 
-    def __init__(self, api_key: str, curr_history: List[Tuple[str]] = None) -> None:
+    def __init__(self, api_key: str, curr_history: List[Tuple[str]] = None, context_policy: ContextPolicy = None, cache: ResponseCache = None) -> None:
         """Take in an API Key and initialize the LLM Agent.
 
         Attributes:
             - api_key: The API Key to access the LLM.
+            - context_policy: The context policy. Defaults to INTERVIEW_CONTEXT.
+            - cache: The response cache. Defaults to the cache of the process set by INTERVIEW_CACHE.
         """
 
         self.api_key = api_key
         self.chat_history = ChatHistory(history = curr_history)
+        self.context_policy = context_policy if context_policy is not None else create_policy(CONTEXT_POLICY)
+        self.cache = cache if cache is not None else get_cache()
+        self._chain = None
+        self._chain_client = None
     
     def check_errors(self, response: str) -> None:
         """Check the errors of the LLM based on the response.
@@ -57,4 +113,220 @@ class LLMAgent:
         """Reveals the chat history.
         """
 
-        return self.chat_history.history
\ No newline at end of file
+        return self.chat_history.history
+
+    @property
+    def chain(self):
+        """Return the chain of the agent. It is only rebuilt when the client is replaced."""
+
+        if self._chain is None or self._chain_client is not self.client:
+            self._chain = MESSAGES_PROMPT | self.client
+            self._chain_client = self.client
+
+        return self._chain
+
+    def _messages(self, history: List[Tuple[str]]) -> Dict:
+        """Return the chain input of a list of chat history entries."""
+
+        return {"messages": [_message(role, text) for role, text in history]}
+
+    def _turn(self, template: str, values: Dict) -> Tuple[str, List[Tuple[str]]]:
+        """Render the new human turn and return it with the selected context followed by the turn."""
+
+        turn = render(template, values)
+        context = self.context_policy.select(self.chat_history, reserve = estimate_tokens(turn))
+
+        return turn, context + [("human", turn)]
+
+    def _model(self) -> str:
+        """Return the model of the client."""
+
+        return getattr(self.client, "model_name", None) or getattr(self.client, "model", None) or type(self.client).__name__
+
+    def _cache_call(self) -> Optional[Tuple[str, float]]:
+        """Return the (model, temperature) of the client if its calls are cached, else None."""
+
+        temperature = getattr(self.client, "temperature", None)
+        if self.cache is None or not self.cache.applies(temperature):
+            return None
+
+        return self._model(), temperature
+
+    def _record(self, start: float, outcome: str, usage: Optional[Dict]) -> None:
+        """Record an LLM call which started at start (see metrics.py)."""
+
+        record_llm(type(self).__name__, self._model(), time.perf_counter() - start, usage, outcome)
+
+    def _call(self, messages: List[Tuple[str]]) -> str:
+        """Send the messages to the LLM, record the call (failed or not) and return the response."""
+
+        start, outcome, usage = time.perf_counter(), "error", None
+        try:
+            message = self.chain.invoke(self._messages(messages))
+            outcome, usage = "ok", message.usage_metadata
+            return message.content
+        finally:
+            self._record(start, outcome, usage)
+
+    async def _acall(self, messages: List[Tuple[str]]) -> str:
+        """The asynchronous _call. A call cut off by the step timeout is recorded as cancelled."""
+
+        start, outcome, usage = time.perf_counter(), "error", None
+        try:
+            message = await self.chain.ainvoke(self._messages(messages))
+            outcome, usage = "ok", message.usage_metadata
+            return message.content
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            self._record(start, outcome, usage)
+
+    def _cached(self, messages: List[Tuple[str]]) -> Optional[str]:
+        """Return the cached response of the messages, or None."""
+
+        call = self._cache_call()
+
+        return None if call is None else self.cache.get(*call, messages)
+
+    def _store(self, messages: List[Tuple[str]], content: str) -> None:
+        """Store the response of the messages in the cache."""
+
+        call = self._cache_call()
+        if call is not None:
+            self.cache.put(*call, messages, content)
+
+    async def _acached(self, messages: List[Tuple[str]]) -> Optional[str]:
+        """The asynchronous _cached, which keeps blocking lookups off the event loop."""
+
+        if self.cache is not None and self.cache.blocking:
+            return await asyncio.to_thread(self._cached, messages)
+
+        return self._cached(messages)
+
+    async def _astore(self, messages: List[Tuple[str]], content: str) -> None:
+        """The asynchronous _store."""
+
+        if self.cache is not None and self.cache.blocking:
+            await asyncio.to_thread(self._store, messages, content)
+        else:
+            self._store(messages, content)
+
+    def _summary_request(self) -> Tuple[List[Tuple[str]], int]:
+        """Return the messages asking for a summary of the turns the policy wants folded, and their number."""
+
+        count = self.context_policy.to_fold(self.chat_history)
+        if count == 0:
+            return None, 0
+
+        head, turns = self.chat_history.split()
+        earlier = [text for _, text in head if text.startswith(SUMMARY_PREFIX)]
+        transcript = "\n\n".join(earlier + [f"{role}: {text}" for role, text in turns[:count]])
+
+        return [("system", SUMMARY_PROMPT), ("human", transcript)], count
+
+    def _fold(self, summary: str, count: int) -> None:
+        """Fold the summarized turns."""
+
+        self.chat_history.fold(count, summary)
+
+    def compact(self) -> None:
+        """Fold the older turns into a summary if the context policy asks for it."""
+
+        messages, count = self._summary_request()
+        if messages is not None:
+            self._fold(self._call(messages), count)
+
+    async def acompact(self) -> None:
+        """The asynchronous compact."""
+
+        messages, count = self._summary_request()
+        if messages is not None:
+            self._fold(await self._acall(messages), count)
+
+    def record(self, template: str, values: Dict, content: str) -> None:
+        """Record a turn whose response was obtained elsewhere (eg. from the question pool), as if it had been invoked.
+        The history is not compacted here, the next invoke does it.
+
+        Attributes:
+            - template: The human template of the turn.
+            - values: The values of the template placeholders.
+            - content: The response of the turn.
+        """
+
+        self.append_history("human", render(template, values))
+        self.append_history("assistant", content)
+
+    def invoke(self, template: str, values: Dict) -> str:
+        """Render a new human turn, send it to the LLM after the chat history, then record both the rendered turn and the response.
+
+        Attributes:
+            - template: The human template of the turn.
+            - values: The values of the template placeholders.
+        """
+
+        turn, messages = self._turn(template, values)
+        content = self._cached(messages)
+        if content is None:
+            content = self._call(messages)
+            self._store(messages, content)
+        self.append_history("human", turn)
+        self.append_history("assistant", content)
+        self.compact()
+
+        return content
+
+    async def ainvoke(self, template: str, values: Dict) -> str:
+        """The asynchronous invoke. The history is only updated once the response has arrived, so a cancelled call leaves it untouched.
+
+        Attributes:
+            - template: The human template of the turn.
+            - values: The values of the template placeholders.
+        """
+
+        turn, messages = self._turn(template, values)
+        content = await self._acached(messages)
+        if content is None:
+            content = await self._acall(messages)
+            await self._astore(messages, content)
+        self.append_history("human", turn)
+        self.append_history("assistant", content)
+        await self.acompact()
+
+        return content
+
+    async def astream(self, template: str, values: Dict) -> AsyncIterator[str]:
+        """The streaming invoke, which yields the response as it is produced. The history is only updated once the whole response has arrived.
+
+        Attributes:
+            - template: The human template of the turn.
+            - values: The values of the template placeholders.
+        """
+
+        turn, messages = self._turn(template, values)
+        chunks = []
+
+        content = await self._acached(messages)
+        if content is not None:
+            chunks.append(content)
+            yield content
+        else:
+            start, outcome, usage = time.perf_counter(), "error", None
+            try:
+                async for chunk in self.chain.astream(self._messages(messages)):
+                    if chunk.usage_metadata: # The providers report the usage in the first or last chunks
+                        usage = add_usage(usage, chunk.usage_metadata)
+                    if chunk.content:
+                        chunks.append(chunk.content)
+                        yield chunk.content
+                outcome = "ok"
+            except (asyncio.CancelledError, GeneratorExit): # The step timeout, or the client went away
+                outcome = "cancelled"
+                raise
+            finally:
+                self._record(start, outcome, usage)
+            await self._astore(messages, "".join(chunks))
+
+        self.append_history("human", turn)
+        self.append_history("assistant", "".join(chunks))
+        await self.acompact()
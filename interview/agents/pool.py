@@ -0,0 +1,192 @@
+"""
+The question pool, which keeps pre-generated questions for the turns whose prompt is the same for every interview.
+
+Key Features:
+    - Serve the opening question (and the scripted question 2 and question 4 prompts) instantly, without an LLM round trip.
+    - Refill the pool in the background on the event loop of runtime.py whenever a question is taken.
+    - Drop the questions older than the staleness budget, and regenerate them before they expire even without traffic.
+    - Back off exponentially after a failed refill (eg. a bad key or a provider outage), instead of retrying every second.
+
+A pooled question is generated by a fresh Questioner, so it is the answer to the system message and the prompt alone.
+The pool of the process is configured by INTERVIEW_POOL_SIZE (questions per prompt, 0 turns the pool off) and INTERVIEW_POOL_STALENESS (seconds).
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from interview.agents import runtime
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+POOL_SIZE = int(os.getenv("INTERVIEW_POOL_SIZE", "8"))
+POOL_STALENESS = float(os.getenv("INTERVIEW_POOL_STALENESS", "3600"))
+BACKOFF = 5.0 # Seconds before the first retry of a failed refill, doubled after each failure
+BACKOFF_MAX = 600.0
+
+
+class QuestionPool:
+    """
+    The QuestionPool class, which keeps up to size fresh questions for each prompt.
+
+    Attributes:
+        - generate: The coroutine function generating a question from a prompt.
+        - prompts: The prompts of the pool.
+        - size: The number of questions kept per prompt.
+        - staleness: The number of seconds a question may be served after it was generated.
+        - questions: The (question, creation time) of each prompt, oldest first.
+        - failures: The number of refills of each prompt which failed in a row.
+    """
+
+    generate: Callable[[str], Awaitable[str]]
+    prompts: List[str]
+    size: int
+    staleness: float
+    questions: Dict[str, Deque[Tuple[str, float]]]
+    failures: Dict[str, int]
+
+    def __init__(self, generate: Callable[[str], Awaitable[str]], prompts: List[str], size: int = POOL_SIZE, staleness: float = POOL_STALENESS) -> None:
+        """Initialize the QuestionPool. The pool starts empty, see start.
+
+        Attributes:
+            - generate: The coroutine function generating a question from a prompt.
+            - prompts: The prompts of the pool.
+            - size: The number of questions kept per prompt.
+            - staleness: The number of seconds a question may be served after it was generated.
+        """
+
+        self.generate = generate
+        self.prompts = list(prompts)
+        self.size = size
+        self.staleness = staleness
+        self.questions = {prompt: deque() for prompt in self.prompts}
+        self.refilling = set()
+        self.failures = {prompt: 0 for prompt in self.prompts}
+        self.retry_at = {prompt: 0.0 for prompt in self.prompts} # The monotonic time before which taking a question does not refill
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """Fill the pool in the background."""
+
+        for prompt in self.prompts:
+            self.schedule(prompt)
+
+    def schedule(self, prompt: str, retry: bool = False) -> None:
+        """Refill the questions of a prompt in the background, unless a refill is already running or the last one failed
+        and its backoff has not run out.
+
+        Attributes:
+            - prompt: The prompt to refill.
+            - retry: Whether this is the scheduled retry, which ignores the backoff.
+        """
+
+        with self.lock:
+            if prompt in self.refilling or (not retry and time.monotonic() < self.retry_at[prompt]):
+                return
+            self.refilling.add(prompt)
+
+        asyncio.run_coroutine_threadsafe(self._refill(prompt), runtime.get_loop())
+
+    def _expire(self, prompt: str, now: float) -> None:
+        """Drop the stale questions of a prompt. The lock must be held."""
+
+        questions = self.questions[prompt]
+        while questions and questions[0][1] + self.staleness < now:
+            questions.popleft()
+
+    async def _refill(self, prompt: str) -> None:
+        """Generate questions until the prompt has size fresh ones. A question is regenerated once it is half way to stale,
+        so the pool is renewed before its questions expire."""
+
+        try:
+            while True:
+                with self.lock:
+                    now = time.time()
+                    self._expire(prompt, now)
+                    questions = self.questions[prompt]
+                    while questions and questions[0][1] + self.staleness / 2 < now and len(questions) >= self.size:
+                        questions.popleft() # Renew the oldest question
+                    if len(questions) >= self.size:
+                        break
+
+                question = await self.generate(prompt)
+                with self.lock:
+                    self.questions[prompt].append((question, time.time()))
+                    self.failures[prompt] = 0
+        except Exception as error:
+            with self.lock:
+                self.failures[prompt] += 1
+            logging.warning("The question pool could not refill %r (%d failures in a row): %r", prompt, self.failures[prompt], error)
+        finally:
+            with self.lock:
+                self.refilling.discard(prompt)
+
+        # Come back once the oldest question is half way to stale, or after the backoff if the refill failed
+        with self.lock:
+            oldest = self.questions[prompt][0][1] if self.questions[prompt] else time.time()
+            delay = max(oldest + self.staleness / 2 - time.time(), 1.0)
+            if self.failures[prompt]:
+                delay = min(BACKOFF * 2 ** (self.failures[prompt] - 1), BACKOFF_MAX)
+                self.retry_at[prompt] = time.monotonic() + delay
+        asyncio.get_running_loop().call_later(delay, self.schedule, prompt, True)
+
+    def take(self, prompt: str) -> Optional[str]:
+        """Return a fresh question of the prompt, or None if there is none. A refill is started in the background.
+
+        Attributes:
+            - prompt: The prompt of the question.
+        """
+
+        if prompt not in self.questions:
+            return None
+
+        with self.lock:
+            self._expire(prompt, time.time())
+            questions = self.questions[prompt]
+            question = questions.pop()[0] if questions else None # The newest question
+
+        self.schedule(prompt)
+
+        return question
+
+    def __len__(self) -> int:
+        """Return the number of pooled questions."""
+
+        with self.lock:
+            return sum(len(questions) for questions in self.questions.values())
+
+
+_LOCK = threading.Lock()
+_POOL = None
+
+
+def _reset() -> None:
+    """Forget the pool of the parent process in a forked child: its refills ran on the parent's event loop."""
+
+    global _POOL, _LOCK
+
+    _POOL = None
+    _LOCK = threading.Lock()
+
+os.register_at_fork(after_in_child = _reset)
+
+def get_pool(generate: Callable[[str], Awaitable[str]], prompts: List[str]) -> Optional[QuestionPool]:
+    """Return the question pool of the process, creating and starting it on the first call. Return None if INTERVIEW_POOL_SIZE is 0.
+
+    Attributes:
+        - generate: The coroutine function generating a question from a prompt.
+        - prompts: The prompts of the pool.
+    """
+
+    global _POOL
+
+    if POOL_SIZE <= 0:
+        return None
+
+    with _LOCK:
+        if _POOL is None:
+            _POOL = QuestionPool(generate, prompts)
+            _POOL.start()
+
+        return _POOL
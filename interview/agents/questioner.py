@@ -10,10 +10,11 @@ import anthropic
 from langchain_anthropic import ChatAnthropic
 from langchain_core.prompts import ChatPromptTemplate
 import logging
+from interview.agents.clients import get_client
 from interview.agents.history import ChatHistory
 from interview.agents.llm import LLMAgent
 from langchain_openai import ChatOpenAI
-from typing import List, Tuple
+from typing import AsyncIterator, List, Tuple
 
 
 class Questioner(LLMAgent):
@@ -21,7 +22,7 @@ class Questioner(LLMAgent):
 
     Attributes:
         api_key: The API key from Anthropic API.
-        client: The Claude Agent using LangChain.
+        client: The shared Claude Agent using LangChain (see clients.py).
         prompt: The prompt to activate the evaluator.
         question_counter: The number of questions.
     """
@@ -42,45 +43,31 @@ class Questioner(LLMAgent):
         super().__init__(api_key, curr_history)
         self.question_counter = 0
 
-        if model == "GPT":
-            self.client = ChatOpenAI(model="gpt-4o-mini", 
-                                    temperature = 1.0,
-                                    max_tokens = 1024,
-                                    timeout = None,
-                                    max_retries = 2,
-                                    api_key = api_key)
-        else:
-            self.client = ChatAnthropic(model="claude-3-5-haiku-latest", 
-                                        temperature = 0,
-                                        max_tokens = 1024,
-                                        timeout = None,
-                                        max_retries = 2,
-                                        api_key = api_key)
+        self.client = get_client(model, api_key, temperature = 1.0 if model == "GPT" else 0) # Shared by every interview in this process
         
-        if curr_history is None:
-            self.append_history("system", "You are a friend who is interviewing someone to match them with meaningful work. Be as personable as possible.")
+        self.critic_prompt = """Critique:
+{critique}
 
-        self.critic_prompt = """
-        You have been provided with a critique of the previous question or a user response. If the critique is 'None,' treat the provided response as a user response.
+Previous Question or User Response:
+{response}"""
 
-        Critique:
-        {critique}
+        # The instructions are sent once in the system message, each turn only carries the critique and the response
+        if curr_history is None:
+            self.append_history("system", """You are a friend who is interviewing someone to match them with meaningful work. Be as personable as possible.
 
-        Previous Question or User Response:
-        {response}
+Each message gives you a critique of the previous question, or a user response. If the critique is 'None', treat the provided response as a user response.
 
-        Adjust and reword the next question as follows:
+Adjust and reword the next question as follows:
 
-        If the critique is 'None' (i.e., it's a user response):
-        Ask an investigative follow-up question that encourages the user to explore new aspects of their response. Avoid narrowing the focus to one specific detail, and ensure the question opens up further lines of conversation.
-        
-        If a critique is provided:
-            Refine and reword the previous question based on the critique.
-            Focus on investigative questions that encourage deeper exploration of the user's perspective, avoiding overly specific or speculative questions.
-            Maintain a friendly tone to keep the conversation approachable and inviting.
-            Output only one question, with some acknowledgement of the response.
-            Don't make it repetitive compared to the other question asked: Reword it properly.
-        """
+If the critique is 'None' (i.e., it's a user response):
+Ask an investigative follow-up question that encourages the user to explore new aspects of their response. Avoid narrowing the focus to one specific detail, and ensure the question opens up further lines of conversation.
+
+If a critique is provided:
+    Refine and reword the previous question based on the critique.
+    Focus on investigative questions that encourage deeper exploration of the user's perspective, avoiding overly specific or speculative questions.
+    Maintain a friendly tone to keep the conversation approachable and inviting.
+    Output only one question, with some acknowledgement of the response.
+    Don't make it repetitive compared to the other question asked: Reword it properly.""")
     
     def add_question_counter(self) -> None:
         """Increment self.question_counter by 1."""
@@ -100,9 +87,36 @@ class Questioner(LLMAgent):
         # Add a question counter
         # Return the content
 
-        self.append_history("human", self.critic_prompt) # Append evaluator
-        prompt = ChatPromptTemplate(self.reveal_chat_history())
-        chain = prompt | self.client
-        content = chain.invoke({"response": response, "critique": critique}).content
-        self.append_history("assistant", content)
-        return content
\ No newline at end of file
+        return self.invoke(self.critic_prompt, {"response": response, "critique": critique})
+
+    def record(self, response: str, question: str, critique: str = None) -> None:
+        """Record a question generated elsewhere (eg. taken from the question pool) as the answer to the response.
+        
+        Attribute:
+            response: The response from the user.
+            question: The question.
+            critic: The criticism of the question.
+        """
+
+        super().record(self.critic_prompt, {"response": response, "critique": critique}, question)
+
+    async def agenerate(self, response: str, critique: str = None) -> str:
+        """The asynchronous generate.
+        
+        Attribute:
+            response: The response from the user.
+            critic: The criticism of the question.
+        """
+
+        return await self.ainvoke(self.critic_prompt, {"response": response, "critique": critique})
+
+    async def astream(self, response: str, critique: str = None) -> AsyncIterator[str]:
+        """The streaming generate, which yields the question as it is produced.
+        
+        Attribute:
+            response: The response from the user.
+            critic: The criticism of the question.
+        """
+
+        async for chunk in super().astream(self.critic_prompt, {"response": response, "critique": critique}):
+            yield chunk
@@ -0,0 +1,93 @@
+"""
+The event loop runtime of the agents.
+
+Key Features:
+    - Run one long-lived asyncio event loop per process in a background thread.
+    - Let synchronous code (eg. the Flask views) run coroutines on it and wait for the result.
+    - Let synchronous code iterate over an asynchronous generator running on it (eg. a streamed response).
+
+The shared LLM clients keep their async connection pools open between turns, and those pools belong to the loop they were first used on.
+Every asynchronous LLM call therefore goes through this loop rather than a fresh asyncio.run per request.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, List
+
+_LOCK = threading.Lock()
+_LOOP = None
+
+
+def _reset() -> None:
+    """Forget the loop of the parent process in a forked child: its thread does not survive the fork."""
+
+    global _LOOP, _LOCK
+
+    _LOOP = None
+    _LOCK = threading.Lock()
+
+os.register_at_fork(after_in_child = _reset)
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop of the process, starting its thread on the first call."""
+
+    global _LOOP
+
+    with _LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target = _LOOP.run_forever, name = "agents-event-loop", daemon = True).start()
+
+        return _LOOP
+
+def run(coroutine: Awaitable, timeout: float = None) -> Any:
+    """Run a coroutine on the event loop of the process and return its result.
+
+    Attributes:
+        - coroutine: The coroutine to run.
+        - timeout: The maximum number of seconds to wait. The coroutine is cancelled if it runs out.
+    """
+
+    future = asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+def iterate(generator: AsyncIterator, timeout: float = None) -> Iterator:
+    """Iterate over an asynchronous generator on the event loop of the process. The generator is closed if the iteration stops early.
+
+    Attributes:
+        - generator: The asynchronous generator.
+        - timeout: The maximum number of seconds to wait for each item.
+    """
+
+    try:
+        while True:
+            try:
+                yield run(generator.__anext__(), timeout)
+            except StopAsyncIteration:
+                return
+    finally:
+        try:
+            run(generator.aclose(), timeout)
+        except RuntimeError: # The generator is still being cancelled after a timeout
+            pass
+
+async def gather(*coroutines: Awaitable) -> List[Any]:
+    """Run coroutines concurrently and return their results. If one fails, the others are cancelled.
+
+    Attributes:
+        - coroutines: The coroutines to run.
+    """
+
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        raise
@@ -0,0 +1,170 @@
+"""
+The evaluation worker, which updates the evaluation of each interview in the background instead of on the request path.
+
+Key Features:
+    - Queue the evaluation updates of an interview and run them one after the other on the event loop of agents/runtime.py.
+    - Keep a versioned snapshot of the evaluation in the interview store: the version is the number of user answers it covers.
+    - Let the later turns read the latest snapshot, and let the end of the interview wait only if the snapshot is out of date.
+
+The snapshot is saved under its own key ("<interview id>:evaluation"), so the worker and the request saving the interview state never overwrite each other.
+The updates of one interview run in order within a process; the snapshot only ever moves to a newer version.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from interview.agents import runtime
+from interview.agents.evaluator import Evaluator
+from interview.store import InterviewStore
+from typing import Dict, Optional, Tuple
+
+INITIAL_EVALUATION = "A person who is trying to find meaningful work."
+
+
+class EvaluationWorker:
+    """
+    The EvaluationWorker class, which runs the evaluation updates of the interviews in the background.
+
+    Attributes:
+        - store: The interview store keeping the snapshots.
+        - api_key: The API Key of the Evaluator.
+        - model: The model of the Evaluator.
+        - pending: The future of the latest queued update of each interview.
+    """
+
+    store: InterviewStore
+    api_key: str
+    model: str
+    pending: Dict[str, concurrent.futures.Future]
+
+    def __init__(self, store: InterviewStore, api_key: str, model: str = "GPT") -> None:
+        """Initialize the EvaluationWorker.
+
+        Attributes:
+            - store: The interview store keeping the snapshots.
+            - api_key: The API Key of the Evaluator.
+            - model: The model of the Evaluator.
+        """
+
+        self.store = store
+        self.api_key = api_key
+        self.model = model
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(interview_id: str) -> str:
+        """Return the store key of the snapshot of an interview."""
+
+        return f"{interview_id}:evaluation"
+
+    def snapshot(self, interview_id: str) -> Dict:
+        """Return the latest snapshot of an interview: {"version": ..., "evaluation": ..., "history": ...}.
+
+        Attributes:
+            - interview_id: The id of the interview.
+        """
+
+        return self._or_initial(self.store.load(self._key(interview_id)))
+
+    @staticmethod
+    def _or_initial(snapshot: Optional[Dict]) -> Dict:
+        """Return the snapshot, or the snapshot of an interview without any evaluation yet."""
+
+        return snapshot if snapshot is not None else {"version": 0, "evaluation": INITIAL_EVALUATION, "history": None}
+
+    def load(self, interview_id: str) -> Tuple[Optional[Dict], Dict]:
+        """Return the state of an interview (None if there is none) and its latest snapshot, read in one round trip.
+
+        Attributes:
+            - interview_id: The id of the interview.
+        """
+
+        state, snapshot = self.store.load_many([interview_id, self._key(interview_id)])
+
+        return state, self._or_initial(snapshot)
+
+    def submit(self, interview_id: str, answers: str, version: int) -> concurrent.futures.Future:
+        """Queue an update of the evaluation with new answers. The updates of an interview run in the order they are submitted.
+
+        Attributes:
+            - interview_id: The id of the interview.
+            - answers: The answers the evaluation is updated with.
+            - version: The number of user answers the updated evaluation covers.
+        """
+
+        with self.lock:
+            previous = self.pending.get(interview_id)
+            future = asyncio.run_coroutine_threadsafe(self._update(interview_id, answers, version, previous), runtime.get_loop())
+            self.pending[interview_id] = future
+
+        future.add_done_callback(lambda done: self._done(interview_id, done))
+
+        return future
+
+    def _done(self, interview_id: str, future: concurrent.futures.Future) -> None:
+        """Forget the finished update, unless a newer one was queued after it."""
+
+        with self.lock:
+            if self.pending.get(interview_id) is future:
+                del self.pending[interview_id]
+
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning("The evaluation update of %s failed: %r", interview_id, future.exception())
+
+    async def _update(self, interview_id: str, answers: str, version: int, previous: Optional[concurrent.futures.Future]) -> Dict:
+        """Wait for the previous update of the interview, then update the latest snapshot and save it."""
+
+        if previous is not None:
+            await asyncio.gather(asyncio.wrap_future(previous), return_exceptions = True)
+
+        snapshot = await asyncio.to_thread(self.snapshot, interview_id)
+        if snapshot["version"] >= version:
+            return snapshot
+
+        evaluator = Evaluator(self.api_key, model = self.model, curr_history = snapshot["history"])
+        evaluator.replace_evaluation(snapshot["evaluation"])
+        await evaluator.aupdate_evaluation(answers)
+
+        snapshot = {"version": version, "evaluation": evaluator.obtain_evaluation(), "history": evaluator.reveal_chat_history()}
+        await asyncio.to_thread(self.store.save, self._key(interview_id), snapshot)
+
+        return snapshot
+
+    def current(self, interview_id: str, answers: list, timeout: float = None, snapshot: Dict = None) -> Dict:
+        """Return a snapshot covering every answer. Only waits if the latest snapshot is out of date:
+        first for the queued update of this process, then for an update with the answers it does not cover.
+        If that update fails or times out, the latest snapshot is returned.
+
+        Attributes:
+            - interview_id: The id of the interview.
+            - answers: Every user answer of the interview.
+            - timeout: The maximum number of seconds to wait for each update.
+            - snapshot: The latest snapshot if it was just loaded (see load), which saves reading it again when it is up to date.
+        """
+
+        if snapshot is None or snapshot["version"] < len(answers):
+            snapshot = self.snapshot(interview_id)
+        if snapshot["version"] >= len(answers):
+            return snapshot
+
+        with self.lock:
+            future = self.pending.get(interview_id)
+        if future is not None:
+            concurrent.futures.wait([future], timeout)
+            snapshot = self.snapshot(interview_id)
+            if snapshot["version"] >= len(answers):
+                return snapshot
+
+        missing = "".join(answers[snapshot["version"]:])
+        try:
+            return self.submit(interview_id, missing, len(answers)).result(timeout)
+        except Exception as error: # Including the timeout
+            logging.warning("Using the out of date evaluation of %s: %r", interview_id, error)
+            return snapshot
+
+    def delete(self, interview_id: str) -> None:
+        """Delete the snapshot of an interview."""
+
+        self.store.delete(self._key(interview_id))
@@ -6,6 +6,9 @@ Key Features:
     - Criticize flow of the interview
     - Create a full picture of the person
     - Save the history of the user.
+    - Update the evaluation in the background (see evaluations.py)
+    - Serve the opening and scripted questions from a pre-generated pool (see agents/pool.py)
+    - Run every agent on one model with INTERVIEW_MODEL, eg. Fake for load tests (see agents/fake.py)
     - Similarity searches from Pinecone (Not yet implemented)
     - Web Scraping using Beautifulsoup (Not yet implemented)
     - Need to write termination sequence (Not yet implemented)
@@ -15,16 +18,34 @@ This is the main component of the interview feature for Brain Bank. After creati
 
 import logging
 import asyncio
+from interview.agents import runtime
 from interview.agents.questioner import Questioner
 from interview.agents.criticizer import Criticizer
 from interview.agents.evaluator import Evaluator
 from interview.agents.history import ChatHistory, UserHistory
+from interview.agents.pool import QuestionPool, get_pool
 from interview.agents.utils import *
+from interview.evaluations import EvaluationWorker
 from dotenv import load_dotenv
 import os
 import time
 import uuid
-from typing import Tuple, Dict
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple, Dict
+
+OPENING_PROMPT = "Hey! Please ask your first question!"
+POTENTIAL_PROMPT = "Please ask a question that deals with discerning the potential of the user."
+INTERESTS_PROMPT = "Ask about other interests which are not previously discussed."
+SCRIPTED_PROMPTS = {2: POTENTIAL_PROMPT, 4: INTERESTS_PROMPT} # The prompt of the question after each evaluation, by question counter
+INTERVIEW_MODEL = os.getenv("INTERVIEW_MODEL") # eg. Fake. By default the Criticizer runs on Claude and the other agents on GPT
+
+
+def pool_generator(openai_key: str, model: str = "GPT") -> Callable[[str], Awaitable[str]]:
+    """Return the coroutine function generating the pooled questions with a fresh Questioner."""
+
+    async def generate(prompt: str) -> str:
+        return await Questioner(openai_key, model = model).agenerate(prompt)
+
+    return generate
 
 
 class InterviewAgent:
@@ -39,38 +60,61 @@ class InterviewAgent:
         history: The Tracking of the User History.
         terminator: The Termination Agent.
         id: The id of the interviewee
+        step_timeout: The maximum number of seconds of each LLM call in aget_response.
+        pool: The question pool of the process, or None.
+        evaluations: The evaluation worker updating the evaluation in the background, or None to update it on the request path.
+        interview_id: The id of the interview in the interview store (used by the evaluation worker).
+        evaluation_snapshot: The snapshot of the evaluation worker the evaluation started from, or None without a worker.
+        model: The model of every agent, or None for Claude (Criticizer) and GPT (Questioner and Evaluator).
     """
 
     def __init__(self, name: str, openai_key: str, anthropic_key: str, question_counter: int, user_history: List[List[str]] = None,
-                 criticizer_history: List[List[str]] = None, questioner_history: List[List[str]] = None, evaluator_history: List[List[str]] = None) -> None:
+                 criticizer_history: List[List[str]] = None, questioner_history: List[List[str]] = None, evaluator_history: List[List[str]] = None,
+                 step_timeout: float = 30.0, use_pool: bool = True, evaluations: EvaluationWorker = None, interview_id: str = None,
+                 model: str = INTERVIEW_MODEL, evaluation_snapshot: Dict = None) -> None:
         """Initialize the InterviewAgent.
         
         Attribute:
             name: The name of the interviewee.
             openai_key: OpenAI Key.
             anthropic_key: Anthropic Key.
+            step_timeout: The maximum number of seconds of each LLM call in aget_response.
+            use_pool: Whether to serve the opening and scripted questions from the question pool (see pool.py).
+            evaluations: The evaluation worker. The evaluation starts from its latest snapshot.
+            interview_id: The id of the interview in the interview store.
+            model: The model of every agent. Defaults to INTERVIEW_MODEL, or to Claude (Criticizer) and GPT (Questioner and Evaluator).
+            evaluation_snapshot: The latest snapshot of the evaluation worker, if it was loaded with the state. Read from the worker otherwise.
         """
 
         if criticizer_history is None:
-            self.criticizer = Criticizer(anthropic_key, model="Claude")
+            self.criticizer = Criticizer(anthropic_key, model=model or "Claude")
         else:
-            self.criticizer = Criticizer(anthropic_key, model="Claude", curr_history = criticizer_history)
+            self.criticizer = Criticizer(anthropic_key, model=model or "Claude", curr_history = criticizer_history)
         
         if questioner_history is None:
-            self.questioner = Questioner(openai_key, model = "GPT")
+            self.questioner = Questioner(openai_key, model = model or "GPT")
         else:
-            self.questioner = Questioner(openai_key, model="GPT", curr_history = questioner_history)
+            self.questioner = Questioner(openai_key, model=model or "GPT", curr_history = questioner_history)
         
         if evaluator_history is None:
-            self.evaluator = Evaluator(openai_key, model="GPT")
+            self.evaluator = Evaluator(openai_key, model=model or "GPT")
         else:
-            self.evaluator = Evaluator(openai_key, model = "GPT", curr_history = evaluator_history)
+            self.evaluator = Evaluator(openai_key, model = model or "GPT", curr_history = evaluator_history)
         
         self.history = UserHistory(past_history=user_history)
         self.terminator = Termination(no_questions = 7)
         self.name = name
         self.id = uuid.uuid4()
         self.question_counter = question_counter
+        self.step_timeout = step_timeout
+        self.evaluations = evaluations
+        self.interview_id = interview_id
+        self.evaluation_snapshot = evaluation_snapshot
+        if evaluations is not None:
+            if self.evaluation_snapshot is None:
+                self.evaluation_snapshot = evaluations.snapshot(interview_id)
+            self.evaluator.replace_evaluation(self.evaluation_snapshot["evaluation"])
+        self.pool = get_pool(pool_generator(openai_key, model or "GPT"), [OPENING_PROMPT, POTENTIAL_PROMPT, INTERESTS_PROMPT]) if use_pool else None
 
     def obtain_evaluation(self) -> str:
         """Return the current evaluation of the user.
@@ -90,7 +134,7 @@ class InterviewAgent:
             response: The response by the user.
         """
 
-        await self.evaluator.update_evaluation(response)
+        await self.evaluator.aupdate_evaluation(response)
     
     def _generate_suitable_question(self, response: str = None, critique: str = None) -> str:
         """Take in a response and generate a suitable question depending on the response.
@@ -101,7 +145,7 @@ class InterviewAgent:
 
         if response is None or response == 'start':
 
-            return self.questioner.generate("Hey! Please ask your first question!")
+            return self.questioner.generate(OPENING_PROMPT)
         elif critique is None:
 
             return self.questioner.generate(response)
@@ -109,6 +153,19 @@ class InterviewAgent:
             
             return self.questioner.generate(response, critique)
     
+    def _pooled_question(self, prompt: str) -> Optional[str]:
+        """Take a question of the prompt from the pool and record it in the questioner history. Return None if the pool has none.
+
+        Attribute:
+            prompt: The prompt of the question.
+        """
+
+        question = self.pool.take(prompt) if self.pool is not None else None
+        if question is not None:
+            self.questioner.record(prompt, question)
+
+        return question
+
     def get_response(self, response: str = None) -> str:
         """Generate a response (follow up question) after taking a response.
 
@@ -130,19 +187,21 @@ class InterviewAgent:
 
         if (response is None) or (response.lower() == 'start'):
             self.question_counter += 1
-            return self._generate_suitable_question(None)
+            return self._pooled_question(OPENING_PROMPT) or self._generate_suitable_question(None)
         
         question = self._generate_suitable_question(response)
         self.history.append_history(response)
 
         if (self.question_counter % self.obtain_question_threshold()) == 0 and (self.question_counter > 0):
-            print("Updating Evaluation")
+            logging.info("Updating the evaluation after question %d", self.question_counter)
             past_history = self.history.concoctenate_string(self.obtain_question_threshold())
-            self.evaluator.update_evaluation(past_history)
-            if self.question_counter == 2:
-                question = self._generate_suitable_question(response = "Please ask a question that deals with discerning the potential of the user.")
-            elif self.question_counter == 4:
-                question = self._generate_suitable_question(response ="Ask about other interests which are not previously discussed.")
+            if self.evaluations is not None:
+                self.evaluations.submit(self.interview_id, past_history, len(self.history.history))
+            else:
+                self.evaluator.update_evaluation(past_history)
+            if self.question_counter in SCRIPTED_PROMPTS:
+                prompt = SCRIPTED_PROMPTS[self.question_counter]
+                question = self._pooled_question(prompt) or self._generate_suitable_question(response = prompt)
         else:
             evaluation = self.evaluator.generate()
             critique = self.criticizer.generate(question, evaluation)
@@ -153,6 +212,172 @@ class InterviewAgent:
 
         return question
     
+    async def _step(self, coroutine) -> str:
+        """Run one LLM call with the step timeout. The call is cancelled if it runs out."""
+
+        return await asyncio.wait_for(coroutine, self.step_timeout)
+
+    async def _evaluator_step(self, coroutine, name: str) -> Optional[str]:
+        """Run one call of the evaluator with the step timeout. If it fails, log it and return None: the turn goes on without it."""
+
+        try:
+            return await self._step(coroutine)
+        except Exception as error: # Including the step timeout
+            logging.warning("Going on without %s, it failed: %r", name, error)
+            return None
+
+    async def _agenerate_suitable_question(self, response: str = None, critique: str = None) -> str:
+        """The asynchronous _generate_suitable_question.
+
+        Attribute:
+            response: The response by the user.
+        """
+
+        if response is None or response == 'start':
+
+            return await self._step(self.questioner.agenerate(OPENING_PROMPT))
+
+        return await self._step(self.questioner.agenerate(response, critique))
+
+    async def _aplan(self, response: str) -> Tuple[str, Tuple[str, str]]:
+        """Run the steps of a turn which come before the final question. The steps which do not depend on each other run concurrently:
+            - The draft question and the evaluation (or its critique) are requested together.
+            - Only the critique waits for them.
+        Return the draft question (None if there is none) and the (response, critique) of the final question (None if the draft is final).
+        If the evaluation update fails or times out, the evaluation is left as it was. If the critique (or the evaluation it needs)
+        fails or times out, the draft question is final.
+
+        Attribute:
+            response: The user's response.
+        """
+
+        self.history.append_history(response)
+
+        if (self.question_counter % self.obtain_question_threshold()) == 0 and (self.question_counter > 0):
+            past_history = self.history.concoctenate_string(self.obtain_question_threshold())
+            prompt = SCRIPTED_PROMPTS.get(self.question_counter)
+            pooled = self._pooled_question(prompt) if prompt is not None else None
+            if self.evaluations is not None: # The evaluation is updated in the background, so the question is generated once
+                self.evaluations.submit(self.interview_id, past_history, len(self.history.history))
+                if pooled is not None:
+                    return pooled, None
+                return None, (prompt if prompt is not None else response, None)
+
+            if pooled is not None: # No draft question is needed
+                await self._evaluator_step(self.evaluator.aupdate_evaluation(past_history), "the evaluation update")
+                return pooled, None
+
+            # The scripted question replaces the draft, so it is the only question requested, like with the evaluation worker
+            question, _ = await runtime.gather(self._agenerate_suitable_question(prompt if prompt is not None else response),
+                                               self._evaluator_step(self.evaluator.aupdate_evaluation(past_history), "the evaluation update"))
+
+            return question, None
+
+        question, evaluation = await runtime.gather(self._agenerate_suitable_question(response),
+                                                    self._evaluator_step(self.evaluator.agenerate(), "the evaluation critique"))
+        if evaluation is None:
+            return question, None
+
+        try:
+            critique = await self._step(self.criticizer.agenerate(question, evaluation))
+        except Exception as error: # Including the step timeout
+            logging.warning("Returning the draft question, the critique failed: %r", error)
+            return question, None
+
+        return question, (response, critique)
+
+    async def aget_response(self, response: str = None) -> str:
+        """The asynchronous get_response, with the independent steps running concurrently (see _aplan).
+        If the final question fails or times out, the draft question is returned instead.
+
+        Attribute:
+            response: The user's response.
+        """
+
+        if self.terminator.termination_status():
+
+            return "You're all done! I've compiled a profile on you and I'm ready to direct you to some connections. Type 'Finish' to continue."
+
+        if (response is None) or (response.lower() == 'start'):
+            self.question_counter += 1
+            return self._pooled_question(OPENING_PROMPT) or await self._agenerate_suitable_question(None)
+
+        question, final = await self._aplan(response)
+        if final is not None:
+            try:
+                question = await self._agenerate_suitable_question(*final)
+            except Exception as error:
+                if question is None:
+                    raise
+                logging.warning("Returning the draft question, the final question failed: %r", error)
+
+        self.history.append_questions(question)
+        self.question_counter += 1
+
+        return question
+
+    async def _astream_question(self, response: str = None, critique: str = None) -> AsyncIterator[str]:
+        """The streaming _agenerate_suitable_question. The step timeout applies to the wait for each chunk.
+
+        Attribute:
+            response: The response by the user.
+        """
+
+        if response is None or response == 'start':
+            response = OPENING_PROMPT
+
+        chunks = self.questioner.astream(response, critique)
+        try:
+            while True:
+                try:
+                    yield await self._step(chunks.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            await chunks.aclose()
+
+    async def astream_response(self, response: str = None) -> AsyncIterator[str]:
+        """The streaming get_response, which yields the final question as it is produced. Every step before it runs as in aget_response.
+        If the final question fails before its first chunk, the draft question is yielded instead.
+
+        Attribute:
+            response: The user's response.
+        """
+
+        if self.terminator.termination_status():
+            yield "You're all done! I've compiled a profile on you and I'm ready to direct you to some connections. Type 'Finish' to continue."
+            return
+
+        if (response is None) or (response.lower() == 'start'):
+            self.question_counter += 1
+            question = self._pooled_question(OPENING_PROMPT)
+            if question is not None:
+                yield question
+                return
+            async for chunk in self._astream_question(None):
+                yield chunk
+            return
+
+        question, final = await self._aplan(response)
+        if final is not None:
+            chunks = []
+            try:
+                async for chunk in self._astream_question(*final):
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as error:
+                if question is None or chunks:
+                    raise
+                logging.warning("Returning the draft question, the final question failed: %r", error)
+                chunks = [question]
+                yield question
+            question = "".join(chunks)
+        else:
+            yield question
+
+        self.history.append_questions(question)
+        self.question_counter += 1
+
     def terminate_interview(self) -> Dict:
         """Terminate the interview."""
 
@@ -160,8 +385,12 @@ class InterviewAgent:
         # Obtain the impression
         # Terminate the interview
 
-        past_history = self.history.concoctenate_string(self.obtain_question_threshold())
-        self.evaluator.update_evaluation(past_history)
+        if self.evaluations is not None: # Only waits if the latest snapshot does not cover every answer
+            snapshot = self.evaluations.current(self.interview_id, self.history.history, self.step_timeout, self.evaluation_snapshot)
+            self.evaluator.replace_evaluation(snapshot["evaluation"])
+        else:
+            past_history = self.history.concoctenate_string(self.obtain_question_threshold())
+            self.evaluator.update_evaluation(past_history)
         impression = self.evaluator.obtain_evaluation()
         curr_time = time.time()
         conversation_history = self.history.obtain_conversation()
@@ -178,14 +407,10 @@ class InterviewAgent:
         questioner_history = self.questioner.reveal_chat_history()
         history = self.history.obtain_conversation()
 
-        # Evaluator evaluations
-        evaluation = self.evaluator.obtain_evaluation()
-
         data = {
             "evaluator_history": evaluator_history,
             "criticizer_history": criticizer_history,
             "questioner_history": questioner_history,
-            "evaluation": evaluation,
             "history": history,
             "question_counter": self.question_counter
         }
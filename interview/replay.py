@@ -0,0 +1,259 @@
+"""
+The replay engine, which re-scores past interviews offline: it rebuilds the impression of each transcript with the Evaluator, then matches them.
+
+Key Features:
+    - Read JSONL transcripts in the format of Termination.terminate (id, name, time, question_answer and impression).
+    - Evaluate the transcripts with bounded concurrency on the event loop of agents/runtime.py.
+    - Encode the impressions and answers in batches and match them against the catalogue with the shared Matcher, reranked as /get_match.
+    - Checkpoint every finished transcript, so that an interrupted run resumes where it stopped.
+
+The evaluation replays the interview: the evaluation is updated every threshold answers, then once more with the remaining answers,
+as the live interview does before /get_match. The impressions are checkpointed in <output>.impressions.jsonl and the matches in <output>.
+
+Usage: python -m interview.replay transcripts.jsonl results.jsonl --catalogue match/data.csv --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from dotenv import load_dotenv
+from interview.agents import runtime
+from interview.agents.evaluator import Evaluator
+from interview.evaluations import INITIAL_EVALUATION
+from typing import Dict, Iterator, List, Set
+
+CONCURRENCY = 16
+BATCH_SIZE = 256
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    """Yield the json objects of a JSONL file, skipping the lines which are not (eg. the last line of an interrupted run).
+
+    Attributes:
+        - path: The filepath of the JSONL file.
+    """
+
+    if not os.path.exists(path):
+        return
+
+    with open(path) as f:
+        for number, line in enumerate(f, start = 1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("Skipping line %d of %s: not json", number, path)
+                continue
+
+            if isinstance(record, dict) and "id" in record:
+                yield record
+            else:
+                logging.warning("Skipping line %d of %s: not a transcript", number, path)
+
+def finished_ids(path: str) -> Set[str]:
+    """Return the ids of the records already written to a checkpoint file."""
+
+    return {str(record["id"]) for record in read_jsonl(path)}
+
+
+class Checkpoint:
+    """
+    The Checkpoint class, which appends finished records to a JSONL file.
+
+    Attributes:
+        - path: The filepath of the checkpoint.
+        - every: The number of records between two fsyncs.
+    """
+
+    path: str
+    every: int
+
+    def __init__(self, path: str, every: int = 100) -> None:
+        """Open the checkpoint for appending.
+
+        Attributes:
+            - path: The filepath of the checkpoint.
+            - every: The number of records between two fsyncs.
+        """
+
+        self.path = path
+        self.every = every
+        self.count = 0
+        self.file = open(path, "a")
+
+    def write(self, record: Dict) -> None:
+        """Append a record. Each record is one line, flushed at once."""
+
+        self.file.write(json.dumps(record, default = str) + "\n")
+        self.file.flush()
+        self.count += 1
+        if self.count % self.every == 0:
+            os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        """Sync and close the checkpoint."""
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+async def evaluate(transcript: Dict, api_key: str, model: str = "GPT", threshold: int = 2) -> str:
+    """Rebuild the impression of a transcript and return it.
+
+    Attributes:
+        - transcript: The transcript, with its question_answer.
+        - api_key: The API Key of the Evaluator.
+        - model: The model of the Evaluator.
+        - threshold: The number of answers between two evaluation updates.
+    """
+
+    evaluator = Evaluator(api_key, model = model, threshold = threshold)
+    evaluator.replace_evaluation(INITIAL_EVALUATION)
+    answers = [str(answer) for answer in transcript.get("question_answer", {}).values()]
+
+    for start in range(0, len(answers), threshold):
+        await evaluator.aupdate_evaluation("".join(answers[start:start + threshold]))
+
+    return evaluator.obtain_evaluation()
+
+async def evaluate_all(transcripts: Iterator[Dict], checkpoint: Checkpoint, api_key: str, model: str = "GPT", threshold: int = 2,
+                       concurrency: int = CONCURRENCY) -> int:
+    """Evaluate the transcripts with at most concurrency in flight, checkpointing each one as it finishes. Return the number evaluated.
+
+    Attributes:
+        - transcripts: The transcripts to evaluate.
+        - checkpoint: The checkpoint of the impressions.
+        - api_key: The API Key of the Evaluator.
+        - model: The model of the Evaluator.
+        - threshold: The number of answers between two evaluation updates.
+        - concurrency: The maximum number of transcripts evaluated at once.
+    """
+
+    done = 0
+
+    async def work() -> None:
+        nonlocal done
+        for transcript in transcripts: # Shared by the workers: each takes the next transcript
+            try:
+                impression = await evaluate(transcript, api_key, model, threshold)
+            except Exception as error:
+                logging.warning("Could not evaluate %s, it will be retried on the next run: %r", transcript["id"], error)
+                continue
+
+            checkpoint.write(dict(transcript, impression = impression))
+            done += 1
+            if done % 100 == 0:
+                logging.info("Evaluated %d transcripts", done)
+
+    await asyncio.gather(*[work() for _ in range(concurrency)])
+
+    return done
+
+def match_all(impressions: Iterator[Dict], checkpoint: Checkpoint, csv_file: str, top_k: int = 5, batch_size: int = BATCH_SIZE) -> int:
+    """Match the impressions against the catalogue in batches, checkpointing each batch. Return the number matched.
+
+    Attributes:
+        - impressions: The transcripts with their impression.
+        - checkpoint: The checkpoint of the matches.
+        - csv_file: The catalogue.
+        - top_k: The number of matches per transcript.
+        - batch_size: The number of impressions encoded at once.
+    """
+
+    from match.registry import get_matcher
+
+    matcher = get_matcher(csv_file)
+    done = 0
+    batch = []
+
+    def flush() -> None:
+        results = matcher.match_batch([record["impression"] for record in batch], top_k, # One encode call per batch
+                                      question_answers = [record.get("question_answer") for record in batch]) # Reranked as /get_match
+        for record, matches in zip(batch, results):
+            checkpoint.write({"id": record["id"], "name": record.get("name"), "impression": record["impression"], "matches": matches})
+        batch.clear()
+
+    for record in impressions:
+        batch.append(record)
+        if len(batch) == batch_size:
+            done += len(batch)
+            flush()
+    if batch:
+        done += len(batch)
+        flush()
+
+    return done
+
+def replay(transcripts_file: str, output_file: str, csv_file: str, api_key: str, model: str = "GPT", threshold: int = 2,
+           concurrency: int = CONCURRENCY, top_k: int = 5, batch_size: int = BATCH_SIZE, restart: bool = False) -> Dict:
+    """Evaluate and match the transcripts which are not in the checkpoints yet, and return the counts.
+
+    Attributes:
+        - transcripts_file: The JSONL transcripts.
+        - output_file: The JSONL matches. The impressions are checkpointed next to it.
+        - csv_file: The catalogue.
+        - api_key: The API Key of the Evaluator.
+        - model: The model of the Evaluator.
+        - threshold: The number of answers between two evaluation updates.
+        - concurrency: The maximum number of transcripts evaluated at once.
+        - top_k: The number of matches per transcript.
+        - batch_size: The number of impressions encoded at once.
+        - restart: Ignore the checkpoints of a previous run.
+    """
+
+    impressions_file = output_file + ".impressions.jsonl"
+    if restart:
+        for path in (impressions_file, output_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    evaluated = finished_ids(impressions_file)
+    pending = (t for t in read_jsonl(transcripts_file) if str(t["id"]) not in evaluated)
+    checkpoint = Checkpoint(impressions_file)
+    try:
+        new_impressions = runtime.run(evaluate_all(pending, checkpoint, api_key, model, threshold, concurrency))
+    finally:
+        checkpoint.close()
+
+    matched = finished_ids(output_file)
+    unmatched = (record for record in read_jsonl(impressions_file) if str(record["id"]) not in matched)
+    checkpoint = Checkpoint(output_file)
+    try:
+        new_matches = match_all(unmatched, checkpoint, csv_file, top_k, batch_size)
+    finally:
+        checkpoint.close()
+
+    return {"evaluated": new_impressions, "skipped": len(evaluated), "matched": new_matches}
+
+
+def main() -> None:
+    """Parse the command line and replay the transcripts."""
+
+    parser = argparse.ArgumentParser(prog = "python -m interview.replay", description = "Re-score past interviews offline.")
+    parser.add_argument("transcripts", help = "The JSONL transcripts.")
+    parser.add_argument("output", help = "The JSONL matches.")
+    parser.add_argument("--catalogue", default = "match/data.csv")
+    parser.add_argument("--model", default = "GPT", choices = ["GPT", "Claude", "Fake"])
+    parser.add_argument("--threshold", type = int, default = 2, help = "The number of answers between two evaluation updates.")
+    parser.add_argument("--concurrency", type = int, default = CONCURRENCY)
+    parser.add_argument("--top-k", type = int, default = 5)
+    parser.add_argument("--batch-size", type = int, default = BATCH_SIZE)
+    parser.add_argument("--restart", action = "store_true", help = "Ignore the checkpoints of a previous run.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level = logging.INFO)
+    api_key = os.getenv("OPENAI_API_KEY") if args.model == "GPT" else os.getenv("ANTHROPIC_API_KEY")
+
+    counts = replay(args.transcripts, args.output, args.catalogue, api_key, args.model, args.threshold, args.concurrency,
+                    args.top_k, args.batch_size, args.restart)
+    print(f"{counts['evaluated']} transcripts evaluated ({counts['skipped']} already done), {counts['matched']} matched: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
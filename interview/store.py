@@ -0,0 +1,456 @@
+"""
+The interview state stores, which keep the state of each interview on the server so that the session cookie only carries the interview id.
+
+Key Features:
+    - MemoryStore: An in-memory LRU store. The state is lost on restart and is not shared between gunicorn workers.
+    - SQLiteStore: A SQLite store shared by the workers of one machine.
+    - RedisStore: A store speaking the Redis protocol (RESP) to Redis, or to the LocalRedisServer stand-in.
+    - The state of an interview is one json value, so it is loaded and saved in one round trip.
+    - Load several keys in one round trip (load_many), eg. the state of an interview with its evaluation snapshot.
+
+The store is picked by url with create_store, eg. memory://?capacity=10000, sqlite:///interviews.db or redis://localhost:6379/0.
+The stand-in can be started with: python -m interview.store --port 6379
+"""
+
+import argparse
+import json
+import logging
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class InterviewStore:
+    """
+    The InterviewStore class, the interface every interview state store implements.
+
+    Attributes:
+        - ttl: The number of seconds an interview is kept after its last save.
+    """
+
+    ttl: int
+
+    def __init__(self, ttl: int = DEFAULT_TTL) -> None:
+        """Initialize the store.
+
+        Attributes:
+            - ttl: The number of seconds an interview is kept after its last save.
+        """
+
+        self.ttl = ttl
+
+    def load(self, interview_id: str) -> Optional[Dict]:
+        """Return the state of an interview, or None if it does not exist or has expired.
+
+        Attributes:
+            - interview_id: The id of the interview.
+        """
+
+        raise NotImplementedError
+
+    def load_many(self, interview_ids: List[str]) -> List[Optional[Dict]]:
+        """Return the states of several keys, in their order. The stores over a connection read them in one round trip.
+
+        Attributes:
+            - interview_ids: The ids of the interviews (or any other keys of the store).
+        """
+
+        return [self.load(interview_id) for interview_id in interview_ids]
+
+    def save(self, interview_id: str, state: Dict) -> None:
+        """Save the state of an interview.
+
+        Attributes:
+            - interview_id: The id of the interview.
+            - state: The json serializable state of the interview.
+        """
+
+        raise NotImplementedError
+
+    def delete(self, interview_id: str) -> None:
+        """Delete the state of an interview.
+
+        Attributes:
+            - interview_id: The id of the interview.
+        """
+
+        raise NotImplementedError
+
+
+class MemoryStore(InterviewStore):
+    """
+    The MemoryStore class, which keeps the most recently used interviews in memory.
+
+    Attributes:
+        - capacity: The maximum number of interviews kept.
+        - states: The serialized states and expiry times, least recently used first.
+    """
+
+    capacity: int
+    states: OrderedDict
+
+    def __init__(self, capacity: int = 10000, ttl: int = DEFAULT_TTL) -> None:
+        """Initialize the MemoryStore.
+
+        Attributes:
+            - capacity: The maximum number of interviews kept.
+            - ttl: The number of seconds an interview is kept after its last save.
+        """
+
+        super().__init__(ttl)
+        self.capacity = capacity
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, interview_id: str) -> Optional[Dict]:
+        """Return the state of an interview and mark it as recently used."""
+
+        with self.lock:
+            entry = self.states.get(interview_id)
+            if entry is None:
+                return None
+
+            data, expiry = entry
+            if expiry < time.time():
+                del self.states[interview_id]
+                return None
+
+            self.states.move_to_end(interview_id)
+
+        return json.loads(data) # Serialized so that callers never share the stored objects
+
+    def save(self, interview_id: str, state: Dict) -> None:
+        """Save the state of an interview, evicting the least recently used interviews over capacity."""
+
+        data = json.dumps(state)
+
+        with self.lock:
+            self.states[interview_id] = (data, time.time() + self.ttl)
+            self.states.move_to_end(interview_id)
+            while len(self.states) > self.capacity:
+                self.states.popitem(last = False)
+
+    def delete(self, interview_id: str) -> None:
+        """Delete the state of an interview."""
+
+        with self.lock:
+            self.states.pop(interview_id, None)
+
+
+class SQLiteStore(InterviewStore):
+    """
+    The SQLiteStore class, which keeps the interviews in a SQLite database.
+
+    Attributes:
+        - path: The filepath of the database.
+    """
+
+    path: str
+
+    def __init__(self, path: str = "interviews.db", ttl: int = DEFAULT_TTL) -> None:
+        """Initialize the SQLiteStore and create its table.
+
+        Attributes:
+            - path: The filepath of the database.
+            - ttl: The number of seconds an interview is kept after its last save.
+        """
+
+        super().__init__(ttl)
+        self.path = path
+        self.local = threading.local()
+
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS interviews (id TEXT PRIMARY KEY, state TEXT NOT NULL, expiry REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS interviews_expiry ON interviews (expiry)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection of the current thread."""
+
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout = 30, isolation_level = None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+
+        return connection
+
+    def load(self, interview_id: str) -> Optional[Dict]:
+        """Return the state of an interview."""
+
+        row = self._connection().execute("SELECT state FROM interviews WHERE id = ? AND expiry >= ?", (interview_id, time.time())).fetchone()
+
+        return None if row is None else json.loads(row[0])
+
+    def load_many(self, interview_ids: List[str]) -> List[Optional[Dict]]:
+        """Return the states of several interviews with one query."""
+
+        placeholders = ", ".join("?" for _ in interview_ids)
+        rows = self._connection().execute(f"SELECT id, state FROM interviews WHERE id IN ({placeholders}) AND expiry >= ?",
+                                          (*interview_ids, time.time())).fetchall()
+        states = dict(rows)
+
+        return [None if interview_id not in states else json.loads(states[interview_id]) for interview_id in interview_ids]
+
+    def save(self, interview_id: str, state: Dict) -> None:
+        """Save the state of an interview, and occasionally purge the expired interviews."""
+
+        now = time.time()
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO interviews (id, state, expiry) VALUES (?, ?, ?)", (interview_id, json.dumps(state), now + self.ttl))
+
+        if hash(interview_id) % 100 == 0:
+            connection.execute("DELETE FROM interviews WHERE expiry < ?", (now,))
+
+    def delete(self, interview_id: str) -> None:
+        """Delete the state of an interview."""
+
+        self._connection().execute("DELETE FROM interviews WHERE id = ?", (interview_id,))
+
+
+def _encode_command(*args: str) -> bytes:
+    """Encode a command as a RESP array of bulk strings."""
+
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+
+    return b"".join(parts)
+
+def _read_reply(stream) -> object:
+    """Read one RESP reply from a buffered stream."""
+
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("The connection was closed.")
+
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        raise RuntimeError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(payload)
+        return None if length < 0 else [_read_reply(stream) for _ in range(length)]
+
+    raise RuntimeError(f"Unexpected reply: {line!r}")
+
+
+class RedisStore(InterviewStore):
+    """
+    The RedisStore class, which keeps the interviews in a server speaking the Redis protocol.
+
+    Attributes:
+        - host: The host of the server.
+        - port: The port of the server.
+        - db: The database number.
+        - prefix: The prefix of the keys.
+    """
+
+    host: str
+    port: int
+    db: int
+    prefix: str
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, prefix: str = "interview:", ttl: int = DEFAULT_TTL) -> None:
+        """Initialize the RedisStore. Each thread keeps its own connection open.
+
+        Attributes:
+            - host: The host of the server.
+            - port: The port of the server.
+            - db: The database number.
+            - prefix: The prefix of the keys.
+            - ttl: The number of seconds an interview is kept after its last save.
+        """
+
+        super().__init__(ttl)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = prefix
+        self.local = threading.local()
+
+    def _execute(self, *args: str) -> object:
+        """Send one command and return its reply, reconnecting once if the connection was dropped."""
+
+        for attempt in range(2):
+            stream = getattr(self.local, "stream", None)
+            try:
+                if stream is None:
+                    connection = socket.create_connection((self.host, self.port))
+                    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    stream = connection.makefile("rwb")
+                    self.local.stream = stream
+                    if self.db:
+                        stream.write(_encode_command("SELECT", self.db))
+                        stream.flush()
+                        _read_reply(stream)
+
+                stream.write(_encode_command(*args))
+                stream.flush()
+
+                return _read_reply(stream)
+            except (ConnectionError, OSError):
+                self.local.stream = None
+                if attempt == 1:
+                    raise
+
+    def load(self, interview_id: str) -> Optional[Dict]:
+        """Return the state of an interview."""
+
+        data = self._execute("GET", self.prefix + interview_id)
+
+        return None if data is None else json.loads(data)
+
+    def load_many(self, interview_ids: List[str]) -> List[Optional[Dict]]:
+        """Return the states of several interviews with one MGET."""
+
+        values = self._execute("MGET", *(self.prefix + interview_id for interview_id in interview_ids))
+
+        return [None if data is None else json.loads(data) for data in values]
+
+    def save(self, interview_id: str, state: Dict) -> None:
+        """Save the state of an interview with its expiry."""
+
+        self._execute("SET", self.prefix + interview_id, json.dumps(state), "EX", self.ttl)
+
+    def delete(self, interview_id: str) -> None:
+        """Delete the state of an interview."""
+
+        self._execute("DEL", self.prefix + interview_id)
+
+
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    """
+    The LocalRedisServer class, a local stand-in serving the subset of the Redis protocol the RedisStore uses (PING, SELECT, GET, MGET, SET with EX, DEL).
+
+    Attributes:
+        - data: The stored values and their expiry times.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host: str = "localhost", port: int = 6379) -> None:
+        """Bind the server. Use port 0 to pick a free port.
+
+        Attributes:
+            - host: The host to bind.
+            - port: The port to bind.
+        """
+
+        super().__init__((host, port), _RedisHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread and return it."""
+
+        thread = threading.Thread(target = self.serve_forever, daemon = True)
+        thread.start()
+
+        return thread
+
+    def _bulk(self, key: bytes) -> bytes:
+        """Return the encoded value of a key, or the null reply if it does not exist or has expired. The lock must be held."""
+
+        entry = self.data.get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time.time()):
+            self.data.pop(key, None)
+            return b"$-1\r\n"
+
+        return b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0])
+
+    def execute(self, command: List[bytes]) -> bytes:
+        """Run one command and return the encoded reply."""
+
+        name = command[0].decode().upper()
+
+        with self.lock:
+            if name == "PING":
+                return b"+PONG\r\n"
+            if name == "SELECT":
+                return b"+OK\r\n"
+            if name == "GET":
+                return self._bulk(command[1])
+            if name == "MGET":
+                return b"*%d\r\n" % (len(command) - 1) + b"".join(self._bulk(key) for key in command[1:])
+            if name == "SET":
+                expiry = None
+                if len(command) >= 5 and command[3].upper() == b"EX":
+                    expiry = time.time() + int(command[4])
+                self.data[command[1]] = (command[2], expiry)
+                return b"+OK\r\n"
+            if name == "DEL":
+                count = sum(self.data.pop(key, None) is not None for key in command[1:])
+                return b":%d\r\n" % count
+
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    """Serve the commands of one connection."""
+
+    def handle(self) -> None:
+        """Read commands until the client disconnects."""
+
+        while True:
+            try:
+                command = _read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+
+            if not isinstance(command, list) or not command:
+                self.wfile.write(b"-ERR expected a command\r\n")
+            else:
+                self.wfile.write(self.server.execute(command))
+            self.wfile.flush()
+
+
+def create_store(url: str) -> InterviewStore:
+    """Return the store described by the url.
+
+    Attributes:
+        - url: memory://?capacity=10000, sqlite:///interviews.db or redis://host:port/db. Every url takes ?ttl=<seconds>.
+    """
+
+    parsed = urlparse(url)
+    options = {key: int(values[-1]) for key, values in parse_qs(parsed.query).items()}
+
+    if parsed.scheme == "memory":
+        return MemoryStore(**options)
+    if parsed.scheme == "sqlite":
+        return SQLiteStore(parsed.path[1:] or "interviews.db", **options) # sqlite:///relative.db or sqlite:////absolute.db
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisStore(parsed.hostname or "localhost", parsed.port or 6379, db, **options)
+
+    raise ValueError("The interview store must be a memory://, sqlite:// or redis:// url!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog = "python -m interview.store", description = "Serve the local Redis stand-in.")
+    parser.add_argument("--host", default = "localhost")
+    parser.add_argument("--port", type = int, default = 6379)
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO)
+    server = LocalRedisServer(args.host, args.port)
+    logging.info("Serving the local Redis stand-in on %s:%d", args.host, args.port)
+    server.serve_forever()
@@ -0,0 +1,43 @@
+"""
+The command line interface of the match subsystem.
+
+Commands:
+    - build: Build the embedding index of a catalogue (csv, jsonl or parquet) offline, eg. python -m match build match/data.csv
+"""
+
+import argparse
+import logging
+from match.index import EmbeddingIndex, INDEX_ROOT
+from match.ingest import BATCH_SIZE, CHUNK_SIZE
+from match.registry import ENCODERS, MATCH_ENCODER, MODEL_NAME, model_id
+
+
+def main() -> None:
+    """Parse the command line and run the command."""
+
+    parser = argparse.ArgumentParser(prog = "python -m match")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    build = commands.add_parser("build", help = "Build the embedding index of a catalogue.")
+    build.add_argument("csv_file")
+    build.add_argument("--model", default = MODEL_NAME)
+    build.add_argument("--encoder", default = MATCH_ENCODER, choices = list(ENCODERS))
+    build.add_argument("--root", default = INDEX_ROOT)
+    build.add_argument("--chunk-size", type = int, default = CHUNK_SIZE)
+    build.add_argument("--batch-size", type = int, default = BATCH_SIZE)
+    build.add_argument("--force", action = "store_true", help = "Rebuild even if the catalogue has not changed.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+
+    if args.command == "build":
+        model = model_id(args.model, args.encoder)
+        if args.force:
+            index = EmbeddingIndex.build(args.csv_file, model, args.root, chunk_size = args.chunk_size, batch_size = args.batch_size, force = True)
+        else:
+            index = EmbeddingIndex.open(args.csv_file, model, args.root)
+        print(f"{index.path}: {len(index)} rows, {index.manifest['skipped']} bad lines skipped (see skipped.jsonl)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""
+The search backends of the Matcher. Each backend takes the profile matrix of the ScoringEngine and returns the best rows for a query vector.
+
+Key Features:
+    - BruteForceBackend: Exact search with one matrix product over the whole catalogue.
+    - IVFBackend: Approximate search with an inverted file index (k-means lists, only n_probe lists are scanned).
+    - VectorStoreBackend: Search through a remote vector store client (PineCone-style upsert/query API).
+      LocalVectorStore is the local stand-in for the remote store.
+
+The backend is picked by name with create_backend, eg. create_backend("ivf", matrix, n_lists = 1024, n_probe = 16).
+n_probe trades recall for latency on the IVF backend, and the vector store stand-in can simulate the network round trip.
+"""
+
+import logging
+import threading
+import time
+import numpy as np
+from match.scoring import blocked_top_k, normalize, select_top_k
+from typing import Any, Dict, List, Tuple
+
+ASSIGN_BLOCK = 8192
+
+
+class MatcherBackend:
+    """
+    The MatcherBackend class, the interface every search backend of the Matcher implements.
+
+    Attributes:
+        - snapshot: The profile matrix of shape (rows, dimension) and the live mask of its rows.
+          Both are swapped together on update, so that a search running meanwhile sees a consistent pair.
+    """
+
+    snapshot: Tuple[np.ndarray, np.ndarray]
+
+    def __init__(self, matrix: np.ndarray) -> None:
+        """Take in the profile matrix and build the backend.
+
+        Attributes:
+            - matrix: The profile matrix of shape (rows, dimension).
+        """
+
+        self.snapshot = (matrix, np.ones(matrix.shape[0], dtype = bool))
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Return the current profile matrix."""
+
+        return self.snapshot[0]
+
+    def _live(self, matrix: np.ndarray, removed: np.ndarray) -> np.ndarray:
+        """Return the live mask extended to the rows of matrix, without the removed rows."""
+
+        live = np.ones(matrix.shape[0], dtype = bool)
+        old = self.snapshot[1]
+        live[:old.shape[0]] = old
+        live[removed] = False
+
+        return live
+
+    def update(self, matrix: np.ndarray, removed: np.ndarray) -> None:
+        """Take the new profile matrix, ie. the old rows followed by the added rows, and the rows which must no longer match.
+
+        Attributes:
+            - matrix: The new profile matrix of shape (rows, dimension).
+            - removed: The indices of the removed rows.
+        """
+
+        self.snapshot = (matrix, self._live(matrix, removed))
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the row indices and scores of the k best rows for the query vector, best first.
+
+        Attributes:
+            - query: The query vector of shape (dimension,).
+            - k: The number of rows to return.
+        """
+
+        raise NotImplementedError
+
+    def search_batch(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Return the row indices and scores of the k best rows for each query vector, best first. Defaults to one search per query.
+
+        Attributes:
+            - queries: The query vectors of shape (queries, dimension).
+            - k: The number of rows to return per query.
+        """
+
+        return [self.search(query, k) for query in queries]
+
+    def search_rows(self, query: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the row indices and scores of the k best rows among the given rows, best first. Only these rows are scored, exactly,
+        so a filter resolved to its candidate rows is pushed down before the similarity scoring.
+
+        Attributes:
+            - query: The query vector of shape (dimension,).
+            - rows: The row indices to score.
+            - k: The number of rows to return.
+        """
+
+        matrix, live = self.snapshot[:2]
+
+        return _search_rows(matrix, live, rows, query, k)
+
+
+def _search_rows(matrix: np.ndarray, live: np.ndarray, rows: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Score the given rows (all of them if rows is None) and return the k best live rows."""
+
+    scores = matrix @ query if rows is None else matrix[rows] @ query
+    alive = live if rows is None else live[rows]
+
+    if alive.all():
+        best, top = select_top_k(scores, k)
+    else:
+        scores[~alive] = -np.inf
+        best, top = select_top_k(scores, k)
+        best, top = best[np.isfinite(top)], top[np.isfinite(top)]
+
+    return (best, top) if rows is None else (rows[best], top)
+
+
+class BruteForceBackend(MatcherBackend):
+    """The BruteForceBackend class, which scores every row exactly."""
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Score every row with one matrix product and return the k best rows."""
+
+        matrix, live = self.snapshot
+
+        return _search_rows(matrix, live, None, query, k)
+
+    def search_batch(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Score every query against every row in blocks (see blocked_top_k) and return the k best rows of each query."""
+
+        matrix, live = self.snapshot
+        indices, values = blocked_top_k(queries, matrix, k, None if live.all() else live)
+        found = indices >= 0
+
+        return [(rows[mask], scores[mask]) for rows, scores, mask in zip(indices, values, found)]
+
+
+class IVFBackend(MatcherBackend):
+    """
+    The IVFBackend class, which clusters the rows into n_lists lists with spherical k-means and only scans the n_probe lists closest to the query.
+
+    Attributes:
+        - n_lists: The number of lists (clusters).
+        - n_probe: The number of lists scanned per query. Higher is better recall and slower queries.
+        - centroids: The normalized centroids of the lists, shape (n_lists, dimension).
+        - assignments: The list of every row.
+        - snapshot: The profile matrix, the live mask, the row indices sorted by list and the start of each list in them.
+    """
+
+    n_lists: int
+    n_probe: int
+    centroids: np.ndarray
+    assignments: np.ndarray
+    snapshot: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+    def __init__(self, matrix: np.ndarray, n_lists: int = None, n_probe: int = 8, iterations: int = 10, train_size: int = 65536, seed: int = 0) -> None:
+        """Train the lists on a sample of the rows and assign every row to its list.
+
+        Attributes:
+            - matrix: The profile matrix of shape (rows, dimension).
+            - n_lists: The number of lists. Defaults to about the square root of the number of rows.
+            - n_probe: The number of lists scanned per query.
+            - iterations: The number of k-means iterations.
+            - train_size: The number of rows sampled to train the lists.
+            - seed: The random seed of the sampling.
+        """
+
+        super().__init__(matrix)
+        rows = matrix.shape[0]
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(rows))
+        self.n_lists = max(1, min(n_lists, rows))
+        self.n_probe = n_probe
+
+        rng = np.random.default_rng(seed)
+        if rows == 0:
+            self.centroids = np.zeros((1, matrix.shape[1]), dtype = np.float32)
+        else:
+            sample = normalize(matrix[rng.choice(rows, min(rows, train_size), replace = False)])
+            self.n_lists = min(self.n_lists, sample.shape[0])
+            self.centroids = self._train(sample, iterations, rng)
+
+        self.assignments = self._assign(matrix)
+        self.snapshot = (matrix, self.snapshot[1]) + self._lists(self.assignments)
+        logging.info("Built an IVF index of %d rows in %d lists", rows, self.n_lists)
+
+    def _train(self, sample: np.ndarray, iterations: int, rng: np.random.Generator) -> np.ndarray:
+        """Run spherical k-means on the sample and return the centroids."""
+
+        centroids = sample[rng.choice(sample.shape[0], self.n_lists, replace = False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis = 1)
+            order = np.argsort(assignments, kind = "stable")
+            counts = np.bincount(assignments, minlength = self.n_lists)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+            sums = np.zeros_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis = 0)
+            sums[~filled] = sample[rng.choice(sample.shape[0], int((~filled).sum()))] # Reseed the empty lists
+            centroids = normalize(sums)
+
+        return centroids
+
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        """Return the list of every row, in blocks to cap the memory."""
+
+        assignments = np.empty(matrix.shape[0], dtype = np.int64)
+        for start in range(0, matrix.shape[0], ASSIGN_BLOCK):
+            block = matrix[start:start + ASSIGN_BLOCK]
+            assignments[start:start + ASSIGN_BLOCK] = np.argmax(block @ self.centroids.T, axis = 1)
+
+        return assignments
+
+    def _lists(self, assignments: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the row indices sorted by list and the start of each list in them."""
+
+        order = np.argsort(assignments, kind = "stable")
+
+        return order, np.searchsorted(assignments[order], np.arange(self.n_lists + 1))
+
+    def update(self, matrix: np.ndarray, removed: np.ndarray) -> None:
+        """Assign the added rows to their lists and drop the removed rows.
+
+        Attributes:
+            - matrix: The new profile matrix of shape (rows, dimension).
+            - removed: The indices of the removed rows.
+        """
+
+        added = self._assign(matrix[self.assignments.shape[0]:])
+        self.assignments = np.concatenate((self.assignments, added))
+        self.snapshot = (matrix, self._live(matrix, removed)) + self._lists(self.assignments)
+
+    def search(self, query: np.ndarray, k: int, n_probe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Scan the n_probe closest lists and return the k best rows.
+
+        Attributes:
+            - query: The query vector of shape (dimension,).
+            - k: The number of rows to return.
+            - n_probe: Override the number of lists scanned for this query.
+        """
+
+        matrix, live, order, offsets = self.snapshot
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        lists, _ = select_top_k(self.centroids @ query, n_probe)
+        rows = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in lists])
+
+        return _search_rows(matrix, live, rows, query, k)
+
+
+class LocalVectorStore:
+    """
+    The LocalVectorStore class, a local stand-in for a remote vector store index with the PineCone-style upsert/query API.
+
+    Attributes:
+        - index: The name of the backend searching the stored vectors (brute or ivf).
+        - index_options: The options of that backend.
+        - latency_ms: The simulated network round trip per call, in milliseconds.
+        - namespaces: The stored ids and vectors of each namespace.
+    """
+
+    index: str
+    index_options: Dict
+    latency_ms: float
+    namespaces: Dict[str, Dict]
+
+    def __init__(self, index: str = "brute", latency_ms: float = 0.0, **index_options: Any) -> None:
+        """Initialize an empty store.
+
+        Attributes:
+            - index: The name of the backend searching the stored vectors (brute or ivf).
+            - latency_ms: The simulated network round trip per call, in milliseconds.
+            - index_options: The options of that backend.
+        """
+
+        self.index = index
+        self.index_options = index_options
+        self.latency_ms = latency_ms
+        self.namespaces = {}
+        self.lock = threading.Lock()
+
+    def _round_trip(self) -> None:
+        """Simulate the network round trip."""
+
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+
+    def upsert(self, vectors: List[Dict], namespace: str = "") -> Dict:
+        """Insert or replace vectors, given as {"id": ..., "values": [...], "metadata": {...}}.
+
+        Attributes:
+            - vectors: The vectors to upsert.
+            - namespace: The namespace of the vectors.
+        """
+
+        self._round_trip()
+
+        with self.lock:
+            space = self.namespaces.setdefault(namespace, {"ids": [], "positions": {}, "values": [], "metadata": [], "backend": None})
+
+            for vector in vectors:
+                position = space["positions"].get(vector["id"])
+                values = np.asarray(vector["values"], dtype = np.float32)
+                if position is None:
+                    space["positions"][vector["id"]] = len(space["ids"])
+                    space["ids"].append(vector["id"])
+                    space["values"].append(values)
+                    space["metadata"].append(vector.get("metadata"))
+                else:
+                    space["values"][position] = values
+                    space["metadata"][position] = vector.get("metadata")
+
+            space["backend"] = None # Rebuilt on the next query
+
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids: List[str], namespace: str = "") -> Dict:
+        """Delete vectors by id.
+
+        Attributes:
+            - ids: The ids of the vectors.
+            - namespace: The namespace of the vectors.
+        """
+
+        self._round_trip()
+
+        with self.lock:
+            space = self.namespaces.get(namespace)
+            if space is None:
+                return {}
+
+            for id in ids:
+                position = space["positions"].pop(id, None)
+                if position is None:
+                    continue
+
+                # Move the last vector into the freed position
+                last = len(space["ids"]) - 1
+                for key in ("ids", "values", "metadata"):
+                    space[key][position] = space[key][last]
+                    space[key].pop()
+                if position != last:
+                    space["positions"][space["ids"][position]] = position
+
+            space["backend"] = None
+
+        return {}
+
+    def query(self, vector: List[float], top_k: int = 10, namespace: str = "", include_metadata: bool = False) -> Dict:
+        """Return the top_k closest vectors as {"matches": [{"id": ..., "score": ...}]}.
+
+        Attributes:
+            - vector: The query vector.
+            - top_k: The number of matches.
+            - namespace: The namespace to search.
+            - include_metadata: Whether to return the metadata of the matches.
+        """
+
+        self._round_trip()
+
+        with self.lock:
+            space = self.namespaces.get(namespace)
+            if space is None or not space["ids"]:
+                return {"matches": []}
+
+            if space["backend"] is None:
+                space["backend"] = create_backend(self.index, np.stack(space["values"]), **self.index_options)
+            backend, ids = space["backend"], list(space["ids"])
+
+        positions, scores = backend.search(np.asarray(vector, dtype = np.float32), top_k)
+        matches = []
+        for position, score in zip(positions, scores):
+            match = {"id": ids[position], "score": float(score)}
+            if include_metadata:
+                match["metadata"] = space["metadata"][position]
+            matches.append(match)
+
+        return {"matches": matches}
+
+
+class VectorStoreBackend(MatcherBackend):
+    """
+    The VectorStoreBackend class, which upserts the rows into a vector store and searches through its query API.
+
+    Attributes:
+        - client: The vector store index client. Defaults to a LocalVectorStore.
+        - namespace: The namespace of the catalogue in the store.
+    """
+
+    client: Any
+    namespace: str
+
+    def __init__(self, matrix: np.ndarray, client: Any = None, namespace: str = "catalogue", batch_size: int = 1000, **store_options: Any) -> None:
+        """Upsert every row into the store, with the row index as the id.
+
+        Attributes:
+            - matrix: The profile matrix of shape (rows, dimension).
+            - client: The vector store index client. Defaults to a LocalVectorStore built with store_options.
+            - namespace: The namespace of the catalogue in the store.
+            - batch_size: The number of vectors per upsert call.
+        """
+
+        super().__init__(matrix)
+        self.client = client if client is not None else LocalVectorStore(**store_options)
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self._upsert(matrix, 0)
+
+    def _upsert(self, matrix: np.ndarray, start: int) -> None:
+        """Upsert the rows of the matrix from start onwards."""
+
+        for offset in range(start, matrix.shape[0], self.batch_size):
+            block = matrix[offset:offset + self.batch_size]
+            self.client.upsert(vectors = [{"id": str(offset + i), "values": values.tolist()} for i, values in enumerate(block)], namespace = self.namespace)
+
+    def update(self, matrix: np.ndarray, removed: np.ndarray) -> None:
+        """Upsert the added rows and delete the removed rows from the store."""
+
+        start = self.matrix.shape[0]
+        self._upsert(matrix, start)
+        if len(removed) > 0:
+            self.client.delete(ids = [str(row) for row in removed], namespace = self.namespace)
+        super().update(matrix, removed)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Query the store and return the k best rows."""
+
+        response = self.client.query(vector = query.tolist(), top_k = k, namespace = self.namespace)
+        matches = response["matches"]
+
+        return np.array([int(m["id"]) for m in matches], dtype = np.int64), np.array([m["score"] for m in matches], dtype = np.float32)
+
+
+BACKENDS = {
+    "brute": BruteForceBackend,
+    "ivf": IVFBackend,
+    "vector_store": VectorStoreBackend
+}
+
+def create_backend(name: str, matrix: np.ndarray, **options: Any) -> MatcherBackend:
+    """Return the backend called name built over the matrix.
+
+    Attributes:
+        - name: The name of the backend (brute, ivf or vector_store).
+        - matrix: The profile matrix of shape (rows, dimension).
+        - options: The options of the backend, eg. n_probe for ivf.
+    """
+
+    if name not in BACKENDS:
+        raise ValueError(f"The backend must be one of: {', '.join(BACKENDS)}!")
+
+    return BACKENDS[name](matrix, **options)
@@ -0,0 +1,198 @@
+"""
+The query embedding cache, which lets repeated match requests skip the Sentence Transformer forward pass.
+
+Key Features:
+    - Key each embedding by the model id and the hash of the normalized text (whitespace collapsed, unicode NFC).
+    - Keep the most recently used embeddings in memory, evicting the least recently used over a capacity.
+    - Optionally keep them on disk in a SQLite database shared by the gunicorn workers of a machine.
+    - Count the hits and misses (see QueryCache.stats).
+
+The cache of the process is picked by url with MATCH_QUERY_CACHE, eg. memory://?capacity=10000, sqlite:///match/.index/queries.db or off.
+Only the queries (the impressions) go through it: the catalogue is encoded once by the index build (see match/ingest.py).
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from match.registry import MODEL_ID, get_model
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+def normalize_text(text: str) -> str:
+    """Return the text in the form it is keyed by: NFC with the whitespace collapsed."""
+
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def text_key(model_id: str, text: str) -> str:
+    """Return the key of the embedding of a text by a model."""
+
+    return hashlib.sha256(f"{model_id}\0{normalize_text(text)}".encode()).hexdigest()
+
+
+class QueryCache:
+    """
+    The QueryCache class, which keeps the query embeddings in memory and, optionally, in a SQLite database.
+
+    Attributes:
+        - capacity: The maximum number of embeddings kept in memory.
+        - path: The filepath of the SQLite database, or None to keep the embeddings in memory only.
+        - embeddings: The embeddings by key, least recently used first.
+        - hits, misses: The counters of the lookups.
+    """
+
+    capacity: int
+    path: Optional[str]
+    embeddings: OrderedDict
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int = 10000, path: str = None) -> None:
+        """Initialize the QueryCache.
+
+        Attributes:
+            - capacity: The maximum number of embeddings kept in memory.
+            - path: The filepath of the SQLite database, or None to keep the embeddings in memory only.
+        """
+
+        self.capacity = capacity
+        self.path = path
+        self.embeddings = OrderedDict()
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+            self._connection().execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection of the current thread, opening a new one in a forked worker."""
+
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout = 30, isolation_level = None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection, self.local.pid = connection, os.getpid()
+
+        return self.local.connection
+
+    def _load(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return the embeddings of the keys found in the database."""
+
+        if self.path is None or not keys:
+            return {}
+
+        stored = {}
+        for start in range(0, len(keys), 500): # Below the SQLite limit of parameters per statement
+            block = keys[start:start + 500]
+            marks = ", ".join("?" * len(block))
+            rows = self._connection().execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", block).fetchall()
+            stored.update((key, np.frombuffer(vector, dtype = np.float32)) for key, vector in rows)
+
+        return stored
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        """Keep an embedding in memory, evicting the least recently used over capacity. The lock must be held."""
+
+        self.embeddings[key] = vector
+        self.embeddings.move_to_end(key)
+        while len(self.embeddings) > self.capacity:
+            self.embeddings.popitem(last = False)
+
+    def encode(self, texts: List[str], model_id: str = MODEL_ID) -> np.ndarray:
+        """Return the embeddings of the texts, shape (texts, dimension). Only the texts missing from the cache are encoded, in one batch.
+
+        Attributes:
+            - texts: The texts.
+            - model_id: The model id (see match/registry.py).
+        """
+
+        keys = [text_key(model_id, text) for text in texts]
+        found = {}
+
+        with self.lock:
+            for key in keys:
+                if key in self.embeddings:
+                    self.embeddings.move_to_end(key)
+                    found[key] = self.embeddings[key]
+
+        stored = self._load([key for key in set(keys) if key not in found])
+        found.update(stored)
+
+        first = {}
+        for text, key in zip(texts, keys):
+            if key not in found:
+                first.setdefault(key, text) # Each missing text is encoded once
+        missing = list(first)
+        if missing:
+            vectors = np.asarray(get_model(model_id).encode([first[key] for key in missing]), dtype = np.float32)
+            found.update(zip(missing, vectors))
+
+            if self.path is not None:
+                self._connection().executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                               [(key, vector.tobytes()) for key, vector in zip(missing, vectors)])
+
+        with self.lock:
+            misses = sum(1 for key in keys if key in first)
+            self.misses += misses
+            self.hits += len(keys) - misses
+            for key in list(stored) + missing:
+                self._remember(key, found[key])
+
+        return np.stack([found[key] for key in keys]) if keys else np.empty((0, 0), dtype = np.float32)
+
+    def stats(self) -> Dict:
+        """Return the counters of the cache."""
+
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.embeddings)
+        }
+
+
+def create_query_cache(url: str) -> Optional[QueryCache]:
+    """Return the cache described by the url, or None if the url is off.
+
+    Attributes:
+        - url: off, memory://?capacity=10000 or sqlite:///match/.index/queries.db?capacity=10000.
+    """
+
+    if url in ("", "off", "none"):
+        return None
+
+    parsed = urlparse(url)
+    options = {key: int(values[-1]) for key, values in parse_qs(parsed.query).items()}
+
+    if parsed.scheme == "memory":
+        return QueryCache(**options)
+    if parsed.scheme == "sqlite":
+        return QueryCache(path = parsed.path[1:] or "match/.index/queries.db", **options) # sqlite:///relative.db or sqlite:////absolute.db
+
+    raise ValueError("The query cache must be off, or a memory:// or sqlite:// url!")
+
+
+_LOCK = threading.Lock()
+_CACHE = None
+_CREATED = False
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    """Return the query cache of the process, created from MATCH_QUERY_CACHE on the first call (memory:// by default)."""
+
+    global _CACHE, _CREATED
+
+    with _LOCK:
+        if not _CREATED:
+            _CACHE = create_query_cache(os.getenv("MATCH_QUERY_CACHE", "memory://"))
+            _CREATED = True
+
+        return _CACHE
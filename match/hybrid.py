@@ -0,0 +1,347 @@
+"""
+The hybrid retrieval of the Matcher: lexical scores over the text fields, metadata filters, and the fusion of both with the embedding score.
+
+Key Features:
+    - LexicalIndex: An inverted index of the text fields of the schema, scored with BM25.
+    - MetadataIndex: The rows of each value of the filterable columns of the schema, so that a filter resolves to its candidate rows
+      before any scoring, and filtered queries only touch those rows.
+    - Fuse the embedding and the BM25 scores with a weighted sum or with reciprocal rank fusion, picked by name with create_fusion.
+
+Both indexes are built from the records of the EmbeddingIndex and grow with it: a row of the index is a row of the embedding matrix.
+Deleted rows stay in the postings and are masked out by the live mask of the backend, like in the embedding search.
+The BM25 statistics (document count and mean length) include them until the Matcher is rebuilt.
+
+Example:
+    create_fusion("weighted:0.7") weighs the cosine 0.7 and the BM25 score (scaled to the best candidate) 0.3.
+    create_fusion("rrf:60") sums 1 / (60 + rank) over the two rankings.
+"""
+
+import re
+import numpy as np
+from collections import Counter
+from match.scoring import select_top_k
+from typing import Any, Dict, Iterable, List, Tuple
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the their they this to was were will with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Return the lowercase word tokens of a text, without the stop words."""
+
+    return [token for token in TOKEN.findall(str(text).lower()) if token not in STOP_WORDS]
+
+def filter_value(value: Any) -> str:
+    """Return the form a metadata value is indexed and filtered by, or None for a missing value."""
+
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+
+    return str(value).strip().lower()
+
+
+class LexicalIndex:
+    """
+    The LexicalIndex class, an inverted index of the text fields scored with BM25.
+
+    Attributes:
+        - fields: The text fields of the records which are indexed.
+        - k1: The BM25 term frequency saturation.
+        - b: The BM25 length normalisation.
+        - snapshot: The postings (term -> rows, term frequencies), the length of every row and the total length.
+          They are swapped together on append, so that a search running meanwhile sees a consistent state.
+    """
+
+    fields: List[str]
+    k1: float
+    b: float
+    snapshot: Tuple[Dict[str, Tuple[np.ndarray, np.ndarray]], np.ndarray, float]
+
+    def __init__(self, fields: List[str], records: Iterable[Dict] = (), k1: float = 1.2, b: float = 0.75) -> None:
+        """Index the records.
+
+        Attributes:
+            - fields: The text fields of the records which are indexed.
+            - records: The records, in row order.
+            - k1: The BM25 term frequency saturation.
+            - b: The BM25 length normalisation.
+        """
+
+        self.fields = fields
+        self.k1 = k1
+        self.b = b
+        self.snapshot = ({}, np.empty(0, dtype = np.float32), 0.0)
+        self.append(records)
+
+    def __len__(self) -> int:
+        """Return the number of rows indexed."""
+
+        return self.snapshot[1].shape[0]
+
+    def append(self, records: Iterable[Dict]) -> None:
+        """Index the records as the next rows.
+
+        Attributes:
+            - records: The records, in row order.
+        """
+
+        postings, lengths, total = self.snapshot
+        start = lengths.shape[0]
+        added_rows, added_counts, added_lengths = {}, {}, []
+
+        for row, record in enumerate(records, start = start):
+            counts = Counter(tokenize(" ".join(str(record.get(field) or "") for field in self.fields)))
+            added_lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                added_rows.setdefault(term, []).append(row)
+                added_counts.setdefault(term, []).append(count)
+
+        if not added_lengths:
+            return
+
+        postings = dict(postings) # Only the terms of the new rows are copied
+        for term, rows in added_rows.items():
+            rows, counts = np.array(rows, dtype = np.int64), np.array(added_counts[term], dtype = np.float32)
+            if term in postings:
+                old_rows, old_counts = postings[term]
+                rows, counts = np.concatenate((old_rows, rows)), np.concatenate((old_counts, counts))
+            postings[term] = (rows, counts) # The rows of a term stay sorted
+
+        lengths = np.concatenate((lengths, np.array(added_lengths, dtype = np.float32)))
+        self.snapshot = (postings, lengths, total + float(sum(added_lengths)))
+
+    def _terms(self, postings: Dict, count: int, text: str) -> List[Tuple[np.ndarray, np.ndarray, float]]:
+        """Return the postings and the idf of the known terms of the query, out of count rows."""
+
+        terms = []
+        for term in set(tokenize(text)):
+            if term in postings:
+                rows, counts = postings[term]
+                terms.append((rows, counts, float(np.log(1 + (count - rows.shape[0] + 0.5) / (rows.shape[0] + 0.5)))))
+
+        return terms
+
+    def _weights(self, counts: np.ndarray, lengths: np.ndarray, idf: float, mean: float) -> np.ndarray:
+        """Return the BM25 weight of term occurrences in rows of the given lengths, the mean length being mean."""
+
+        return idf * counts * (self.k1 + 1) / (counts + self.k1 * (1 - self.b + self.b * lengths / max(mean, 1e-12)))
+
+    def scores(self, text: str, rows: np.ndarray) -> np.ndarray:
+        """Return the BM25 score of the query for the given rows only. The postings are probed for each row, the other rows are not touched.
+
+        Attributes:
+            - text: The query.
+            - rows: The sorted row indices.
+        """
+
+        postings, lengths, total = self.snapshot
+        mean = total / max(lengths.shape[0], 1)
+        scores = np.zeros(rows.shape[0], dtype = np.float32)
+
+        for posting_rows, counts, idf in self._terms(postings, lengths.shape[0], text):
+            positions = np.minimum(np.searchsorted(posting_rows, rows), posting_rows.shape[0] - 1)
+            hit = posting_rows[positions] == rows
+            scores[hit] += self._weights(counts[positions[hit]], lengths[rows[hit]], idf, mean)
+
+        return scores
+
+    def search(self, text: str, k: int, rows: np.ndarray = None, live: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the row indices and BM25 scores of the k best rows for the query, best first. Rows without any query term are not returned.
+
+        Attributes:
+            - text: The query.
+            - k: The number of rows to return.
+            - rows: Only score these sorted rows, eg. the candidates of a filter. Defaults to every row.
+            - live: The mask of the rows which may be returned. The rows past its end are not returned.
+        """
+
+        if rows is not None:
+            scores = self.scores(text, rows)
+        else:
+            postings, lengths, total = self.snapshot
+            mean = total / max(lengths.shape[0], 1)
+            scores = np.zeros(lengths.shape[0], dtype = np.float32)
+            for posting_rows, counts, idf in self._terms(postings, lengths.shape[0], text):
+                scores[posting_rows] += self._weights(counts, lengths[posting_rows], idf, mean) # The rows of a posting are unique
+            rows = np.arange(lengths.shape[0])
+
+        if live is not None:
+            inside = rows < live.shape[0]
+            scores[~inside] = 0.0
+            scores[inside] *= live[rows[inside]]
+        matched = scores > 0
+        best, top = select_top_k(scores[matched], k)
+
+        return rows[matched][best], top
+
+
+class MetadataIndex:
+    """
+    The MetadataIndex class, which holds the rows of every value of the filterable columns.
+
+    Attributes:
+        - columns: The filterable columns.
+        - snapshot: The sorted rows of each value of each column, and the number of rows indexed.
+    """
+
+    columns: List[str]
+    snapshot: Tuple[Dict[str, Dict[str, np.ndarray]], int]
+
+    def __init__(self, columns: List[str], records: Iterable[Dict] = ()) -> None:
+        """Index the records.
+
+        Attributes:
+            - columns: The filterable columns.
+            - records: The records, in row order.
+        """
+
+        self.columns = columns
+        self.snapshot = ({column: {} for column in columns}, 0)
+        self.append(records)
+
+    def __len__(self) -> int:
+        """Return the number of rows indexed."""
+
+        return self.snapshot[1]
+
+    def append(self, records: Iterable[Dict]) -> None:
+        """Index the records as the next rows.
+
+        Attributes:
+            - records: The records, in row order.
+        """
+
+        values, start = self.snapshot
+        added = {column: {} for column in self.columns}
+        count = start
+
+        for row, record in enumerate(records, start = start):
+            for column in self.columns:
+                value = filter_value(record.get(column))
+                if value is not None:
+                    added[column].setdefault(value, []).append(row)
+            count = row + 1
+
+        if count == start:
+            return
+
+        values = {column: dict(rows) for column, rows in values.items()}
+        for column, rows_by_value in added.items():
+            for value, rows in rows_by_value.items():
+                rows = np.array(rows, dtype = np.int64)
+                old = values[column].get(value)
+                values[column][value] = rows if old is None else np.concatenate((old, rows))
+
+        self.snapshot = (values, count)
+
+    def rows(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Return the sorted rows matching every filter. A filter is a value or a list of values, any of which matches.
+
+        Attributes:
+            - filters: The value or values of each filterable column, eg. {"sector": "Healthcare", "location": ["Singapore", "Malaysia"]}.
+        """
+
+        values, count = self.snapshot
+        unknown = [column for column in filters if column not in values]
+        if unknown:
+            raise ValueError(f"The columns {', '.join(unknown)} are not filterable! The schema declares: {', '.join(self.columns)}.")
+
+        matched = np.arange(count)
+        for column, wanted in filters.items():
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            found = [values[column][key] for key in map(filter_value, wanted) if key in values[column]]
+            rows = np.unique(np.concatenate(found)) if len(found) > 1 else (found[0] if found else np.empty(0, dtype = np.int64))
+            matched = np.intersect1d(matched, rows, assume_unique = True)
+            if matched.shape[0] == 0:
+                break
+
+        return matched
+
+
+class Fusion:
+    """
+    The Fusion class, the embedding score alone. Fusions combine the cosine and the BM25 score of the candidates of both searches.
+
+    Attributes:
+        - hybrid: Whether the fusion uses the BM25 score.
+    """
+
+    hybrid: bool = False
+
+    def fuse(self, cosines: np.ndarray, lexical: np.ndarray, semantic_ranks: np.ndarray, lexical_ranks: np.ndarray) -> np.ndarray:
+        """Return the fused score of every candidate.
+
+        Attributes:
+            - cosines: The cosine of every candidate.
+            - lexical: The BM25 score of every candidate.
+            - semantic_ranks, lexical_ranks: The rank of every candidate in each search, starting at 1, or inf if it was not found by it.
+        """
+
+        return cosines
+
+
+class WeightedFusion(Fusion):
+    """
+    The WeightedFusion class, a weighted sum of the cosine and of the BM25 score scaled to the best candidate.
+
+    Attributes:
+        - alpha: The weight of the cosine. The BM25 score weighs 1 - alpha.
+    """
+
+    hybrid = True
+    alpha: float
+
+    def __init__(self, alpha: float = 0.7) -> None:
+        """Initialize the WeightedFusion class."""
+
+        self.alpha = alpha
+
+    def fuse(self, cosines: np.ndarray, lexical: np.ndarray, semantic_ranks: np.ndarray, lexical_ranks: np.ndarray) -> np.ndarray:
+        """Return alpha * cosine + (1 - alpha) * BM25 / best BM25."""
+
+        top = lexical.max() if lexical.shape[0] else 0.0
+
+        return self.alpha * cosines + (1 - self.alpha) * (lexical / top if top > 0 else lexical)
+
+
+class ReciprocalRankFusion(Fusion):
+    """
+    The ReciprocalRankFusion class, the sum of 1 / (k + rank) over both rankings. It only uses the ranks, so the scales do not matter.
+
+    Attributes:
+        - k: The rank offset, which dampens the weight of the first ranks.
+    """
+
+    hybrid = True
+    k: int
+
+    def __init__(self, k: int = 60) -> None:
+        """Initialize the ReciprocalRankFusion class."""
+
+        self.k = k
+
+    def fuse(self, cosines: np.ndarray, lexical: np.ndarray, semantic_ranks: np.ndarray, lexical_ranks: np.ndarray) -> np.ndarray:
+        """Return 1 / (k + semantic rank) + 1 / (k + lexical rank). A missing rank adds nothing."""
+
+        return (1 / (self.k + semantic_ranks) + 1 / (self.k + lexical_ranks)).astype(np.float32)
+
+
+def create_fusion(spec: str) -> Fusion:
+    """Return the fusion described by the spec.
+
+    Attributes:
+        - spec: semantic (the cosine alone), weighted[:alpha] or rrf[:k].
+    """
+
+    name, _, option = spec.partition(":")
+
+    if name == "semantic":
+        return Fusion()
+    if name == "weighted":
+        return WeightedFusion(float(option)) if option else WeightedFusion()
+    if name == "rrf":
+        return ReciprocalRankFusion(int(option)) if option else ReciprocalRankFusion()
+
+    raise ValueError("The fusion must be semantic, weighted[:alpha] or rrf[:k]!")
@@ -0,0 +1,680 @@
+"""
+The EmbeddingIndex class which keeps the precomputed embeddings of the company catalogue on disk.
+
+Key Features:
+    - Build the index offline from the csv file (python -m match build match/data.csv).
+    - Stream the catalogue (csv, jsonl or parquet) in chunks and append each chunk to disk, so the peak memory is bounded (see match/ingest.py).
+    - Store the embeddings as a memory-mapped float32 matrix with a records sidecar, read one record at a time.
+    - Only encode the text fields declared by the Schema (see match/schema.py).
+    - Key the index by the csv file (its name and path), the model id (the model name and encoder backend), the schema fields
+      and a content hash of the csv file.
+    - Only rebuild the index when the source data changes.
+    - Upsert and delete single profiles by id: only the changed rows are encoded and appended, and the manifest is replaced atomically.
+    - Keep the upserts and deletes in a change log next to the indexes, replayed by every rebuild, so that editing the catalogue does not lose them.
+    - Compact the index once enough of its rows are deleted, so that the data files and the manifest stay bounded.
+
+An index directory (match/.index/<csv>-<path hash>-<model>-<schema>-<hash>/) has the following files:
+    - manifest.json: The model id, source hash, shape, fields, columns, deleted rows, generation and data files of the index.
+      It is the commit point of every write: rows past its shape are ignored until the next write truncates them.
+    - embeddings.f32: The raw float32 matrix of shape (rows, fields, dimension), normalized per field.
+    - records.jsonl: One json record per row, in the same order as the matrix.
+    - offsets.i64: The byte offset of each record in records.jsonl, followed by the size of the file.
+      A compaction writes the live rows to new data files (eg. embeddings.2.f32) and commits them by replacing the manifest.
+    - skipped.jsonl: The bad lines of the catalogue which were skipped.
+    - lock: The lock file serialising the writers of every process.
+
+The data files are append-only between compactions: an upsert appends the new version of a profile and marks the old row as deleted.
+The change log (match/.index/<csv>-<path hash>.changes.jsonl) holds the last version of every profile written by id, or its deletion.
+It takes precedence over the catalogue: delete it to discard the changes made through the API.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from match.ingest import BATCH_SIZE, CHUNK_SIZE, encode_chunk, log_skipped, read_chunks
+from match.registry import MODEL_ID
+from match.schema import DEFAULT_SCHEMA, Schema
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+INDEX_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".index")
+FORMAT_VERSION = 3
+HASH_CHUNK = 1 << 20
+COMPACT_FRACTION = 0.25 # Compact once this fraction of the rows is deleted
+COMPACT_MIN = 64 # ...and at least this many rows
+DATA_FILES = ("embeddings.f32", "records.jsonl", "offsets.i64")
+
+
+def _slug(text: str) -> str:
+    """Turn a name into something safe for a directory name."""
+
+    return re.sub(r"[^A-Za-z0-9]+", "-", text).strip("-").lower()
+
+def _write_json(path: str, data: Dict) -> None:
+    """Write a json file atomically by replacing it with a temporary file."""
+
+    directory = os.path.dirname(path)
+    handle, tmp = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+
+    with os.fdopen(handle, "w") as f:
+        json.dump(data, f)
+
+    os.replace(tmp, path)
+
+def _data_file(path: str, suffix: str, name: str) -> str:
+    """Return the path of a data file of the index, eg. embeddings.2.f32 for the suffix .2 of the second compaction."""
+
+    stem, extension = os.path.splitext(name)
+
+    return os.path.join(path, f"{stem}{suffix}{extension}")
+
+def _fsync(path: str) -> None:
+    """Flush a file to disk."""
+
+    fd = os.open(path, os.O_RDONLY)
+    os.fsync(fd)
+    os.close(fd)
+
+def _record_lines(chunk: pd.DataFrame) -> List[bytes]:
+    """Return the records of a chunk as json lines."""
+
+    return [line.encode() + b"\n" for line in chunk.to_json(orient = "records", lines = True).splitlines()]
+
+def hash_file(path: str) -> str:
+    """Return the sha256 content hash of a file.
+
+    Attributes:
+        - path: The filepath to be hashed.
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def source_hash(csv_file: str, root: str = INDEX_ROOT) -> str:
+    """Return the content hash of the csv file, reusing the last hash if the file has not been modified.
+
+    Attributes:
+        - csv_file: The csv filepath.
+        - root: The directory holding the indexes.
+    """
+
+    os.makedirs(root, exist_ok = True)
+    sources_file = os.path.join(root, "sources.json")
+    path = os.path.abspath(csv_file)
+    stat = os.stat(path)
+
+    try:
+        with open(sources_file) as f:
+            sources = json.load(f)
+    except (FileNotFoundError, ValueError):
+        sources = {}
+
+    known = sources.get(path)
+    if known is not None and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        return known["hash"]
+
+    digest = hash_file(path)
+    sources[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest}
+    _write_json(sources_file, sources)
+
+    return digest
+
+
+def _catalogue_name(csv_file: str) -> str:
+    """Return the name of a catalogue in the index directory: its file name and a short hash of its absolute path,
+    so that catalogues with the same file name in different directories never share their indexes."""
+
+    path = os.path.abspath(csv_file)
+    stem = os.path.splitext(os.path.basename(path))[0]
+
+    return f"{_slug(stem)}-{hashlib.sha256(path.encode()).hexdigest()[:8]}"
+
+def changes_file(csv_file: str, root: str = INDEX_ROOT) -> str:
+    """Return the change log of a catalogue, shared by its indexes of every model, schema and content hash.
+
+    Attributes:
+        - csv_file: The filepath of the catalogue.
+        - root: The directory holding the indexes.
+    """
+
+    return os.path.join(root, f"{_catalogue_name(csv_file)}.changes.jsonl")
+
+def read_changes(path: str) -> Dict[str, Optional[Dict]]:
+    """Return the last change of each profile id in a change log: its record, or None if it was deleted.
+
+    Attributes:
+        - path: The change log.
+    """
+
+    changes = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError: # A line cut short by a crash
+                    continue
+                changes[str(change["id"])] = change.get("record")
+    except FileNotFoundError:
+        pass
+
+    return changes
+
+def compact_changes(path: str) -> None:
+    """Rewrite a change log with only the last change of each profile id.
+
+    Attributes:
+        - path: The change log.
+    """
+
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        changes = read_changes(path)
+        if not changes:
+            return
+
+        handle, tmp = tempfile.mkstemp(dir = os.path.dirname(path), suffix = ".tmp")
+        with os.fdopen(handle, "w") as f:
+            for id, record in changes.items():
+                f.write(json.dumps({"id": id} if record is None else {"id": id, "record": record}) + "\n")
+        os.replace(tmp, path)
+
+
+class RecordStore:
+    """
+    The RecordStore class which reads the records of an index one at a time, without loading the whole file.
+
+    Attributes:
+        - offsets: The memory-mapped byte offsets of the records, shape (rows + 1,).
+        - data: The memory-mapped records.jsonl file.
+    """
+
+    offsets: np.ndarray
+    data: mmap.mmap
+
+    def __init__(self, path: str, rows: int, suffix: str = "") -> None:
+        """Open the records of the index stored in path.
+
+        Attributes:
+            - path: The directory of the index.
+            - rows: The number of records.
+            - suffix: The suffix of the data files, after a compaction.
+        """
+
+        self.offsets = np.memmap(_data_file(path, suffix, "offsets.i64"), dtype = np.int64, mode = "r", shape = (rows + 1,))
+        self.data = None
+
+        if self.offsets[rows] > 0:
+            with open(_data_file(path, suffix, "records.jsonl"), "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        """Return the number of records."""
+
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, row: int) -> Dict:
+        """Return the record of a row."""
+
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+
+        return json.loads(self.line(row))
+
+    def line(self, row: int) -> bytes:
+        """Return the json line of a row."""
+
+        return self.data[self.offsets[row]:self.offsets[row + 1]]
+
+    def __iter__(self) -> Iterator[Dict]:
+        """Iterate over the records."""
+
+        for row in range(len(self)):
+            yield self[row]
+
+
+class IndexWriter:
+    """
+    The IndexWriter class which appends chunks of embeddings and records to a new index directory.
+
+    Attributes:
+        - path: The temporary directory being written.
+        - rows: The number of rows written so far.
+        - dimension: The dimension of the embeddings.
+        - columns: The columns seen so far.
+    """
+
+    path: str
+    rows: int
+    dimension: int
+    columns: List[str]
+
+    def __init__(self, root: str) -> None:
+        """Create a temporary index directory in root.
+
+        Attributes:
+            - root: The directory holding the indexes.
+        """
+
+        self.path = tempfile.mkdtemp(dir = root, prefix = ".build-")
+        self.rows = 0
+        self.dimension = 0
+        self.columns = []
+        self.offset = 0
+
+        self.embeddings_file = open(os.path.join(self.path, "embeddings.f32"), "wb")
+        self.records_file = open(os.path.join(self.path, "records.jsonl"), "wb")
+        self.offsets_file = open(os.path.join(self.path, "offsets.i64"), "wb")
+
+    def append(self, chunk: pd.DataFrame, embeddings: np.ndarray) -> None:
+        """Append a chunk of records and its embeddings of shape (rows, fields, dimension).
+
+        Attributes:
+            - chunk: The chunk of the catalogue.
+            - embeddings: The normalized embeddings of the chunk.
+        """
+
+        lines = _record_lines(chunk)
+        sizes = np.fromiter((len(line) for line in lines), dtype = np.int64, count = len(lines))
+        offsets = self.offset + np.concatenate(([0], np.cumsum(sizes)[:-1])) if len(lines) else sizes
+
+        embeddings.astype(np.float32).tofile(self.embeddings_file)
+        self.records_file.write(b"".join(lines))
+        offsets.astype(np.int64).tofile(self.offsets_file)
+
+        self.offset += int(sizes.sum())
+        self.rows += len(lines)
+        self.dimension = embeddings.shape[2]
+        self.columns += [column for column in chunk.columns if column not in self.columns]
+
+    def close(self) -> None:
+        """Write the final offset and close the files."""
+
+        np.array([self.offset], dtype = np.int64).tofile(self.offsets_file)
+        for f in (self.embeddings_file, self.records_file, self.offsets_file):
+            f.close()
+
+    def abort(self) -> None:
+        """Close the files and remove the temporary directory."""
+
+        for f in (self.embeddings_file, self.records_file, self.offsets_file):
+            f.close()
+        shutil.rmtree(self.path, ignore_errors = True)
+
+
+class EmbeddingIndex:
+    """
+    The EmbeddingIndex class which opens a prebuilt index of the company catalogue.
+
+    Attributes:
+        - path: The directory of the index.
+        - manifest: The manifest of the index (model, source hash, shape, fields, columns and change log).
+        - embeddings: The memory-mapped embeddings of shape (rows, fields, dimension).
+        - records: The RecordStore of the rows of the catalogue, in the same order as the embeddings.
+        - deleted: The rows which were deleted or replaced by an upsert.
+    """
+
+    path: str
+    manifest: Dict
+    embeddings: np.ndarray
+    records: RecordStore
+    deleted: Set[int]
+
+    def __init__(self, path: str) -> None:
+        """Open the index stored in path.
+
+        Attributes:
+            - path: The directory of the index.
+        """
+
+        self.path = path
+        self.lock = threading.RLock()
+        self.rows_by_id = None # Built on the first write
+        self.mtime = None
+        self._load()
+
+    def _load(self) -> None:
+        """Read the manifest and map the data files."""
+
+        manifest_file = os.path.join(self.path, "manifest.json")
+        self.mtime = os.stat(manifest_file).st_mtime_ns
+
+        with open(manifest_file) as f:
+            self.manifest = json.load(f)
+
+        shape = tuple(self.manifest["shape"])
+        suffix = self.manifest.get("data", "")
+        if shape[0] == 0:
+            self.embeddings = np.zeros(shape, dtype = np.float32)
+        else:
+            self.embeddings = np.memmap(_data_file(self.path, suffix, "embeddings.f32"), dtype = np.float32, mode = "r", shape = shape)
+
+        self.records = RecordStore(self.path, shape[0], suffix)
+        self.deleted = set(self.manifest.get("deleted", []))
+
+    def __len__(self) -> int:
+        """Return the number of rows in the index, including the deleted rows."""
+
+        return self.manifest["shape"][0]
+
+    def reload(self) -> bool:
+        """Reload the index if another writer has changed it, and return whether it changed."""
+
+        with self.lock:
+            if os.stat(os.path.join(self.path, "manifest.json")).st_mtime_ns == self.mtime:
+                return False
+
+            rows, deleted, generation, data = len(self), self.deleted, self.manifest.get("generation", 0), self.manifest.get("data", "")
+            self._load()
+            if self.manifest.get("generation", 0) == generation:
+                return False
+
+            if self.manifest.get("data", "") != data: # Compacted: every row has moved
+                self.rows_by_id = None
+            elif self.rows_by_id is not None:
+                self._index_ids(rows, self.deleted - deleted)
+            return True
+
+    def _index_ids(self, start: int = 0, removed: Set[int] = frozenset()) -> None:
+        """Add the live rows from start onwards to the id lookup, and drop the removed rows."""
+
+        id_column = self.manifest["id_column"]
+        if self.rows_by_id is None:
+            self.rows_by_id, start, removed = {}, 0, frozenset()
+
+        for row in removed:
+            key = str(self.records[row][id_column])
+            if self.rows_by_id.get(key) == row:
+                del self.rows_by_id[key]
+
+        for row in range(start, len(self)):
+            if row not in self.deleted:
+                self.rows_by_id[str(self.records[row][id_column])] = row
+
+    def row_of(self, id: Any) -> int:
+        """Return the live row of a profile id, or None."""
+
+        with self.lock:
+            if self.rows_by_id is None:
+                self._index_ids()
+
+            return self.rows_by_id.get(str(id))
+
+    def _write(self, chunk: pd.DataFrame, embeddings: np.ndarray, deleted: List[int]) -> None:
+        """Append a chunk and commit the new manifest. Must hold both locks."""
+
+        rows, fields, dimension = self.manifest["shape"]
+        embeddings_file, records_file, offsets_file = (_data_file(self.path, self.manifest.get("data", ""), name) for name in DATA_FILES)
+        end = int(self.records.offsets[rows])
+
+        if len(chunk) > 0:
+            lines = _record_lines(chunk)
+            sizes = np.fromiter((len(line) for line in lines), dtype = np.int64, count = len(lines))
+            offsets = end + np.cumsum(sizes)
+            dimension = embeddings.shape[2]
+
+            # Drop anything a crashed writer left past the last commit, then append
+            with open(embeddings_file, "r+b") as f:
+                f.truncate(rows * fields * dimension * 4)
+                f.seek(0, os.SEEK_END)
+                embeddings.astype(np.float32).tofile(f)
+            with open(records_file, "r+b") as f:
+                f.truncate(end)
+                f.seek(0, os.SEEK_END)
+                f.write(b"".join(lines))
+            with open(offsets_file, "r+b") as f:
+                f.truncate((rows + 1) * 8)
+                f.seek(0, os.SEEK_END)
+                offsets.tofile(f)
+            for f in (embeddings_file, records_file, offsets_file):
+                _fsync(f)
+
+        manifest = dict(self.manifest)
+        manifest["shape"] = [rows + len(chunk), fields, dimension]
+        manifest["deleted"] = sorted(self.deleted.union(deleted))
+        manifest["columns"] = manifest["columns"] + [column for column in chunk.columns if column not in manifest["columns"]]
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        _write_json(os.path.join(self.path, "manifest.json"), manifest)
+
+        previous = self.deleted
+        self._load()
+        self._index_ids(rows, self.deleted - previous)
+
+        if len(self.deleted) >= max(COMPACT_MIN, COMPACT_FRACTION * len(self)):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Write the live rows to new data files and commit them with the manifest, which renumbers the rows. Must hold both locks.
+        The data files of the compaction before are kept, so that a process which has just read the old manifest can still open them."""
+
+        rows, fields, dimension = self.manifest["shape"]
+        live = np.array([row for row in range(rows) if row not in self.deleted], dtype = np.int64)
+        compactions = self.manifest.get("compactions", 0) + 1
+        suffix = f".{compactions}"
+        embeddings_file, records_file, offsets_file = (_data_file(self.path, suffix, name) for name in DATA_FILES)
+        logging.info("Compacting the embedding index %s: %d of %d rows are live", os.path.basename(self.path), len(live), rows)
+
+        with open(embeddings_file, "wb") as embeddings, open(records_file, "wb") as records, open(offsets_file, "wb") as offsets:
+            end = 0
+            for start in range(0, len(live), CHUNK_SIZE):
+                block = live[start:start + CHUNK_SIZE]
+                lines = [self.records.line(row) for row in block]
+                sizes = np.fromiter((len(line) for line in lines), dtype = np.int64, count = len(lines))
+
+                np.asarray(self.embeddings[block], dtype = np.float32).tofile(embeddings)
+                records.write(b"".join(lines))
+                (end + np.concatenate(([0], np.cumsum(sizes)[:-1]))).astype(np.int64).tofile(offsets)
+                end += int(sizes.sum())
+            np.array([end], dtype = np.int64).tofile(offsets)
+        for f in (embeddings_file, records_file, offsets_file):
+            _fsync(f)
+
+        manifest = dict(self.manifest)
+        manifest["shape"] = [len(live), fields, dimension]
+        manifest["deleted"] = []
+        manifest["data"] = suffix
+        manifest["compactions"] = compactions
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        _write_json(os.path.join(self.path, "manifest.json"), manifest)
+
+        kept = {_data_file(self.path, suffix, name) for name in DATA_FILES}
+        kept |= {_data_file(self.path, self.manifest.get("data", ""), name) for name in DATA_FILES}
+        for name in os.listdir(self.path):
+            if os.path.join(self.path, name) not in kept and name.split(".")[0] in ("embeddings", "records", "offsets"):
+                os.remove(os.path.join(self.path, name))
+
+        self._load()
+        self.rows_by_id = None
+
+    def _log(self, changes: List[Dict]) -> None:
+        """Append changes to the change log of the catalogue, so that the next rebuild replays them. Must hold both locks."""
+
+        path = self.manifest.get("changes")
+        if path is None: # An index built before the change log
+            return
+
+        with open(path + ".lock", "a") as lock, open(path, "a") as f:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            f.write("".join(json.dumps(change) + "\n" for change in changes))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def upsert(self, chunk: pd.DataFrame, embeddings: np.ndarray) -> None:
+        """Add or replace profiles by id. The rows of the replaced profiles are marked as deleted.
+
+        Attributes:
+            - chunk: The profiles, one row each. Must have the id column of the index.
+            - embeddings: The normalized embeddings of the chunk, shape (rows, fields, dimension).
+        """
+
+        id_column = self.manifest["id_column"]
+        keep = ~chunk[id_column].astype(str).duplicated(keep = "last").values # The last version of an id wins
+        chunk, embeddings = chunk[keep], embeddings[keep]
+
+        with self.lock, open(os.path.join(self.path, "lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.reload()
+            replaced = [self.row_of(id) for id in chunk[id_column]]
+            self._write(chunk, embeddings, [row for row in replaced if row is not None])
+            self._log([{"id": json.loads(line)[id_column], "record": json.loads(line)} for line in _record_lines(chunk)])
+
+    def delete(self, ids: List[Any]) -> int:
+        """Delete profiles by id and return the number of profiles deleted.
+
+        Attributes:
+            - ids: The ids of the profiles.
+        """
+
+        with self.lock, open(os.path.join(self.path, "lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.reload()
+            rows = {self.row_of(id) for id in ids} - {None}
+            if rows:
+                id_column = self.manifest["id_column"]
+                changes = [{"id": self.records[row][id_column]} for row in rows]
+                self._write(pd.DataFrame(), None, list(rows))
+                self._log(changes)
+
+            return len(rows)
+
+    def dataframe(self) -> pd.DataFrame:
+        """Return the live records of the index as a dataframe."""
+
+        records = [record for row, record in enumerate(self.records) if row not in self.deleted]
+
+        return pd.DataFrame(records, columns = self.manifest["columns"])
+
+    @staticmethod
+    def key(csv_file: str, model_name: str, schema: Schema, digest: str) -> str:
+        """Return the directory name of the index for a csv file (its name and path), model, schema and content hash."""
+
+        return f"{_catalogue_name(csv_file)}-{_slug(model_name)}-{schema.key()}-{digest[:16]}"
+
+    @classmethod
+    def build(cls, csv_file: str, model_name: str = MODEL_ID, root: str = INDEX_ROOT, schema: Schema = DEFAULT_SCHEMA,
+              chunk_size: int = CHUNK_SIZE, batch_size: int = BATCH_SIZE, force: bool = False) -> "EmbeddingIndex":
+        """Stream the catalogue in chunks, encode the schema fields of each chunk and append it to a new index on disk,
+        replacing stale indexes of the same catalogue, model and schema. The change log of the catalogue is replayed over it.
+
+        Attributes:
+            - csv_file: The filepath of the catalogue (csv, jsonl or parquet).
+            - model_name: The model id of the Sentence Transformer used for the embeddings (see match/registry.py).
+            - root: The directory holding the indexes.
+            - schema: The schema declaring the embedded fields.
+            - chunk_size: The number of rows read and encoded at a time.
+            - batch_size: The encode batch size.
+            - force: Replace the index of the same content hash too. Otherwise an index another process has just built is kept.
+        """
+
+        digest = source_hash(csv_file, root)
+        name = cls.key(csv_file, model_name, schema, digest)
+        path = os.path.join(root, name)
+        logging.info("Building the embedding index %s", name)
+
+        changes_path = changes_file(csv_file, root)
+        changes = read_changes(changes_path)
+        if changes:
+            logging.info("Replaying %d changed profiles of %s from %s", len(changes), csv_file, changes_path)
+
+        writer = IndexWriter(root)
+        skipped = []
+        try:
+            for chunk in read_chunks(csv_file, chunk_size, skipped):
+                if changes:
+                    chunk = chunk[~chunk[schema.id_column].astype(str).isin(changes)] # The changed profiles are appended below
+                if len(chunk) == 0:
+                    continue
+                writer.append(chunk, encode_chunk(chunk, schema, model_name, batch_size))
+                logging.info("Encoded %d rows of %s", writer.rows, csv_file)
+
+            upserted = [record for record in changes.values() if record is not None]
+            for start in range(0, len(upserted), chunk_size):
+                chunk = pd.DataFrame(upserted[start:start + chunk_size])
+                writer.append(chunk, encode_chunk(chunk, schema, model_name, batch_size))
+            writer.close()
+
+            with open(os.path.join(writer.path, "skipped.jsonl"), "w") as f:
+                for line in skipped:
+                    f.write(json.dumps(line) + "\n")
+
+            _write_json(os.path.join(writer.path, "manifest.json"), {
+                "version": FORMAT_VERSION,
+                "model": model_name,
+                "source": os.path.abspath(csv_file),
+                "source_hash": digest,
+                "id_column": schema.id_column,
+                "fields": schema.field_names(),
+                "columns": writer.columns,
+                "shape": [writer.rows, len(schema.fields), writer.dimension],
+                "skipped": len(skipped),
+                "deleted": [],
+                "generation": 0,
+                "changes": changes_path
+            })
+
+            if os.path.isdir(path) and not force and cls._digest(path) == digest: # Another process built the same index first
+                logging.info("Keeping the embedding index %s built by another process", name)
+            else:
+                if os.path.isdir(path): # A forced rebuild: move the old index aside, its readers keep their mapped files
+                    stale = tempfile.mkdtemp(dir = root, prefix = ".stale-")
+                    os.replace(path, os.path.join(stale, name))
+                    shutil.rmtree(stale, ignore_errors = True)
+                try:
+                    os.replace(writer.path, path)
+                except OSError:
+                    if cls._digest(path) != digest: # Another process did not win the race: this is a real error
+                        raise
+        finally:
+            writer.abort()
+
+        log_skipped(csv_file, skipped)
+        if changes:
+            compact_changes(changes_path)
+        prefix = name[:-16]
+        for other in os.listdir(root):
+            if other.startswith(prefix) and other != name:
+                shutil.rmtree(os.path.join(root, other), ignore_errors = True)
+
+        return cls(path)
+
+    @staticmethod
+    def _digest(path: str) -> Optional[str]:
+        """Return the source hash of the index in path, or None if there is no complete index there."""
+
+        try:
+            with open(os.path.join(path, "manifest.json")) as f:
+                return json.load(f).get("source_hash")
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def open(cls, csv_file: str, model_name: str = MODEL_ID, root: str = INDEX_ROOT, schema: Schema = DEFAULT_SCHEMA) -> "EmbeddingIndex":
+        """Open the index of the csv file, building it first if the csv file has changed since the last build.
+
+        Attributes:
+            - csv_file: The filepath of the catalogue (csv, jsonl or parquet).
+            - model_name: The model id of the Sentence Transformer used for the embeddings (see match/registry.py).
+            - root: The directory holding the indexes.
+            - schema: The schema declaring the embedded fields.
+        """
+
+        digest = source_hash(csv_file, root)
+        path = os.path.join(root, cls.key(csv_file, model_name, schema, digest))
+
+        if os.path.isfile(os.path.join(path, "manifest.json")):
+            return cls(path)
+
+        return cls.build(csv_file, model_name, root, schema)
@@ -0,0 +1,134 @@
+"""
+The ingestion pipeline which streams a company catalogue into the EmbeddingIndex in chunks.
+
+Key Features:
+    - Read csv, jsonl or parquet files in chunks, so that the whole catalogue is never held in memory.
+    - Encode the schema fields of each chunk with one batched encode call.
+    - Report the bad lines which were skipped instead of dropping them silently.
+
+The chunks are appended to the index on disk by EmbeddingIndex.build (see match/index.py).
+"""
+
+import json
+import logging
+import os
+import re
+import warnings
+import numpy as np
+import pandas as pd
+from match.registry import MODEL_ID, get_model
+from match.schema import Schema
+from typing import Dict, Iterator, List
+
+CHUNK_SIZE = 10000
+BATCH_SIZE = 64
+SKIPPED_LINE = re.compile(r"Skipping line (\d+): (.*)")
+
+
+def _read_csv(path: str, chunk_size: int, skipped: List[Dict]) -> Iterator[pd.DataFrame]:
+    """Read a csv file in chunks, recording the lines pandas skips."""
+
+    reader = pd.read_csv(path, chunksize = chunk_size, on_bad_lines = "warn", index_col = False)
+
+    while True:
+        with warnings.catch_warnings(record = True) as caught:
+            warnings.simplefilter("always", pd.errors.ParserWarning)
+            chunk = next(reader, None)
+
+        for warning in caught:
+            for line, reason in SKIPPED_LINE.findall(str(warning.message)):
+                skipped.append({"line": int(line), "reason": reason.strip()})
+
+        if chunk is None:
+            return
+        yield chunk
+
+def _read_jsonl(path: str, chunk_size: int, skipped: List[Dict]) -> Iterator[pd.DataFrame]:
+    """Read a jsonl file in chunks, recording the lines which are not json objects."""
+
+    records = []
+
+    with open(path) as f:
+        for number, line in enumerate(f, start = 1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                skipped.append({"line": number, "reason": str(error)})
+                continue
+
+            if not isinstance(record, dict):
+                skipped.append({"line": number, "reason": "Not a json object."})
+                continue
+
+            records.append(record)
+            if len(records) == chunk_size:
+                yield pd.DataFrame(records)
+                records = []
+
+    if records:
+        yield pd.DataFrame(records)
+
+def _read_parquet(path: str, chunk_size: int, skipped: List[Dict]) -> Iterator[pd.DataFrame]:
+    """Read a parquet file in record batches."""
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading parquet files requires pyarrow: pip install pyarrow")
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size = chunk_size):
+        yield batch.to_pandas()
+
+READERS = {
+    ".csv": _read_csv,
+    ".jsonl": _read_jsonl,
+    ".parquet": _read_parquet
+}
+
+def read_chunks(path: str, chunk_size: int = CHUNK_SIZE, skipped: List[Dict] = None) -> Iterator[pd.DataFrame]:
+    """Stream a csv, jsonl or parquet file in chunks of at most chunk_size rows.
+
+    Attributes:
+        - path: The filepath of the catalogue.
+        - chunk_size: The number of rows per chunk.
+        - skipped: A list which receives the skipped lines as {"line": ..., "reason": ...}.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in READERS:
+        raise ValueError(f"The catalogue must be one of: {', '.join(READERS)}!")
+
+    if skipped is None:
+        skipped = []
+
+    return READERS[extension](path, chunk_size, skipped)
+
+def encode_chunk(chunk: pd.DataFrame, schema: Schema, model_name: str = MODEL_ID, batch_size: int = BATCH_SIZE) -> np.ndarray:
+    """Encode the schema fields of a chunk and return the normalized embeddings of shape (rows, fields, dimension).
+
+    Attributes:
+        - chunk: The chunk of the catalogue.
+        - schema: The schema declaring the embedded fields.
+        - model_name: The model id of the Sentence Transformer (see match/registry.py).
+        - batch_size: The encode batch size.
+    """
+
+    fields = schema.field_names()
+    missing = [field for field in fields if field not in chunk.columns]
+    if missing:
+        raise ValueError(f"The catalogue is missing the schema fields: {', '.join(missing)}!")
+
+    texts = chunk[fields].fillna("").astype(str).values.ravel().tolist()
+    embeddings = get_model(model_name).encode(texts, batch_size = batch_size, normalize_embeddings = True)
+
+    return np.asarray(embeddings, dtype = np.float32).reshape(len(chunk), len(fields), -1)
+
+def log_skipped(path: str, skipped: List[Dict]) -> None:
+    """Log a summary of the skipped lines."""
+
+    if skipped:
+        lines = ", ".join(str(s["line"]) for s in skipped[:10])
+        logging.warning("Skipped %d bad lines of %s (lines %s%s)", len(skipped), path, lines, "..." if len(skipped) > 10 else "")
@@ -2,19 +2,36 @@
 This is the Matcher class which attempts to match the results from the interview to companies or candidates.
 
 Key Features:
-    - Fetch data from a vector database (PineCone) - Not Implemented Yet
-        - In its' current iteration, this will simply use the Cosine Similarity.
+    - Fetch data from a vector database (PineCone) through a pluggable search backend (see match/backends.py):
+        - brute: Exact Cosine Similarity over the whole catalogue.
+        - ivf: Approximate nearest neighbours with an inverted file index.
+        - vector_store: A PineCone-style vector store, served by a local stand-in for now.
     - Output the match 
+    - Match many candidates at once (match_batch), or rank candidates for each company (rank_candidates), with one encode call per batch
+    - Restrict the matches with metadata filters, which are resolved to their rows before any scoring (see match/hybrid.py).
+    - Fuse the Cosine Similarity with BM25 over the text fields, with a weighted sum or reciprocal rank fusion (fusion).
+    - Represent the candidate by its answers too: the first stage is reranked by late interaction (MaxSim) of the answer vectors
+      with the field vectors of the companies (rerank_depth), in match_batch too when it is given the transcripts.
+    - Add, update or remove single profiles by id while matching keeps running (only the changed rows are encoded).
+    - Time the index load, the embedding, the scoring and the reranking (see metrics.py).
 
-This class will take in a dataset, currently in csv format.
+This class will take in a dataset, currently in csv format. The embeddings of the dataset are read from a prebuilt EmbeddingIndex (see match/index.py).
 """
 
 import logging
-from match.utils import *
+import threading
+import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
-from typing import Any, Dict
+from match.backends import create_backend
+from match.hybrid import LexicalIndex, MetadataIndex, create_fusion
+from match.index import EmbeddingIndex, INDEX_ROOT
+from match.ingest import encode_chunk
+from match.registry import MODEL_ID
+from match.schema import DEFAULT_SCHEMA, Schema
+from match.scoring import ScoringEngine, blocked_top_k, max_sim, normalize, select_top_k
+from match.utils import *
+from metrics import span
+from typing import Any, Dict, List, Tuple
 
 
 class Matcher:
@@ -22,10 +39,21 @@ class Matcher:
     The Matcher class which aims to match people with their values.
 
     Attributes:
-        - dataset: The csv filepath. Must contain the subfield: values_summary
+        - dataset: The csv filepath. Must contain the fields of the schema.
+        - schema: The schema declaring the embedded fields and their weights.
         - user_attributes: The user attributes obtained from the interview.
-        - tensors: The Tensors in the csv file.
-        - model: The Sentence Transformer model for cosine calculation.
+        - index: The prebuilt embedding index of the csv file.
+        - engine: The ScoringEngine holding the profile matrix of the index.
+        - backend: The search backend over the profile matrix.
+        - backend_spec: The name and options of the backend, to build it again after the index is compacted.
+        - fusion: How the Cosine is fused with the BM25 score (see match/hybrid.py).
+        - depth: The number of candidates each search of a hybrid match returns to the fusion, at least.
+        - lexical, metadata: The BM25 index and the filter index of the rows, built on first use.
+        - rerank_depth: The number of first stage matches reranked with the answers of the interview, or 0 to match the impression alone.
+        - lock: Serialises the writes and the builds of the lexical and metadata indexes. Matching only takes it for those builds:
+          the engine and the backend swap in new state atomically.
+
+    The Sentence Transformer is shared by the whole process (see match/registry.py), so one Matcher can serve every request.
     
     Pre Condition: self.dataset must have:
         - id: ID of the interview
@@ -35,23 +63,229 @@ class Matcher:
         - impression: The impression by the agent
     """
 
-    def __init__(self, user_attributes: Dict, csv_file: str) -> None:
+    def __init__(self, user_attributes: Dict = None, csv_file: str = "match/data.csv", backend: str = "brute", backend_options: Dict = None,
+                 schema: Schema = DEFAULT_SCHEMA, fusion: str = "semantic", depth: int = 100, rerank_depth: int = 50,
+                 model: str = MODEL_ID, root: str = INDEX_ROOT) -> None:
         """Initialize the Matcher class.
 
         Attributes:
-        - csv_file: The csv filepath. Must contain the subfield: values_summary
-        - user_attributes: The user attributes obtained from the interview.
+        - csv_file: The csv filepath. Must contain the fields of the schema.
+        - user_attributes: The user attributes obtained from the interview. Can instead be passed to match.
+        - backend: The name of the search backend (brute, ivf or vector_store).
+        - backend_options: The recall/latency options of the backend, eg. {"n_probe": 16} for ivf.
+        - schema: The schema declaring the embedded fields and their weights.
+        - fusion: semantic (the Cosine alone), weighted[:alpha] or rrf[:k].
+        - depth: The number of candidates each search of a hybrid match returns to the fusion, at least.
+        - rerank_depth: The number of first stage matches reranked with the answers of the interview, or 0 to match the impression alone.
+        - model: The model id of the embeddings (see match/registry.py).
+        - root: The directory holding the indexes.
         """
 
         self.user_attributes = user_attributes
-        self.dataset = pd.read_csv(csv_file, on_bad_lines = "skip", index_col = False)
-        self.tensors = obtain_tensors_dataframe(self.dataset)
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.schema = schema
+        with span("csv_load"):
+            self.index = EmbeddingIndex.open(csv_file, model, root, schema) # Only encodes the csv file if it has changed since the last build
+        self.engine = ScoringEngine(self.index.embeddings, schema.weights())
+        self.backend = create_backend(backend, self.engine.matrix, **(backend_options or {}))
+        self.backend_spec = (backend, backend_options or {})
+        self.fusion = create_fusion(fusion)
+        self.depth = depth
+        self.rerank_depth = rerank_depth
+        self.lexical = self.metadata = None
+        self.lock = threading.RLock() # Reentrant: _apply resets the hybrid indexes while holding it
+        self.rows = len(self.index) # The rows of the index applied to the engine and the backend
+        self.data = self.index.manifest.get("data", "") # The data files of the index applied, changed by a compaction
+        self.removed = set()
+        self._apply()
+
+    def _apply(self) -> None:
+        """Apply the rows added to and deleted from the index since the last call to the engine and the backend. Must hold self.lock."""
+
+        if self.index.manifest.get("data", "") != self.data: # The index was compacted: every row has moved
+            engine = ScoringEngine(self.index.embeddings, self.schema.weights())
+            self.backend = create_backend(self.backend_spec[0], engine.matrix, **self.backend_spec[1])
+            self.engine = engine
+            self.lexical = self.metadata = None
+            self.rows, self.removed = len(self.index), set()
+            self.data = self.index.manifest.get("data", "")
+
+        if len(self.index) > self.rows:
+            self.engine.append(self.index.embeddings[self.rows:])
+
+        removed = np.array(sorted(self.index.deleted - self.removed), dtype = np.int64)
+        if len(self.index) > self.rows or len(removed) > 0:
+            self.backend.update(self.engine.matrix, removed)
+
+        self.rows = len(self.index)
+        self.removed = set(self.index.deleted)
+
+    def refresh(self) -> None:
+        """Pick up the profiles which other processes have added or removed."""
+
+        with self.lock:
+            if self.index.reload():
+                self._apply()
+
+    def _hybrid_index(self, name: str, rows: int) -> Any:
+        """Return the lexical or metadata index, building it on first use and indexing the records up to rows."""
+
+        with self.lock:
+            index = getattr(self, name)
+            if index is None:
+                index = LexicalIndex(self.schema.field_names()) if name == "lexical" else MetadataIndex(self.schema.filters)
+                setattr(self, name, index)
+            if len(index) < rows:
+                index.append(self.index.records[row] for row in range(len(index), rows))
+
+        return index
+
+    def _candidates(self, filters: Dict, live: np.ndarray) -> np.ndarray:
+        """Return the live rows matching the filters, or None without filters."""
+
+        if not filters:
+            return None
+
+        rows = self._hybrid_index("metadata", live.shape[0]).rows(filters)
+        rows = rows[rows < live.shape[0]]
+
+        return rows[live[rows]]
+
+    def _search(self, query: np.ndarray, impression: str, maximum_count: int, filters: Dict = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Return the rows of the matches of one query vector and their scores by name, restricted to the rows of the filters
+        and fused with BM25 if the fusion is hybrid.
+
+        Attributes:
+            - query: The normalized query vector.
+            - impression: The impression the query vector encodes, for BM25.
+            - maximum_count: The number of matches to return.
+            - filters: The values of the filterable columns of the schema.
+        """
+
+        matrix, live = self.backend.snapshot[:2]
+        candidates = self._candidates(filters, live)
+
+        if not self.fusion.hybrid:
+            if candidates is None:
+                rows, scores = self.backend.search(query, maximum_count)
+            else:
+                rows, scores = self.backend.search_rows(query, candidates, maximum_count)
+            return rows, {"Cosine": scores}
 
-    def match(self, maximum_count: int = 2) -> Dict:
+        depth = max(maximum_count, self.depth)
+        lexical = self._hybrid_index("lexical", live.shape[0])
+        if candidates is None:
+            semantic_rows, _ = self.backend.search(query, depth)
+        else:
+            semantic_rows, _ = self.backend.search_rows(query, candidates, depth)
+        lexical_rows, _ = lexical.search(impression, depth, candidates, live)
+
+        # Score the union of both searches with both scores
+        rows = np.union1d(semantic_rows, lexical_rows)
+        cosines = matrix[rows] @ query
+        bm25 = lexical.scores(impression, rows)
+        semantic_ranks = np.full(rows.shape[0], np.inf)
+        semantic_ranks[np.searchsorted(rows, semantic_rows)] = np.arange(1, semantic_rows.shape[0] + 1)
+        lexical_ranks = np.full(rows.shape[0], np.inf)
+        lexical_ranks[np.searchsorted(rows, lexical_rows)] = np.arange(1, lexical_rows.shape[0] + 1)
+
+        fused = self.fusion.fuse(cosines, bm25, semantic_ranks, lexical_ranks)
+        best, top = select_top_k(fused, maximum_count)
+
+        return rows[best], {"Cosine": cosines[best], "BM25": bm25[best], "Score": top}
+
+    def _records(self, rows: np.ndarray, scores: Dict[str, np.ndarray]) -> List[Dict]:
+        """Return the records of the rows with their scores."""
+
+        return [dict(self.index.records[row], **{name: float(values[i]) for name, values in scores.items()}) for i, row in enumerate(rows)]
+
+    def _rerank(self, rows: np.ndarray, scores: Dict[str, np.ndarray], vectors: np.ndarray, maximum_count: int) -> Tuple[np.ndarray, Dict]:
+        """Rerank the rows of the first stage by the late-interaction score of the candidate vectors (see max_sim) and keep the best.
+
+        Attributes:
+            - rows: The rows found by the first stage.
+            - scores: Their scores by name.
+            - vectors: The normalized candidate vectors.
+            - maximum_count: The number of rows to keep.
+        """
+
+        ordered = np.argsort(rows) # Read the memory-mapped field vectors in row order
+        late = np.empty(rows.shape[0], dtype = np.float32)
+        late[ordered] = max_sim(self.index.embeddings[rows[ordered]], vectors, self.schema.weights())
+        best, top = select_top_k(late, maximum_count)
+
+        return rows[best], dict({name: values[best] for name, values in scores.items()}, MaxSim = top)
+
+    def _candidate(self, user_attributes: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        """Encode the impression and every answer of the transcript with one encode call.
+        Return the query vector of the impression and the normalized candidate vectors (the impression first, then the answers).
+
+        Attributes:
+            - user_attributes: The user attributes, with the impression and optionally the question_answer of the interview.
+        """
+
+        answers = self._answers(user_attributes.get("question_answer"))
+        with span("embedding"):
+            vectors = normalize(obtain_tensors_list([user_attributes["impression"]] + answers, self.index.manifest["model"]))
+
+        return vectors[0], vectors
+
+    def _answers(self, question_answer: Dict) -> List[str]:
+        """Return the answers of a transcript which rerank the matches, or none if the reranking is off."""
+
+        if not self.rerank_depth:
+            return []
+
+        return [str(answer) for answer in (question_answer or {}).values() if str(answer).strip()]
+
+    def upsert(self, profiles: List[Dict]) -> int:
+        """Add or update profiles by id and return the number of profiles written. Only these profiles are encoded.
+        The fields missing from the profile of an existing id are kept.
+
+        Attributes:
+            - profiles: The profiles. Each must have the id column of the schema.
+        """
+
+        id_column = self.schema.id_column
+        merged = []
+        for profile in profiles:
+            if profile.get(id_column) is None:
+                raise ValueError(f"Every profile must have an {id_column}!")
+
+            row = self.index.row_of(profile[id_column])
+            merged.append(profile if row is None else {**self.index.records[row], **profile})
+
+        chunk = pd.DataFrame(merged)
+        with span("embedding"):
+            embeddings = encode_chunk(chunk, self.schema, self.index.manifest["model"]) # Outside the lock: matching keeps running
+
+        with self.lock:
+            self.index.upsert(chunk, embeddings)
+            self._apply()
+
+        return len(chunk)
+
+    def delete(self, ids: List[Any]) -> int:
+        """Remove profiles by id and return the number of profiles removed.
+
+        Attributes:
+            - ids: The ids of the profiles.
+        """
+
+        with self.lock:
+            count = self.index.delete(ids)
+            self._apply()
+
+        return count
+
+    def match(self, maximum_count: int = 2, user_attributes: Dict = None, filters: Dict = None) -> Dict:
         """Conduct value matching by calculating the Cosine Similarity.
+
+        Attributes:
+            - maximum_count: The number of matches to return.
+            - user_attributes: The user attributes to match. Defaults to self.user_attributes.
+            - filters: Only match the profiles with these values of the filterable columns, eg. {"sector": "Healthcare", "location": ["Singapore"]}.
         
-        Pre Condition: self.user_attributes must have:
+        Pre Condition: user_attributes must have:
             - id: ID of the interview
             - name: Name of the interviewee
             - time: The current time
@@ -59,11 +293,119 @@ class Matcher:
             - impression: The impression by the agent
         """
 
-        print(self.user_attributes)
-        candidate_values = obtain_tensors_list([self.user_attributes["impression"]]) # Values Deduction: Must be a list and calculates the impression!
-        cosine_dataframe = calculate_cosine(candidate_values, self.dataset, self.tensors)
-        cosine_dataframe = cosine_dataframe.sort_values(by=["Cosine"], ascending = False)
-        print(cosine_dataframe)
-        cosine_dataframe = cosine_dataframe.iloc[:maximum_count]
+        if user_attributes is None:
+            user_attributes = self.user_attributes
+
+        query, vectors = self._candidate(user_attributes) # Values Deduction: the impression, and the answers for the reranking
+
+        if vectors.shape[0] > 1: # Rerank a deeper first stage with the answers
+            with span("scoring"):
+                rows, scores = self._search(query, user_attributes["impression"], max(maximum_count, self.rerank_depth), filters)
+            with span("rerank"):
+                rows, scores = self._rerank(rows, scores, vectors, maximum_count)
+        else:
+            with span("scoring"):
+                rows, scores = self._search(query, user_attributes["impression"], maximum_count, filters)
+
+        matches = self._records(rows, scores)
+        logging.debug(matches)
+
+        return matches
+
+    def _queries(self, impressions: List[str]) -> np.ndarray:
+        """Encode the impressions with one encode call and return their normalized query vectors."""
+
+        if not impressions:
+            return np.empty((0, self.engine.matrix.shape[1]), dtype = np.float32)
+
+        with span("embedding"):
+            return normalize(obtain_tensors_list(list(impressions), self.index.manifest["model"])) # The encoder of the index
+
+    def _batch_candidates(self, impressions: List[str], question_answers: List[Dict]) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """Encode the impressions and every answer of the transcripts with one encode call.
+        Return the query vectors of the impressions and the candidate vectors of each (the impression first, then the answers).
+
+        Attributes:
+            - impressions: The impressions of the candidates.
+            - question_answers: The question_answer of each candidate, in the order of the impressions.
+        """
+
+        answers = [self._answers(question_answer) for question_answer in question_answers]
+        vectors = self._queries(list(impressions) + [answer for candidate in answers for answer in candidate])
+
+        candidates, start = [], len(impressions)
+        for i, candidate in enumerate(answers):
+            candidates.append(np.vstack([vectors[i:i + 1], vectors[start:start + len(candidate)]]))
+            start += len(candidate)
+
+        return vectors[:len(impressions)], candidates
+
+    def match_batch(self, impressions: List[str], maximum_count: int = 2, filters: Dict = None,
+                    question_answers: List[Dict] = None) -> List[List[Dict]]:
+        """Match many candidates at once and return the matches of each impression, in the order of the impressions.
+        With the transcripts, the matches of each candidate are reranked with its answers as match does.
+
+        Attributes:
+            - impressions: The impressions of the candidates.
+            - maximum_count: The number of matches per candidate.
+            - filters: Only match the profiles with these values of the filterable columns.
+            - question_answers: The question_answer of each candidate, in the order of the impressions. Defaults to the impressions alone.
+        """
+
+        if question_answers is None:
+            queries, candidates = self._queries(impressions), [None] * len(impressions)
+        else:
+            if len(question_answers) != len(impressions):
+                raise ValueError("There must be one question_answer per impression!")
+            queries, candidates = self._batch_candidates(impressions, question_answers)
+
+        reranked = any(vectors is not None and vectors.shape[0] > 1 for vectors in candidates)
+        depth = max(maximum_count, self.rerank_depth) if reranked else maximum_count
+
+        with span("scoring"):
+            if filters or self.fusion.hybrid:
+                found = [self._search(query, impression, depth, filters) for query, impression in zip(queries, impressions)]
+            else:
+                found = [(rows, {"Cosine": scores}) for rows, scores in self.backend.search_batch(queries, depth)]
+
+        if not reranked:
+            return [self._records(rows, scores) for rows, scores in found]
+
+        matches = []
+        with span("rerank"):
+            for (rows, scores), vectors in zip(found, candidates):
+                if vectors is not None and vectors.shape[0] > 1:
+                    rows, scores = self._rerank(rows, scores, vectors, maximum_count)
+                else: # No answers: the first stage alone, as match does
+                    rows, scores = rows[:maximum_count], {name: values[:maximum_count] for name, values in scores.items()}
+                matches.append(self._records(rows, scores))
+
+        return matches
+
+    def rank_candidates(self, impressions: List[str], maximum_count: int = 2, ids: List[Any] = None, filters: Dict = None) -> List[Dict]:
+        """The reverse direction: rank the candidates for each company and return the companies with their best candidates.
+        The candidates are given by their position in impressions.
+
+        Attributes:
+            - impressions: The impressions of the candidates.
+            - maximum_count: The number of candidates per company.
+            - ids: The ids of the companies. Defaults to every company of the catalogue.
+            - filters: Only rank the candidates of the companies with these values of the filterable columns.
+        """
+
+        candidates = self._queries(impressions)
+        matrix, live = self.backend.snapshot[:2]
+        rows = np.flatnonzero(live) if ids is None else np.array([row for row in map(self.index.row_of, ids) if row is not None], dtype = np.int64)
+        if filters:
+            rows = np.intersect1d(rows, self._candidates(filters, live))
+
+        with span("scoring"):
+            indices, values = blocked_top_k(matrix[rows], candidates, maximum_count) # The companies are the queries
+
+        ranked = []
+        for row, best, scores in zip(rows, indices, values):
+            found = best >= 0
+            top = [{"candidate": int(candidate), "Cosine": float(score)} for candidate, score in zip(best[found], scores[found])]
+            ranked.append(dict(self.index.records[row], candidates = top))
 
-        return cosine_dataframe.to_dict('records')
\ No newline at end of file
+        return ranked
@@ -0,0 +1,130 @@
+"""
+The model registry which shares one copy of the Sentence Transformer and of each Matcher per process.
+
+Key Features:
+    - Load the Sentence Transformer lazily, once per process and only on demand.
+    - Preload the models before gunicorn forks, so that the workers share the pages copy-on-write.
+    - Warm up the model and the Matchers so that the first /get_match runs at steady-state latency.
+    - Select the encoder backend with MATCH_ENCODER: torch (full precision PyTorch), onnx (ONNX Runtime) or int8 (ONNX Runtime, int8 quantized).
+
+A model is named by its model id: the model name, followed by @<encoder> unless the encoder is torch (eg. all-MiniLM-L6-v2@int8).
+The id keys the embedding indexes and the query cache, so embeddings of different encoders are never mixed.
+The onnx and int8 encoders need ONNX Runtime: pip install sentence_transformers[onnx]
+"""
+
+import json
+import logging
+import os
+import threading
+from sentence_transformers import SentenceTransformer
+from typing import Dict, Iterable
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+MATCH_ENCODER = os.getenv("MATCH_ENCODER", "torch") # torch, onnx or int8
+ENCODERS = {
+    "torch": {},
+    "onnx": {"backend": "onnx"},
+    "int8": {"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}} # Shipped with the model, runs on any AVX2 CPU
+}
+MATCH_BACKEND = os.getenv("MATCH_BACKEND", "brute") # brute, ivf or vector_store
+MATCH_BACKEND_OPTIONS = json.loads(os.getenv("MATCH_BACKEND_OPTIONS", "{}")) # eg. {"n_probe": 16}
+MATCH_FUSION = os.getenv("MATCH_FUSION", "semantic") # semantic, weighted[:alpha] or rrf[:k]
+MATCH_RERANK_DEPTH = int(os.getenv("MATCH_RERANK_DEPTH", "50")) # 0 matches the impression alone
+
+
+def model_id(name: str = MODEL_NAME, encoder: str = MATCH_ENCODER) -> str:
+    """Return the model id of a model name and encoder backend.
+
+    Attributes:
+        - name: The name of the Sentence Transformer model.
+        - encoder: The encoder backend (torch, onnx or int8).
+    """
+
+    if encoder not in ENCODERS:
+        raise ValueError(f"The encoder must be one of: {', '.join(ENCODERS)}!")
+
+    return name if encoder == "torch" else f"{name}@{encoder}"
+
+MODEL_ID = model_id()
+
+_LOCK = threading.RLock()
+_MODELS: Dict[str, SentenceTransformer] = {}
+_MATCHERS: Dict[str, "Matcher"] = {}
+
+
+def get_model(id: str = MODEL_ID) -> SentenceTransformer:
+    """Return the shared Sentence Transformer, loading it on the first call.
+
+    Attributes:
+        - id: The model id, ie. the name of the Sentence Transformer model and optionally @<encoder>.
+    """
+
+    model = _MODELS.get(id)
+    if model is not None:
+        return model
+
+    with _LOCK:
+        if id not in _MODELS:
+            name, _, encoder = id.partition("@")
+            encoder = encoder or "torch"
+            if encoder not in ENCODERS:
+                raise ValueError(f"The encoder must be one of: {', '.join(ENCODERS)}!")
+
+            logging.info("Loading the Sentence Transformer %s with the %s encoder", name, encoder)
+            _MODELS[id] = SentenceTransformer(name, **ENCODERS[encoder])
+
+        return _MODELS[id]
+
+def register_model(id: str, model: SentenceTransformer) -> None:
+    """Share a model under an id, instead of loading a Sentence Transformer, eg. a stand-in encoder for benchmarks.
+
+    Attributes:
+        - id: The model id.
+        - model: Any object with the encode method of the Sentence Transformer.
+    """
+
+    with _LOCK:
+        _MODELS[id] = model
+
+def get_matcher(csv_file: str) -> "Matcher":
+    """Return the shared Matcher of a csv file, reopening it if the csv file has changed and picking up the profiles other processes have upserted.
+
+    Attributes:
+        - csv_file: The csv filepath.
+    """
+
+    from match.index import source_hash
+    from match.matcher import Matcher
+
+    with _LOCK:
+        matcher = _MATCHERS.get(csv_file)
+        if matcher is None or matcher.index.manifest["source_hash"] != source_hash(csv_file):
+            matcher = Matcher(csv_file = csv_file, backend = MATCH_BACKEND, backend_options = MATCH_BACKEND_OPTIONS, fusion = MATCH_FUSION,
+                              rerank_depth = MATCH_RERANK_DEPTH)
+            _MATCHERS[csv_file] = matcher
+
+    matcher.refresh()
+
+    return matcher
+
+def preload(csv_files: Iterable[str] = ()) -> None:
+    """Load the model and open the Matchers, eg. in the gunicorn master before the workers are forked.
+
+    Attributes:
+        - csv_files: The csv files of the Matchers to open.
+    """
+
+    get_model()
+    for csv_file in csv_files:
+        get_matcher(csv_file)
+
+def warm_up(csv_files: Iterable[str] = ()) -> None:
+    """Run one encode and one match so that the first request does not pay for the lazy initialisation.
+
+    Attributes:
+        - csv_files: The csv files of the Matchers to warm up.
+    """
+
+    get_model().encode(["Warming up the model."])
+    for csv_file in csv_files:
+        get_matcher(csv_file).match(user_attributes = {"impression": "A person who is trying to find meaningful work."})
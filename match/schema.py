@@ -0,0 +1,94 @@
+"""
+The field schema of the Matcher dataset, which declares which columns are embedded and how much each of them weighs in the score.
+
+Key Features:
+    - Only the declared text fields are encoded and stored in the EmbeddingIndex.
+    - The score of a row is the weighted sum of the cosines between the candidate and each field.
+    - The filterable metadata columns are declared too: a match can be restricted to their values before any scoring (see match/hybrid.py).
+
+Example:
+    Schema(id_column = "id", fields = [Field("values_summary", 0.6), Field("future_goals_and_interests", 0.4)], filters = ["sector", "location"])
+"""
+
+import hashlib
+import numpy as np
+from typing import List
+
+
+class Field:
+    """
+    The Field class, one embedded column of the dataset.
+
+    Attributes:
+        - name: The name of the column.
+        - weight: The weight of the column in the score.
+    """
+
+    name: str
+    weight: float
+
+    def __init__(self, name: str, weight: float = 1.0) -> None:
+        """Initialize the Field class.
+
+        Attributes:
+            - name: The name of the column.
+            - weight: The weight of the column in the score.
+        """
+
+        self.name = name
+        self.weight = weight
+
+    def __repr__(self) -> str:
+        """Return the representation of the field."""
+
+        return f"Field({self.name!r}, {self.weight!r})"
+
+
+class Schema:
+    """
+    The Schema class, which describes the dataset of the Matcher.
+
+    Attributes:
+        - id_column: The column holding the id of each profile.
+        - fields: The embedded columns and their weights.
+        - filters: The metadata columns which matches can be filtered by.
+    """
+
+    id_column: str
+    fields: List[Field]
+    filters: List[str]
+
+    def __init__(self, id_column: str, fields: List[Field], filters: List[str] = None) -> None:
+        """Initialize the Schema class.
+
+        Attributes:
+            - id_column: The column holding the id of each profile.
+            - fields: The embedded columns and their weights.
+            - filters: The metadata columns which matches can be filtered by. A profile without the column matches no filter on it.
+        """
+
+        if not fields:
+            raise ValueError("The schema must have at least one field!")
+
+        self.id_column = id_column
+        self.fields = fields
+        self.filters = list(filters or [])
+
+    def field_names(self) -> List[str]:
+        """Return the names of the embedded columns."""
+
+        return [field.name for field in self.fields]
+
+    def weights(self) -> np.ndarray:
+        """Return the weights of the embedded columns."""
+
+        return np.array([field.weight for field in self.fields], dtype = np.float32)
+
+    def key(self) -> str:
+        """Return a short hash of the embedded columns, so that indexes of different schemas do not collide. The weights and filters are not part of it."""
+
+        return hashlib.sha256("|".join(self.field_names()).encode()).hexdigest()[:8]
+
+
+DEFAULT_SCHEMA = Schema(id_column = "id", fields = [Field("values_summary", 0.5), Field("future_goals_and_interests", 0.5)],
+                        filters = ["sector", "location", "stage"])
@@ -0,0 +1,236 @@
+"""
+The ScoringEngine class which scores every profile against a candidate with one matrix product.
+
+Key Features:
+    - Pre-normalize the field embeddings of each row, weigh them and stack them into one contiguous matrix.
+    - Score all the rows with a single matrix product against the candidate vector.
+    - Select the top k rows with argpartition instead of sorting the whole catalogue.
+    - Score many queries at once in blocks of queries and rows, keeping only the top k of each query (blocked_top_k).
+    - Score a multi-vector candidate against the field vectors of a few rows with late interaction (max_sim).
+
+The score of a row is the weighted sum of the cosines between the candidate and the fields of the row (the mean when no weights are given,
+which is what calculate_cosine computed one row at a time). Because a weighted sum of cosines equals the dot product with the weighted sum
+of the normalized field vectors, each row collapses into one vector ahead of time and the whole score is computed in one pass.
+"""
+
+import numpy as np
+from typing import Tuple
+
+BLOCK_SIZE = 65536
+QUERY_BLOCK = 256
+SCORE_BLOCK = 1 << 22 # The maximum number of scores held at once by blocked_top_k (16 MB)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Return the vectors scaled to unit length along the last axis.
+
+    Attributes:
+        - vectors: The array of vectors.
+    """
+
+    vectors = np.asarray(vectors, dtype = np.float32)
+    norms = np.linalg.norm(vectors, axis = -1, keepdims = True)
+
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+def select_top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the positions and values of the k highest scores, best first.
+
+    Attributes:
+        - scores: The scores of shape (rows,).
+        - k: The number of positions to return.
+    """
+
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype = np.int64), np.empty(0, dtype = np.float32)
+
+    if k < scores.shape[0]:
+        best = np.argpartition(-scores, k - 1)[:k]
+    else:
+        best = np.arange(scores.shape[0])
+    best = best[np.argsort(-scores[best], kind = "stable")]
+
+    return best, scores[best]
+
+
+def select_top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the positions and values of the k highest scores of each row, best first.
+
+    Attributes:
+        - scores: The scores of shape (queries, rows).
+        - k: The number of positions to return per row.
+    """
+
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        best = np.argpartition(-scores, k - 1, axis = 1)[:, :k]
+    else:
+        best = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    top = np.take_along_axis(scores, best, axis = 1)
+    order = np.argsort(-top, axis = 1, kind = "stable")
+
+    return np.take_along_axis(best, order, axis = 1), np.take_along_axis(top, order, axis = 1)
+
+
+def blocked_top_k(queries: np.ndarray, matrix: np.ndarray, k: int, live: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the row indices and scores of the k best rows of the matrix for each query, best first.
+    The score matrix is computed in blocks of queries and rows, so that at most SCORE_BLOCK scores are held at once.
+    When fewer than k rows are live, the missing positions have the index -1 and the score -inf.
+
+    Attributes:
+        - queries: The normalized query vectors of shape (queries, dimension).
+        - matrix: The profile matrix of shape (rows, dimension).
+        - k: The number of rows to return per query.
+        - live: The mask of the rows which may be returned. Defaults to every row.
+    """
+
+    k = max(0, min(k, matrix.shape[0]))
+    indices = np.full((queries.shape[0], k), -1, dtype = np.int64)
+    values = np.full((queries.shape[0], k), -np.inf, dtype = np.float32)
+    if k == 0:
+        return indices, values
+
+    row_block = max(k, SCORE_BLOCK // QUERY_BLOCK)
+
+    for q in range(0, queries.shape[0], QUERY_BLOCK):
+        block = queries[q:q + QUERY_BLOCK]
+        best, top = indices[q:q + QUERY_BLOCK], values[q:q + QUERY_BLOCK]
+
+        for start in range(0, matrix.shape[0], row_block):
+            rows = matrix[start:start + row_block]
+            scores = block @ rows.T
+            if live is not None:
+                scores[:, ~live[start:start + row_block]] = -np.inf
+
+            # Merge the best rows so far with the rows of this block
+            candidates = np.concatenate((best, np.broadcast_to(np.arange(start, start + rows.shape[0]), scores.shape)), axis = 1)
+            positions, top = select_top_k_rows(np.concatenate((top, scores), axis = 1), k)
+            best = np.take_along_axis(candidates, positions, axis = 1)
+
+        indices[q:q + QUERY_BLOCK], values[q:q + QUERY_BLOCK] = best, top
+
+    indices[~np.isfinite(values)] = -1
+
+    return indices, values
+
+
+def max_sim(embeddings: np.ndarray, vectors: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+    """Return the late-interaction score of each row: for each field, the cosine of the candidate vector closest to it,
+    summed with the field weights. Computed with one matrix product over all the rows, fields and candidate vectors.
+
+    Attributes:
+        - embeddings: The normalized field vectors of the rows, shape (rows, fields, dimension).
+        - vectors: The normalized candidate vectors, shape (vectors, dimension), eg. one per answer and one for the impression.
+        - weights: The weight of each field. Defaults to the mean of the fields.
+    """
+
+    rows, fields, dimension = embeddings.shape
+    if weights is None:
+        weights = np.full(fields, 1 / fields, dtype = np.float32)
+    if rows == 0 or vectors.shape[0] == 0:
+        return np.zeros(rows, dtype = np.float32)
+
+    cosines = np.asarray(embeddings, dtype = np.float32).reshape(rows * fields, dimension) @ vectors.T
+
+    return cosines.max(axis = 1).reshape(rows, fields) @ weights
+
+
+class ScoringEngine:
+    """
+    The ScoringEngine class which holds the profile matrix of a catalogue.
+
+    Attributes:
+        - matrix: The contiguous float32 matrix of shape (rows, dimension), one weighted normalized vector per row.
+        - weights: The weight of each field.
+
+    The matrix is a view of a larger buffer, so that appending rows does not copy the whole catalogue every time.
+    Appending never writes to the rows of an older view, so readers holding one are not disturbed.
+    """
+
+    matrix: np.ndarray
+    weights: np.ndarray
+
+    def __init__(self, embeddings: np.ndarray, weights: np.ndarray = None) -> None:
+        """Build the profile matrix.
+
+        Attributes:
+            - embeddings: The embeddings of shape (rows, fields, dimension) or (rows, dimension).
+            - weights: The weight of each field. Defaults to the mean of the fields.
+        """
+
+        if embeddings.ndim == 3 and weights is None:
+            weights = np.full(embeddings.shape[1], 1 / embeddings.shape[1], dtype = np.float32)
+        self.weights = None if weights is None else np.asarray(weights, dtype = np.float32)
+
+        self._buffer = np.empty((embeddings.shape[0], embeddings.shape[-1]), dtype = np.float32)
+        self._collapse(embeddings, 0)
+        self.matrix = self._buffer[:embeddings.shape[0]]
+
+    def _collapse(self, embeddings: np.ndarray, offset: int) -> None:
+        """Write the weighted normalized vectors of the embeddings into the buffer from offset onwards.
+        The fields are collapsed in blocks, so that a memory-mapped index is never copied whole."""
+
+        for start in range(0, embeddings.shape[0], BLOCK_SIZE):
+            block = normalize(embeddings[start:start + BLOCK_SIZE])
+            if block.ndim == 3:
+                block = np.einsum("rfd,f->rd", block, self.weights)
+            self._buffer[offset + start:offset + start + block.shape[0]] = block
+
+    def append(self, embeddings: np.ndarray) -> None:
+        """Append rows to the profile matrix, growing the buffer geometrically.
+
+        Attributes:
+            - embeddings: The embeddings of the new rows, shape (rows, fields, dimension) or (rows, dimension).
+        """
+
+        rows = self.matrix.shape[0]
+        total = rows + embeddings.shape[0]
+
+        if total > self._buffer.shape[0] or self._buffer.shape[1] != embeddings.shape[-1]:
+            buffer = np.empty((max(total, 2 * self._buffer.shape[0]), embeddings.shape[-1]), dtype = np.float32)
+            if rows > 0:
+                buffer[:rows] = self.matrix
+            self._buffer = buffer
+
+        self._collapse(embeddings, rows)
+        self.matrix = self._buffer[:total]
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+
+        return self.matrix.shape[0]
+
+    @staticmethod
+    def query_vector(candidate: np.ndarray) -> np.ndarray:
+        """Collapse the candidate sentences into one query vector.
+
+        Attributes:
+            - candidate: The candidate embeddings of shape (sentences, dimension) or (dimension,).
+        """
+
+        candidate = normalize(candidate)
+        if candidate.ndim == 2:
+            candidate = candidate.mean(axis = 0)
+
+        return candidate
+
+    def score(self, candidate: np.ndarray) -> np.ndarray:
+        """Return the score of every row against the candidate.
+
+        Attributes:
+            - candidate: The candidate embeddings of shape (sentences, dimension) or (dimension,).
+        """
+
+        return self.matrix @ self.query_vector(candidate)
+
+    def top_k(self, candidate: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the row indices and scores of the k best rows, best first.
+
+        Attributes:
+            - candidate: The candidate embeddings of shape (sentences, dimension) or (dimension,).
+            - k: The number of rows to return.
+        """
+
+        return select_top_k(self.score(candidate), k)
@@ -1,36 +1,41 @@
 # Preprocessing
+import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
+from match.registry import MODEL_ID, MODEL_NAME, get_model
+from match.schema import DEFAULT_SCHEMA, Schema
+from match.scoring import ScoringEngine
 from typing import Any, List
 import torch
 
-MODEL = SentenceTransformer('all-MiniLM-L6-v2')
-
-def obtain_tensors_dataframe(dataset: pd.DataFrame) -> List[torch.Tensor]:
-    """Get a dataset and obtain a list of tensors for each row in the dataset.
+def obtain_tensors_dataframe(dataset: pd.DataFrame, schema: Schema = DEFAULT_SCHEMA) -> List[torch.Tensor]:
+    """Get a dataset and obtain a list of tensors for each row in the dataset, one per schema field.
 
     Attributes:
         dataset: The current csv dataset.
+        schema: The schema declaring the embedded fields.
     """
 
-    test = dataset.T.to_dict('list')
-    test_names = []
+    fields = schema.field_names()
+    texts = dataset[fields].fillna("").astype(str).values.ravel().tolist()
+    embeddings = get_model().encode(texts)
 
-    for name in test:
-        curr_name = MODEL.encode(test[name])
-        test_names.append(curr_name)
-    
-    return test_names
+    return list(embeddings.reshape(len(dataset), len(fields), -1))
 
-def obtain_tensors_list(dataset: List[str]) -> torch.Tensor:
-    """Get a tensors for an entire list.
+def obtain_tensors_list(dataset: List[str], model_id: str = MODEL_ID) -> torch.Tensor:
+    """Get a tensors for an entire list. The embeddings go through the query cache of the process (see match/cache.py).
     
     Attributes:
         - dataset: The list of strings to be converted into one tensor.
+        - model_id: The model id (see match/registry.py).
     """
 
-    return MODEL.encode(dataset)
+    from match.cache import get_query_cache
+
+    cache = get_query_cache()
+    if cache is None:
+        return get_model(model_id).encode(dataset)
+
+    return cache.encode(dataset, model_id)
 
 def calculate_cosine(candidate_data: List[str], profiles_list: pd.DataFrame, profile_tensors: List[torch.Tensor]) -> pd.DataFrame:
     """Calculate the cosine and return the highest matches of the profiles.
@@ -38,16 +43,11 @@ def calculate_cosine(candidate_data: List[str], profiles_list: pd.DataFrame, pro
     Attributes:
         - candidate_data: The current company data in 
         - profiles_list: The list of tensors from th
-        - profile_tensors: The list of tensors
+        - profile_tensors: The list of tensors, or one array of shape (rows, fields, dimension)
     """
 
-    all_talent_embedding = []
-
-    for curr_name in profile_tensors:
-        cosine = cosine_similarity(candidate_data, curr_name).mean(axis = 1).mean()
-        all_talent_embedding.append(cosine)
-    
-    profiles_list["Cosine"] = all_talent_embedding
+    engine = ScoringEngine(np.stack(profile_tensors) if isinstance(profile_tensors, list) else profile_tensors)
+    profiles_list["Cosine"] = engine.score(candidate_data)
 
     return profiles_list
 
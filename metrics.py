@@ -0,0 +1,142 @@
+"""
+The instrumentation of the interview and match hot paths, exported in the Prometheus format by the /metrics endpoint of app.py.
+
+Key Features:
+    - Time each stage of a request with span(stage): session load and save, agent construction, the turn, the evaluation update,
+      the index load, the embedding, the scoring and the reranking.
+    - Time each LLM call by agent and model, and count its prompt and completion tokens (see record_llm).
+    - Report the counters of the response cache and of the match query cache at scrape time.
+    - Log every span at debug level, so the timings are also available without a Prometheus server.
+
+The metrics need prometheus_client (in the requirements of the app). Without it the spans are only logged, so the interview and match
+packages keep running with their own requirements.
+
+With several gunicorn workers each process keeps its own metrics. To aggregate them, set PROMETHEUS_MULTIPROC_DIR to an empty directory
+before gunicorn starts: the workers then write their metrics there and /metrics reads them all (see gunicorn.conf.py).
+The cache counters are always those of the worker serving the scrape.
+"""
+
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Histogram
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+if prometheus_client is not None:
+    STAGE_SECONDS = Histogram("brainbank_stage_seconds", "The duration of each stage of the interview and match paths.", ["stage"],
+                              buckets = STAGE_BUCKETS)
+    LLM_SECONDS = Histogram("brainbank_llm_seconds", "The duration of each LLM call, until its last token or its failure, by outcome.",
+                            ["agent", "model", "outcome"], buckets = LLM_BUCKETS)
+    LLM_PROMPT_TOKENS = Histogram("brainbank_llm_prompt_tokens", "The prompt tokens of each LLM call.", ["agent", "model"],
+                                  buckets = TOKEN_BUCKETS)
+    LLM_TOKENS = Counter("brainbank_llm_tokens", "The tokens of the LLM calls, by kind (prompt or completion).", ["agent", "model", "kind"])
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the block as one stage. The duration is recorded even if the block raises.
+
+    Attributes:
+        - stage: The name of the stage, eg. session_load or embedding.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if prometheus_client is not None:
+            STAGE_SECONDS.labels(stage).observe(elapsed)
+        logging.debug("span %s %.1f ms", stage, elapsed * 1000)
+
+def record_llm(agent: str, model: str, seconds: float, usage: Optional[Dict], outcome: str = "ok") -> None:
+    """Record one LLM call.
+
+    Attributes:
+        - agent: The name of the agent, eg. Questioner.
+        - model: The model of the client.
+        - seconds: The duration of the call.
+        - usage: The usage_metadata of the response (input_tokens and output_tokens), or None if the client did not report it.
+        - outcome: ok, error or cancelled (eg. by the step timeout).
+    """
+
+    prompt = (usage or {}).get("input_tokens", 0)
+    completion = (usage or {}).get("output_tokens", 0)
+
+    if prometheus_client is not None:
+        LLM_SECONDS.labels(agent, model, outcome).observe(seconds)
+        if usage:
+            LLM_PROMPT_TOKENS.labels(agent, model).observe(prompt)
+            LLM_TOKENS.labels(agent, model, "prompt").inc(prompt)
+            LLM_TOKENS.labels(agent, model, "completion").inc(completion)
+    logging.debug("llm %s %s %s %.1f ms, %d prompt and %d completion tokens", agent, model, outcome, seconds * 1000, prompt, completion)
+
+
+class CacheCollector:
+    """
+    The CacheCollector class, which reads the counters of the caches of the process when /metrics is scraped.
+    A cache is only read if its module is already loaded, so that collecting never loads a model the process has not loaded.
+    """
+
+    def collect(self) -> Iterator[object]:
+        """Yield one metric per counter of the caches, labelled by cache: a counter for the lookups (hits, misses), a gauge otherwise."""
+
+        caches = []
+        if "interview.agents.cache" in sys.modules:
+            caches.append(("responses", sys.modules["interview.agents.cache"].get_cache()))
+        if "match.cache" in sys.modules:
+            caches.append(("queries", sys.modules["match.cache"].get_query_cache()))
+
+        families = {}
+        for name, cache in caches:
+            if cache is None:
+                continue
+            for stat, value in cache.stats().items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if stat not in families:
+                    if stat.endswith(("hits", "misses")): # Only ever grow, so rate() applies
+                        families[stat] = CounterMetricFamily(f"brainbank_cache_{stat}", f"The {stat} of the cache.", labels = ["cache"])
+                    else:
+                        families[stat] = GaugeMetricFamily(f"brainbank_cache_{stat}", f"The {stat} of the cache.", labels = ["cache"])
+                families[stat].add_metric([name], value)
+
+        yield from families.values()
+
+
+if prometheus_client is not None and not MULTIPROCESS_DIR:
+    prometheus_client.REGISTRY.register(CacheCollector())
+
+
+def exposition() -> Tuple[bytes, str]:
+    """Return the body and the content type of the /metrics response.
+
+    Raises:
+        - RuntimeError if prometheus_client is not installed.
+    """
+
+    if prometheus_client is None:
+        raise RuntimeError("The metrics require prometheus_client: pip install prometheus_client")
+
+    registry = prometheus_client.REGISTRY
+    if MULTIPROCESS_DIR:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry() # Read the metrics of every worker from the directory
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(CacheCollector())
+
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -35,17 +35,7 @@ class ChatInterface {
     // Start the Chat: Remove the name of the inputContainer so that people can start chatting
     async startChat () {
         //this.addMessage("Press 'Start' to start the interview.");
-        setTimeout(() => { // Get the First question
-                fetch("/get_response", {
-                    method: "POST",
-                    headers: {"Content-Type": "application/x-www-form-urlencoded" },
-                    body: `message=Start`
-                })
-                .then(response => response.json())
-                .then(data => {
-                    this.addMessage(data.question)
-                })
-            }, 1000)
+        setTimeout(() => this.streamQuestion("Start"), 1000) // Get the First question
             this.questionCount ++;
         this.inputContainer.classList.remove('hidden') 
     }
@@ -60,19 +50,7 @@ class ChatInterface {
         this.questionCount ++;
 
         if (this.questionCount < this.maxQuestions) {
-            setTimeout(() => { // Get the next question
-                    fetch("/get_response", {
-                        method: "POST",
-                        headers: {"Content-Type": "application/x-www-form-urlencoded" },
-                        body: `message=${userInput}`
-                    })
-                    .then(response => {
-                        return response.json();
-                    })
-                    .then(data => {
-                        this.addMessage(data.question);
-                    })
-            }, 1000); 
+            setTimeout(() => this.streamQuestion(userInput), 1000); // Get the next question
         } else {
             this.addMessage("You're all done! Press the 'View Results' button to view your results.")
             this.inputContainer.classList.add('hidden');
@@ -80,12 +58,71 @@ class ChatInterface {
         }
         }
     
+    // Stream the next question: the tokens are shown as they arrive from the Server-Sent Events of /stream_response
+    async streamQuestion (message) {
+        const response = await fetch("/stream_response", {
+            method: "POST",
+            headers: {"Content-Type": "application/x-www-form-urlencoded" },
+            body: new URLSearchParams({message: message})
+        });
+        const messageDiv = this.addMessage("");
+        if (!response.ok || !response.body) { // The stream could not start: ask for the whole question instead
+            return this.fetchQuestion(message, messageDiv);
+        }
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = "";
+
+        while (true) {
+            const {value, done} = await reader.read();
+            if (done) break;
+
+            buffer += value;
+            const events = buffer.split("\n\n");
+            buffer = events.pop(); // The last event may be incomplete
+
+            for (const event of events) {
+                const typeLine = event.match(/^event: (.*)$/m);
+                const dataLine = event.match(/^data: (.*)$/m);
+                if (!typeLine || !dataLine) continue; // Comments and keep-alives
+                const type = typeLine[1];
+                const data = JSON.parse(dataLine[1]);
+
+                if (type === "token") {
+                    messageDiv.textContent += data.token;
+                } else if (type === "done") {
+                    messageDiv.textContent = data.question;
+                } else if (type === "error") {
+                    messageDiv.textContent = "Sorry, something went wrong. Please try again.";
+                }
+                this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+            }
+        }
+    }
+
+    // Get the next question from /get_response in one piece, into the message already shown
+    async fetchQuestion (message, messageDiv) {
+        try {
+            const response = await fetch("/get_response", {
+                method: "POST",
+                headers: {"Content-Type": "application/x-www-form-urlencoded" },
+                body: new URLSearchParams({message: message})
+            });
+            if (!response.ok) throw new Error(response.status);
+            const data = await response.json();
+            messageDiv.textContent = data.question;
+        } catch (error) {
+            messageDiv.textContent = "Sorry, something went wrong. Please try again.";
+        }
+        this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+    }
+
     addMessage(content, type) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${type}-message`;
         messageDiv.textContent = content;
         this.chatMessages.appendChild(messageDiv);
         this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        return messageDiv;
     }
 
     // Results Showcase